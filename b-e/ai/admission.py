@@ -0,0 +1,195 @@
+"""
+Admission control for chat requests, shared by all workers.
+
+The Gemini quota is the hard ceiling of the deployment, so requests are
+admitted against token buckets kept in the shared state database before any
+work is done:
+
+- one bucket per client IP and one per chat session, refilled at
+  ADMISSION_CLIENT_RATE requests per minute up to ADMISSION_CLIENT_BURST;
+- one global bucket for requests that will call the LLM (answer cache hits
+  and coalesced duplicates don't), refilled at LLM_DAILY_QUOTA per day up to
+  ADMISSION_GLOBAL_BURST, so the quota is spread over the day instead of being
+  spent in a spike. LLM calls admitted per day are also capped at
+  LLM_DAILY_QUOTA.
+
+A request that would have a token within ADMISSION_MAX_WAIT seconds reserves
+it and waits (queued, in reservation order); otherwise it is rejected straight
+away with AdmissionRejected, which the views answer with 429 and Retry-After.
+All buckets of a request are checked and charged in one transaction, so a
+rejected request costs nothing.
+
+Client IPs come from REMOTE_ADDR, or from X-Forwarded-For when
+ADMISSION_TRUST_FORWARDED says a trusted proxy sets it.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+from . import shared_state
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS admission_buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS admission_days (
+    day TEXT PRIMARY KEY,
+    admitted INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+# Buckets untouched this long are full again and are deleted
+IDLE_BUCKET_SECONDS = 60 * 60
+# Seconds between deletions of idle buckets (per worker)
+CLEANUP_INTERVAL = 5 * 60
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted: retry after retry_after seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Rejected by the {reason} limit; retry in {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Bucket:
+    def __init__(self, key, per_second, burst):
+        self.key = key
+        self.per_second = per_second
+        self.burst = burst
+
+    @property
+    def kind(self):
+        return self.key.split(':', 1)[0]
+
+
+def client_ip(request):
+    if settings.ADMISSION_TRUST_FORWARDED:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded.strip():
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def seconds_until_tomorrow(now):
+    tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (tomorrow - now).total_seconds()
+
+
+class AdmissionController:
+    def __init__(self):
+        self._next_cleanup = 0.0
+
+    def client_buckets(self, request, session_id=None):
+        """The per-IP bucket and, for a chat session, its per-session bucket"""
+        per_second = settings.ADMISSION_CLIENT_RATE / 60
+        buckets = [Bucket(f"ip:{client_ip(request)}", per_second, settings.ADMISSION_CLIENT_BURST)]
+        if session_id:
+            buckets.append(Bucket(f"session:{session_id}", per_second, settings.ADMISSION_CLIENT_BURST))
+        return buckets
+
+    def quota_buckets(self):
+        """The global bucket that spreads LLM_DAILY_QUOTA over the day (none if unlimited)"""
+        if not settings.LLM_DAILY_QUOTA:
+            return []
+        return [Bucket('quota:global', settings.LLM_DAILY_QUOTA / 86400, settings.ADMISSION_GLOBAL_BURST)]
+
+    def reserve(self, buckets):
+        """
+        Take a token from every bucket, or none of them. Returns the seconds to
+        wait until the reserved tokens are due (0 if available now); raises
+        AdmissionRejected if that would be longer than ADMISSION_MAX_WAIT.
+        """
+        if not settings.ADMISSION_ENABLED or not buckets:
+            return 0.0
+        charge_day = any(bucket.kind == 'quota' for bucket in buckets)
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._cleanup(conn, now)
+            if charge_day:
+                today = datetime.now()
+                day = today.strftime('%Y-%m-%d')
+                row = conn.execute('SELECT admitted FROM admission_days WHERE day = ?', (day,)).fetchone()
+                if row is not None and row[0] >= settings.LLM_DAILY_QUOTA:
+                    raise AdmissionRejected('daily', seconds_until_tomorrow(today))
+            wait, reason, balances = 0.0, None, []
+            for bucket in buckets:
+                row = conn.execute('SELECT tokens, updated FROM admission_buckets WHERE key = ?',
+                                   (bucket.key,)).fetchone()
+                tokens = bucket.burst if row is None else \
+                    min(bucket.burst, row[0] + max(0.0, now - row[1]) * bucket.per_second)
+                balances.append((bucket, tokens))
+                bucket_wait = max(0.0, (1 - tokens) / bucket.per_second)
+                if bucket_wait > wait:
+                    wait, reason = bucket_wait, bucket.kind
+            if wait > settings.ADMISSION_MAX_WAIT:
+                raise AdmissionRejected(reason, wait)
+            # Reserve: a bucket may go below zero, which queues the next caller behind this one
+            conn.executemany(
+                'INSERT INTO admission_buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                [(bucket.key, tokens - 1, now) for bucket, tokens in balances],
+            )
+            if charge_day:
+                conn.execute(
+                    'INSERT INTO admission_days (day, admitted) VALUES (?, 1) '
+                    'ON CONFLICT(day) DO UPDATE SET admitted = admitted + 1',
+                    (day,),
+                )
+            conn.execute('COMMIT')
+        except AdmissionRejected as rejected:
+            conn.execute('ROLLBACK')
+            shared_state.increment(f"admission:rejected:{rejected.reason}")
+            raise
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        shared_state.increment('admission:queued' if wait else 'admission:admitted')
+        return wait
+
+    def admit(self, buckets):
+        """Admit a sync request, waiting up to ADMISSION_MAX_WAIT for its turn"""
+        wait = self.reserve(buckets)
+        if wait:
+            time.sleep(wait)
+
+    async def aadmit(self, buckets):
+        """Async admit: the queued wait doesn't block the event loop"""
+        wait = await asyncio.to_thread(self.reserve, buckets)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def _cleanup(self, conn, now):
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + CLEANUP_INTERVAL
+        conn.execute('DELETE FROM admission_buckets WHERE updated < ?', (now - IDLE_BUCKET_SECONDS,))
+        conn.execute('DELETE FROM admission_days WHERE day < ?',
+                     ((datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),))
+
+    def stats(self):
+        """Admission outcomes so far and today's use of the daily LLM budget"""
+        conn = shared_state.connection(SCHEMA)
+        row = conn.execute('SELECT admitted FROM admission_days WHERE day = ?',
+                           (datetime.now().strftime('%Y-%m-%d'),)).fetchone()
+        counts = shared_state.counters('admission:')
+        return {
+            'enabled': settings.ADMISSION_ENABLED,
+            'admitted': counts.get('admission:admitted', 0),
+            'queued': counts.get('admission:queued', 0),
+            'rejected': {name.rsplit(':', 1)[1]: value for name, value in counts.items()
+                         if name.startswith('admission:rejected:')},
+            'daily_quota': settings.LLM_DAILY_QUOTA,
+            'llm_calls_admitted_today': row[0] if row else 0,
+        }
+
+
+admission = AdmissionController()
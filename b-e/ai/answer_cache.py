@@ -0,0 +1,113 @@
+"""
+Cache of voiced answers keyed by normalized question.
+
+Repeated questions (including the chat page's replay and edit-and-resend
+buttons, which re-POST the same text) are answered from the shared state
+database instead of calling Gemini and edge-tts again. Entries expire after
+ANSWER_CACHE_TTL seconds and the least recently used ones are evicted once
+ANSWER_CACHE_MAX_ENTRIES is exceeded. Hits and misses are counted across all
+workers.
+"""
+
+import hashlib
+import json
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from . import audio_store, shared_state
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS answer_cache (
+    key TEXT PRIMARY KEY,
+    question TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    audio_digest TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answer_cache_last_used ON answer_cache (last_used);
+'''
+
+WHITESPACE = re.compile(r'\s+')
+EDGE_PUNCTUATION = re.compile(r'^[\s.!?,;:"\']+|[\s.!?,;:"\']+$')
+
+
+def normalize_question(question):
+    """Case-fold, collapse whitespace and drop surrounding punctuation"""
+    question = WHITESPACE.sub(' ', question.casefold())
+    return EDGE_PUNCTUATION.sub('', question)
+
+
+class AnswerCache:
+    """Shared TTL + LRU cache of chat response payloads"""
+
+    def __init__(self, namespace=''):
+        # The namespace (e.g. the model name) keeps answers from different models apart
+        self.namespace = namespace
+
+    def key(self, question):
+        normalized = normalize_question(question)
+        return hashlib.sha256(f"{self.namespace}\n{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, question):
+        """Return the cached response payload, or None on a miss"""
+        key = self.key(question)
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        row = conn.execute(
+            'SELECT payload, audio_digest FROM answer_cache WHERE key = ? AND created > ?',
+            (key, now - settings.ANSWER_CACHE_TTL),
+        ).fetchone()
+        # The clip may have been evicted from the audio store; then the entry is useless
+        if row is None or not audio_store.exists(row[1]):
+            if row is not None:
+                conn.execute('DELETE FROM answer_cache WHERE key = ?', (key,))
+            shared_state.increment('answer_cache.misses')
+            return None
+        conn.execute('UPDATE answer_cache SET last_used = ? WHERE key = ?', (now, key))
+        shared_state.increment('answer_cache.hits')
+        return json.loads(row[0])
+
+    def put(self, question, payload):
+        """Store a response payload and evict expired / least recently used entries"""
+        audio_digest = Path(payload['filename']).stem  # Content-addressed clip name
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO answer_cache (key, question, payload, audio_digest, created, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.key(question), normalize_question(question), json.dumps(payload), audio_digest, now, now),
+            )
+            conn.execute('DELETE FROM answer_cache WHERE created <= ?', (now - settings.ANSWER_CACHE_TTL,))
+            evicted = conn.execute(
+                'DELETE FROM answer_cache WHERE key IN '
+                '(SELECT key FROM answer_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (settings.ANSWER_CACHE_MAX_ENTRIES,),
+            ).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if evicted:
+            shared_state.increment('answer_cache.evictions', evicted)
+
+    def stats(self):
+        """Hit/miss counters and current size, for capacity planning"""
+        conn = shared_state.connection(SCHEMA)
+        counts = shared_state.counters('answer_cache.')
+        hits = counts.get('answer_cache.hits', 0)
+        misses = counts.get('answer_cache.misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': counts.get('answer_cache.evictions', 0),
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'entries': conn.execute('SELECT COUNT(*) FROM answer_cache').fetchone()[0],
+            'max_entries': settings.ANSWER_CACHE_MAX_ENTRIES,
+            'ttl_seconds': settings.ANSWER_CACHE_TTL,
+        }
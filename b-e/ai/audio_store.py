@@ -0,0 +1,291 @@
+"""
+Content-addressed, size-bounded store for generated speech.
+
+Each clip lives at generated_audio/<sha256>.mp3, so it has a stable,
+immutable URL (/ai/audio/<sha256>.mp3) that browsers can cache and
+range-request instead of receiving base64 audio inside the chat JSON.
+
+TTS output arrives in memory (TTSModule.synthesize) and is handed to
+store_bytes, which hashes it and returns the digest straight away. With
+AUDIO_STORE_ASYNC_WRITES the file is written by a background writer thread;
+until it lands the clip is served from memory (pending_clip), so the request
+path does no filesystem work at all. Queued clips are also listed in shared
+state, so another worker asked for one waits briefly for the file (wait_for)
+while unknown digests get an immediate 404.
+
+Writers never share a file name: clips go to a unique temporary file
+(new_temp_path) and are renamed into place atomically once complete, so a
+half-written clip is never served and concurrent requests can't overwrite each
+other. The directory is kept within AUDIO_STORE_MAX_BYTES and
+AUDIO_STORE_MAX_AGE by evicting the least recently used clips (a clip's mtime
+is refreshed whenever it is served).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+
+from . import shared_state
+
+logger = logging.getLogger(__name__)
+
+AUDIO_DIR = Path(__file__).parent / "generated_audio"
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+TEMP_SUFFIX = '.part'
+# Temporary files older than this were abandoned by a crashed writer
+STALE_TEMP_AGE = 60 * 60
+
+# Seconds the audio view waits for a clip another worker is still writing
+WRITE_WAIT = 1.0
+WRITE_POLL_INTERVAL = 0.05
+# Queued writes older than this were abandoned by a crashed worker
+STALE_PENDING_AGE = 60
+
+# Clips queued for a background write, visible to every worker: the audio view
+# only waits for a digest that is listed here (or pending in its own process)
+PENDING_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS audio_pending (
+    digest TEXT PRIMARY KEY,
+    queued REAL NOT NULL
+);
+'''
+
+_evict_lock = threading.Lock()
+_next_eviction = 0.0
+
+_ready_dirs = set()
+_pending_lock = threading.Lock()
+_pending = {}  # digest -> clip bytes queued for the background writer
+_writer = None
+
+
+def _ensure_dir(directory):
+    """Create the audio directory once per process instead of on every write"""
+    if directory not in _ready_dirs:
+        directory.mkdir(exist_ok=True)
+        _ready_dirs.add(directory)
+    return directory
+
+
+def new_temp_path(directory=None):
+    """A unique path to write a clip to before it is stored"""
+    return _ensure_dir(directory or AUDIO_DIR) / f"speech-{uuid.uuid4().hex}{TEMP_SUFFIX}"
+
+
+def store_file(path):
+    """Move a freshly written clip to its content-addressed name; returns the digest"""
+    path = Path(path)
+    digest = hashlib.sha256(path.read_bytes()).hexdigest()
+    target = AUDIO_DIR / f"{digest}.mp3"
+    if target.exists():
+        path.unlink()  # Identical clip already stored
+        touch(digest)
+    else:
+        os.replace(path, target)  # Atomic: readers see the whole clip or nothing
+    maybe_evict()
+    return digest
+
+
+def store_bytes(data, wait=None):
+    """
+    Store an in-memory clip under its content hash; returns the digest.
+    Unless `wait` is true (default: not AUDIO_STORE_ASYNC_WRITES) the write
+    happens on the background writer and the clip is served from memory until
+    it is on disk.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    if digest in _pending:
+        return digest  # Identical clip already queued
+    if audio_path(digest) is not None:
+        touch(digest)  # Identical clip already stored
+        return digest
+
+    if wait is None:
+        wait = not settings.AUDIO_STORE_ASYNC_WRITES
+    if wait:
+        _write(digest, data, AUDIO_DIR)
+        return digest
+
+    global _writer
+    with _pending_lock:
+        if digest in _pending:
+            return digest
+        # Listed before the write is queued, so other workers know to wait for it
+        shared_state.connection(PENDING_SCHEMA).execute(
+            'INSERT OR REPLACE INTO audio_pending (digest, queued) VALUES (?, ?)', (digest, time.time())
+        )
+        _pending[digest] = data
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-store')
+    _writer.submit(_write_pending, digest, data, AUDIO_DIR)
+    return digest
+
+
+def _write(digest, data, directory):
+    """Write a clip to a temp file and rename it to its content-addressed name"""
+    temp_path = new_temp_path(directory)
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, directory / f"{digest}.mp3")
+    maybe_evict()
+
+
+def _write_pending(digest, data, directory):
+    try:
+        _write(digest, data, directory)
+    except Exception as e:
+        logger.error(f"Writing audio clip {digest} failed: {e}")
+    finally:
+        with _pending_lock:
+            _pending.pop(digest, None)
+        shared_state.connection(PENDING_SCHEMA).execute('DELETE FROM audio_pending WHERE digest = ?', (digest,))
+
+
+def flush():
+    """Block until every queued clip has been written"""
+    if _writer is not None:
+        _writer.submit(lambda: None).result()
+
+
+def pending_clip(digest):
+    """The bytes of a clip this process has not finished writing, or None"""
+    return _pending.get(digest)
+
+
+def exists(digest):
+    """Whether a clip can be served (still in memory or on disk)"""
+    return digest in _pending or audio_path(digest) is not None
+
+
+def is_pending(digest):
+    """Whether this or another worker has queued the clip and not yet written it"""
+    if digest in _pending:
+        return True
+    row = shared_state.connection(PENDING_SCHEMA).execute(
+        'SELECT 1 FROM audio_pending WHERE digest = ? AND queued > ?', (digest, time.time() - STALE_PENDING_AGE)
+    ).fetchone()
+    return row is not None
+
+
+def wait_for(digest, timeout=WRITE_WAIT):
+    """
+    Path of a clip that may still be being written by another worker, polling
+    for up to `timeout` seconds; None if it never appears. Digests no worker
+    is writing are answered at once, so unknown URLs can't tie up a thread.
+    """
+    if not DIGEST_PATTERN.match(digest):
+        return None
+    path = audio_path(digest)
+    if path is not None or not is_pending(digest):
+        return path
+    deadline = time.monotonic() + timeout
+    while True:
+        path = audio_path(digest)
+        if path is not None or time.monotonic() >= deadline:
+            return path
+        time.sleep(WRITE_POLL_INTERVAL)
+
+
+def audio_path(digest):
+    """Path of a stored clip, or None if the digest is malformed or unknown"""
+    if not DIGEST_PATTERN.match(digest):
+        return None
+    path = AUDIO_DIR / f"{digest}.mp3"
+    return path if path.is_file() else None
+
+
+def audio_url(digest):
+    """Relative URL the frontend prefixes with the API base URL"""
+    return reverse('audio', kwargs={'digest': digest})
+
+
+def touch(digest):
+    """Mark a clip as recently used so eviction keeps it"""
+    try:
+        os.utime(AUDIO_DIR / f"{digest}.mp3")
+    except FileNotFoundError:
+        pass
+
+
+def _scan():
+    """(mtime, size, path) of every stored clip, plus abandoned temp files"""
+    clips, stale_temps = [], []
+    now = time.time()
+    try:
+        entries = list(os.scandir(AUDIO_DIR))
+    except FileNotFoundError:
+        return clips, stale_temps
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue  # Evicted or renamed by another worker meanwhile
+        if entry.name.endswith('.mp3'):
+            clips.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        elif entry.name.endswith(TEMP_SUFFIX) and now - stat.st_mtime > STALE_TEMP_AGE:
+            stale_temps.append(Path(entry.path))
+    return clips, stale_temps
+
+
+def evict():
+    """Delete expired clips, then least recently used ones until within the size budget"""
+    clips, stale_temps = _scan()
+    for path in stale_temps:
+        path.unlink(missing_ok=True)
+    shared_state.connection(PENDING_SCHEMA).execute(
+        'DELETE FROM audio_pending WHERE queued <= ?', (time.time() - STALE_PENDING_AGE,)
+    )
+
+    cutoff = time.time() - settings.AUDIO_STORE_MAX_AGE
+    total = sum(size for _, size, _ in clips)
+    evicted_files = evicted_bytes = 0
+    for mtime, size, path in sorted(clips):  # Oldest (least recently used) first
+        if mtime >= cutoff and total <= settings.AUDIO_STORE_MAX_BYTES:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass  # Another worker got there first
+        else:
+            evicted_files += 1
+            evicted_bytes += size
+        total -= size
+    if evicted_files:
+        shared_state.increment('audio_store.evicted_files', evicted_files)
+        shared_state.increment('audio_store.evicted_bytes', evicted_bytes)
+    return evicted_files
+
+
+def maybe_evict():
+    """Run eviction at most once per AUDIO_STORE_EVICT_INTERVAL in this process"""
+    global _next_eviction
+    now = time.time()
+    with _evict_lock:
+        if now < _next_eviction:
+            return
+        _next_eviction = now + settings.AUDIO_STORE_EVICT_INTERVAL
+    evict()
+
+
+def stats():
+    """Bytes and files held, budget, and eviction counters (all workers)"""
+    clips, _ = _scan()
+    counts = shared_state.counters('audio_store.')
+    return {
+        'files': len(clips),
+        'bytes': sum(size for _, size, _ in clips),
+        'max_bytes': settings.AUDIO_STORE_MAX_BYTES,
+        'max_age_seconds': settings.AUDIO_STORE_MAX_AGE,
+        'evicted_files': counts.get('audio_store.evicted_files', 0),
+        'evicted_bytes': counts.get('audio_store.evicted_bytes', 0),
+    }
@@ -0,0 +1,115 @@
+"""
+Gemini context caching for the system prompt.
+
+The system prompt used to be pasted in front of every question, so each call
+re-sent and re-processed the same ~4 KB prefix. It now travels as the
+request's system instruction, and is registered once with Gemini's context
+cache (client.caches): requests then reference the cached content by name
+instead of carrying the prompt. The cache entry is keyed by the rendered
+prompt text, so an edited prompt file or a new {current_date} gets a fresh
+entry, and it is renewed shortly before its LLM_CONTEXT_CACHE_TTL runs out.
+Superseded entries are left to expire rather than deleted under requests that
+may still reference them.
+
+Gemini only caches prompts above a model-specific minimum size; if creating
+the entry fails for that or any other reason, requests carry the prompt as a
+plain system instruction and creation is retried after RETRY_INTERVAL.
+Each worker process keeps its own entry. Creating it is a network call, made
+outside the lock by one request at a time; requests arriving meanwhile keep
+using the entry being renewed, or send the prompt inline.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Renew the cached content this long before it expires
+REFRESH_MARGIN = 60
+# Seconds before retrying after Gemini refused to cache a prompt
+RETRY_INTERVAL = 600
+
+
+class ContextCache:
+    def __init__(self, caches, model):
+        """
+        caches is the google-genai client's `caches` API (MockLLM emulates it);
+        model is the model the cached content is created for.
+        """
+        self.caches = caches
+        self.model = model
+        self._lock = threading.Lock()
+        self._key = None
+        self._name = None
+        self._refresh_at = 0.0
+        self._retry_at = 0.0
+        self._creating = set()  # Keys whose entry is being created
+        self._counts = {'created': 0, 'hits': 0, 'uncached': 0, 'errors': 0}
+
+    def generation_config(self, system_prompt):
+        """Per-request generation_config that carries the system prompt"""
+        if not system_prompt:
+            return {}
+        name = self.cached_name(system_prompt) if settings.LLM_CONTEXT_CACHE else None
+        if name is None:
+            return {'system_instruction': system_prompt}
+        return {'cached_content': name}
+
+    def cached_name(self, system_prompt):
+        """Name of the cached content holding system_prompt, or None if it can't be cached"""
+        key = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            if key == self._key:
+                if self._name is not None and now < self._refresh_at:
+                    self._counts['hits'] += 1
+                    return self._name
+                if self._name is None and now < self._retry_at:
+                    self._counts['uncached'] += 1
+                    return None
+            if key in self._creating:
+                # Another request is creating the entry: use the one being
+                # renewed (still valid for REFRESH_MARGIN), or send the prompt
+                if key == self._key and self._name is not None:
+                    self._counts['hits'] += 1
+                    return self._name
+                self._counts['uncached'] += 1
+                return None
+            self._creating.add(key)
+
+        # A network call, so made without holding the lock
+        ttl = settings.LLM_CONTEXT_CACHE_TTL
+        try:
+            cached = self.caches.create(model=self.model, config={
+                'system_instruction': system_prompt,
+                'ttl': f"{ttl}s",
+                'display_name': f"red-queen-system-prompt-{key[:12]}",
+            })
+        except Exception as e:
+            logger.warning(f"Context caching unavailable, sending the system prompt with each request: {e}")
+            with self._lock:
+                self._creating.discard(key)
+                self._key, self._name, self._retry_at = key, None, now + RETRY_INTERVAL
+                self._counts['errors'] += 1
+                self._counts['uncached'] += 1
+            return None
+
+        with self._lock:
+            self._creating.discard(key)
+            self._key, self._name = key, cached.name
+            self._refresh_at = now + max(ttl - REFRESH_MARGIN, ttl / 2)
+            self._counts['created'] += 1
+            return cached.name
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': settings.LLM_CONTEXT_CACHE,
+                'cached_content': self._name,
+                'ttl_seconds': settings.LLM_CONTEXT_CACHE_TTL,
+                **self._counts,
+            }
@@ -0,0 +1,227 @@
+"""
+Server-side conversation memory, keyed by the client's session id.
+
+Each chat turn of a session is stored in the shared state database, so any
+worker can continue the conversation. The history that goes into the prompt
+is bounded: at most CONVERSATION_MAX_TURNS recent turns are kept verbatim,
+and only as many as fit in CONVERSATION_TOKEN_BUDGET together with the
+summary. Older turns are folded into a rolling summary - one line per turn,
+appended when the turn leaves the window, with the oldest lines dropped once
+the summary exceeds CONVERSATION_SUMMARY_TOKENS. The summary is extractive, so
+keeping it up to date costs no LLM call, and compaction happens when a turn is
+recorded, so reading the context only selects rows.
+
+Turns are numbered from 1 within a session and each summary line keeps the
+number of its turn. The chat views return the number of the turn they
+recorded; a client that edits an earlier question sends it back as
+replaces_turn, and that turn and everything after it are forgotten (verbatim
+or summarized) before the edited question is answered.
+
+Tokens are estimated at four characters each, close enough for budgeting.
+"""
+
+import math
+import re
+import time
+
+from django.conf import settings
+
+from . import shared_state
+from .segmenter import sentence_spans
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS conversation_sessions (
+    session_id TEXT PRIMARY KEY,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversation_sessions_updated ON conversation_sessions (updated);
+CREATE TABLE IF NOT EXISTS conversation_turns (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+CREATE TABLE IF NOT EXISTS conversation_summary (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (session_id, seq)
+);
+'''
+
+# Session ids are the only thing guarding a conversation, so clients must send
+# unguessable ones: 22-128 URL-safe characters, e.g. crypto.randomUUID() or
+# secrets.token_urlsafe(). Short or numeric ids such as timestamps are refused
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{22,128}')
+# Characters of the question and answer kept in a summary line
+SUMMARY_CLIP_CHARS = 160
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / 4)
+
+
+def clip(text, limit=SUMMARY_CLIP_CHARS):
+    text = ' '.join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + '…'
+
+
+def summary_line(question, answer):
+    """One summary line for a turn: the question and the answer's first sentence"""
+    start, end = sentence_spans(answer)[0]
+    return f"- Asked: {clip(question)} Answered: {clip(answer[start:end])}"
+
+
+def format_turn(question, answer):
+    return f"User: {question}\nRed Queen: {answer}"
+
+
+def session_key(value):
+    """The session id from a request payload, or None if absent or not in the accepted format"""
+    if isinstance(value, str) and SESSION_ID_PATTERN.fullmatch(value):
+        return value
+    return None
+
+
+def turn_number(value):
+    """A turn number from a request payload, or None if absent or invalid"""
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return None
+
+
+class ConversationContext:
+    """The part of a session's history that goes into the next prompt"""
+
+    def __init__(self, summary='', turns=()):
+        self.summary = summary
+        self.turns = list(turns)  # (question, answer), oldest first
+
+    def __bool__(self):
+        return bool(self.summary or self.turns)
+
+    def render(self):
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation:\n{self.summary}")
+        if self.turns:
+            recent = '\n\n'.join(format_turn(question, answer) for question, answer in self.turns)
+            parts.append(f"Recent conversation:\n{recent}")
+        return '\n\n'.join(parts)
+
+    def tokens(self):
+        return estimate_tokens(self.render())
+
+
+class ConversationStore:
+    def context(self, session_id):
+        """The summary and recent turns of a session (empty for a new session)"""
+        conn = shared_state.connection(SCHEMA)
+        row = conn.execute(
+            'SELECT 1 FROM conversation_sessions WHERE session_id = ? AND updated > ?',
+            (session_id, time.time() - settings.CONVERSATION_TTL),
+        ).fetchone()
+        if row is None:
+            return ConversationContext()
+        lines = conn.execute(
+            'SELECT line FROM conversation_summary WHERE session_id = ? ORDER BY seq', (session_id,)
+        ).fetchall()
+        turns = conn.execute(
+            'SELECT question, answer FROM conversation_turns WHERE session_id = ? ORDER BY seq',
+            (session_id,),
+        ).fetchall()
+        return ConversationContext('\n'.join(line for line, in lines), turns)
+
+    def record(self, session_id, question, answer):
+        """
+        Append a turn, folding turns that no longer fit the window into the
+        summary; returns the turn's number
+        """
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._expire(conn, now)
+            seq = conn.execute(
+                'SELECT COALESCE(MAX(seq), 0) + 1 FROM (SELECT seq FROM conversation_turns WHERE session_id = ? '
+                'UNION ALL SELECT seq FROM conversation_summary WHERE session_id = ?)',
+                (session_id, session_id),
+            ).fetchone()[0]
+            conn.execute(
+                'INSERT INTO conversation_turns (session_id, seq, question, answer, tokens) VALUES (?, ?, ?, ?, ?)',
+                (session_id, seq, question, answer, estimate_tokens(format_turn(question, answer))),
+            )
+            self._compact(conn, session_id)
+            conn.execute(
+                'INSERT INTO conversation_sessions (session_id, updated) VALUES (?, ?) '
+                'ON CONFLICT(session_id) DO UPDATE SET updated = excluded.updated',
+                (session_id, now),
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return seq
+
+    def _compact(self, conn, session_id):
+        """Keep the newest turns that fit the window and summarize the rest"""
+        turns = conn.execute(
+            'SELECT seq, question, answer, tokens FROM conversation_turns WHERE session_id = ? ORDER BY seq DESC',
+            (session_id,),
+        ).fetchall()
+        kept = 0
+        used = 0
+        for seq, question, answer, tokens in turns:
+            # The summary may grow by one line per folded turn; budget for its cap
+            if kept >= settings.CONVERSATION_MAX_TURNS or (
+                    used + tokens + settings.CONVERSATION_SUMMARY_TOKENS > settings.CONVERSATION_TOKEN_BUDGET):
+                break
+            kept += 1
+            used += tokens
+        folded = turns[kept:]
+        if not folded:
+            return
+        conn.executemany(
+            'INSERT INTO conversation_summary (session_id, seq, line) VALUES (?, ?, ?)',
+            [(session_id, seq, summary_line(question, answer)) for seq, question, answer, _ in folded],
+        )
+        conn.execute(
+            'DELETE FROM conversation_turns WHERE session_id = ? AND seq <= ?', (session_id, folded[0][0])
+        )
+        lines = conn.execute(
+            'SELECT seq, line FROM conversation_summary WHERE session_id = ? ORDER BY seq', (session_id,)
+        ).fetchall()
+        while len(lines) > 1 and estimate_tokens('\n'.join(line for _, line in lines)) > settings.CONVERSATION_SUMMARY_TOKENS:
+            lines.pop(0)
+        conn.execute(
+            'DELETE FROM conversation_summary WHERE session_id = ? AND seq < ?', (session_id, lines[0][0])
+        )
+
+    def _expire(self, conn, now):
+        expired = now - settings.CONVERSATION_TTL
+        for table in ('conversation_turns', 'conversation_summary'):
+            conn.execute(
+                f'DELETE FROM {table} WHERE session_id IN '
+                '(SELECT session_id FROM conversation_sessions WHERE updated <= ?)',
+                (expired,),
+            )
+        conn.execute('DELETE FROM conversation_sessions WHERE updated <= ?', (expired,))
+
+    def forget(self, session_id, from_turn=None):
+        """Delete a session's history, or only turn from_turn and the turns after it"""
+        conn = shared_state.connection(SCHEMA)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for table in ('conversation_turns', 'conversation_summary'):
+                conn.execute(f'DELETE FROM {table} WHERE session_id = ? AND seq >= ?', (session_id, from_turn or 0))
+            if from_turn is None:
+                conn.execute('DELETE FROM conversation_sessions WHERE session_id = ?', (session_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+conversations = ConversationStore()
@@ -0,0 +1,289 @@
+"""
+Deadline-aware routing of LLM calls across the configured Gemini models.
+
+The router stands in for a single llama-index LLM (complete, acomplete and
+stream_complete) but holds one client per model in ai.utils.modelTypes, the
+chosen model first. Every call has an overall LLM_DEADLINE and each model
+attempt at most LLM_ATTEMPT_TIMEOUT of it; when a model times out or reports
+exhausted quota (429 / RESOURCE_EXHAUSTED) the call fails over to the next
+model instead of sleeping and retrying the same one. Other errors are raised
+to the caller unchanged.
+
+Models are tried in configured order, adjusted by what recent calls showed:
+a model that just timed out or ran out of quota cools down for
+LLM_FAILURE_COOLDOWN / LLM_QUOTA_COOLDOWN seconds and goes to the back, and
+one whose recent p95 latency exceeds LLM_SLOW_LATENCY goes behind the fast
+ones. Streams fail over only until their first chunk arrives. Their time to
+first chunk is kept apart from the latency of whole calls (a stream's full
+length depends on the answer and on how fast the client reads it); either
+one's p95 above LLM_SLOW_LATENCY marks the model slow.
+
+Sync attempts run on a small thread pool so they can be timed out; an
+abandoned attempt finishes in the background and its answer is discarded.
+Each attempt is recorded in the usage meter under the model that made it.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+from .context_cache import ContextCache
+from .metering import usage_meter
+from .percentiles import percentile
+from .resilience import Resilient
+
+# Threads for sync attempts (abandoned attempts hold one until they finish)
+ATTEMPT_THREADS = 16
+# Recent successful latencies per model (whole calls, and streams' time to
+# first chunk), and how long they stay relevant
+LATENCY_WINDOW = 50
+LATENCY_MAX_AGE = 300
+# Samples needed before a model can be judged slow
+MIN_SAMPLES = 5
+
+
+def is_quota_error(e):
+    """True if an LLM exception means the Gemini quota is exhausted"""
+    error_str = str(e)
+    return "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "quota exceeded" in error_str.lower()
+
+
+class ModelRoute:
+    """One model of the chain: its client, context cache and recent health"""
+
+    def __init__(self, llm, caches):
+        self.llm = llm
+        self.name = llm.model
+        self.context_cache = ContextCache(caches, self.name)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)  # (recorded at, seconds)
+        self._first_chunk_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.cooldown_until = 0.0
+        self.counts = {'calls': 0, 'errors': 0, 'timeouts': 0, 'quota_errors': 0}
+
+    def call_kwargs(self, system_prompt, kwargs):
+        """kwargs for this model's client, with the system prompt in its generation_config"""
+        generation_config = {**self.context_cache.generation_config(system_prompt),
+                             **kwargs.get('generation_config', {})}
+        return {**kwargs, 'generation_config': generation_config} if generation_config else kwargs
+
+    @staticmethod
+    def recent(samples, now):
+        return [latency for at, latency in samples if now - at < LATENCY_MAX_AGE]
+
+    def is_slow(self, now):
+        return any(
+            len(latencies) >= MIN_SAMPLES and percentile(latencies, 95) > settings.LLM_SLOW_LATENCY
+            for latencies in (self.recent(self._latencies, now), self.recent(self._first_chunk_latencies, now))
+        )
+
+    def record_success(self, latency):
+        """A whole call that succeeded after latency seconds"""
+        with self._lock:
+            self.counts['calls'] += 1
+            self._latencies.append((time.monotonic(), latency))
+        usage_meter.record(self.name, latency)
+
+    def record_first_chunk(self, latency):
+        """A stream whose first chunk arrived after latency seconds"""
+        with self._lock:
+            self.counts['calls'] += 1
+            self._first_chunk_latencies.append((time.monotonic(), latency))
+
+    def record_stream_end(self, latency, error=False):
+        """A stream started by record_first_chunk ended latency seconds after the call"""
+        usage_meter.record(self.name, latency, error=error)
+
+    def record_failure(self, latency, kind=None):
+        """kind is 'timeout' or 'quota' for failures that fail over, None otherwise"""
+        with self._lock:
+            self.counts['calls'] += 1
+            self.counts['errors'] += 1
+            if kind == 'timeout':
+                self.counts['timeouts'] += 1
+                self.cooldown_until = time.monotonic() + settings.LLM_FAILURE_COOLDOWN
+            elif kind == 'quota':
+                self.counts['quota_errors'] += 1
+                self.cooldown_until = time.monotonic() + settings.LLM_QUOTA_COOLDOWN
+        usage_meter.record(self.name, latency, error=True)
+
+    def stats(self, now):
+        latencies = self.recent(self._latencies, now)
+        first_chunk_latencies = self.recent(self._first_chunk_latencies, now)
+        with self._lock:
+            stats = {
+                **self.counts,
+                'cooling_down_seconds': round(max(0.0, self.cooldown_until - now), 1),
+                'slow': self.is_slow(now),
+            }
+        for pct in (50, 95):
+            stats[f'latency_p{pct}'] = round(percentile(latencies, pct), 3) if latencies else None
+            stats[f'first_chunk_p{pct}'] = (
+                round(percentile(first_chunk_latencies, pct), 3) if first_chunk_latencies else None
+            )
+        stats['context_cache'] = self.context_cache.stats()
+        return stats
+
+
+class LLMRouter:
+    def __init__(self, routes):
+        self.routes = routes
+        self.model = routes[0].name  # The preferred model names the service
+        self._executor = ThreadPoolExecutor(max_workers=ATTEMPT_THREADS, thread_name_prefix='llm')
+        self._lock = threading.Lock()
+        self._counts = {'requests': 0, 'failovers': 0, 'exhausted': 0}
+
+    def ordered_routes(self):
+        """Routes to try for the next call: healthy, then slow, then cooling down"""
+        now = time.monotonic()
+        return sorted(self.routes, key=lambda route: (now < route.cooldown_until, route.is_slow(now)))
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _attempts(self):
+        """(route, timeout) for each model to try, within the call's deadline"""
+        self._count('requests')
+        deadline = time.monotonic() + settings.LLM_DEADLINE
+        for i, route in enumerate(self.ordered_routes()):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if i:
+                self._count('failovers')
+            yield route, min(remaining, settings.LLM_ATTEMPT_TIMEOUT)
+        self._count('exhausted')
+
+    @staticmethod
+    def _failover_kind(error):
+        if isinstance(error, (TimeoutError, asyncio.TimeoutError, FutureTimeout)):
+            return 'timeout'
+        if is_quota_error(error):
+            return 'quota'
+        return None
+
+    def _failed(self, route, started, error):
+        """Record a failed attempt; re-raise it unless it should fail over"""
+        kind = self._failover_kind(error)
+        route.record_failure(time.monotonic() - started, kind)
+        if kind is None:
+            raise error
+        if kind == 'timeout':
+            return TimeoutError(f"{route.name} did not answer in time")
+        return error
+
+    def complete(self, prompt, system_prompt=None, **kwargs):
+        error = TimeoutError("LLM deadline exceeded")
+        for route, timeout in self._attempts():
+            started = time.monotonic()
+            future = self._executor.submit(route.llm.complete, prompt, **route.call_kwargs(system_prompt, kwargs))
+            try:
+                result = future.result(timeout=timeout)
+            except Exception as e:
+                error = self._failed(route, started, e)
+                continue
+            route.record_success(time.monotonic() - started)
+            return result
+        raise error
+
+    async def acomplete(self, prompt, system_prompt=None, **kwargs):
+        error = TimeoutError("LLM deadline exceeded")
+        for route, timeout in self._attempts():
+            started = time.monotonic()
+            try:
+                # Creating the context cache entry is a blocking call
+                call_kwargs = await asyncio.to_thread(route.call_kwargs, system_prompt, kwargs)
+                result = await asyncio.wait_for(route.llm.acomplete(prompt, **call_kwargs), timeout)
+            except Exception as e:
+                error = self._failed(route, started, e)
+                continue
+            route.record_success(time.monotonic() - started)
+            return result
+        raise error
+
+    def stream_complete(self, prompt, system_prompt=None, **kwargs):
+        """Stream from the first model that starts answering within its timeout"""
+        error = TimeoutError("LLM deadline exceeded")
+        for route, timeout in self._attempts():
+            started = time.monotonic()
+            try:
+                stream = route.llm.stream_complete(prompt, **route.call_kwargs(system_prompt, kwargs))
+                first = self._executor.submit(next, stream, None).result(timeout=timeout)
+            except Exception as e:
+                error = self._failed(route, started, e)
+                continue
+            route.record_first_chunk(time.monotonic() - started)
+            failed = False
+            try:
+                if first is not None:
+                    yield first
+                yield from stream
+            except Exception:
+                failed = True
+                raise
+            finally:
+                route.record_stream_end(time.monotonic() - started, error=failed)
+            return
+        raise error
+
+    async def astream_complete(self, prompt, system_prompt=None, **kwargs):
+        """
+        Async stream_complete: like GoogleGenAI.astream_complete, awaiting it
+        returns an async generator of chunks, from the first model that starts
+        answering within its timeout
+        """
+        error = TimeoutError("LLM deadline exceeded")
+        for route, timeout in self._attempts():
+            started = time.monotonic()
+            try:
+                call_kwargs = await asyncio.to_thread(route.call_kwargs, system_prompt, kwargs)
+                stream, first = await asyncio.wait_for(self._astart(route.llm, prompt, call_kwargs), timeout)
+            except Exception as e:
+                error = self._failed(route, started, e)
+                continue
+            route.record_first_chunk(time.monotonic() - started)
+            return self._achain(route, started, first, stream)
+        raise error
+
+    @staticmethod
+    async def _astart(llm, prompt, kwargs):
+        """(stream, its first chunk or None)"""
+        stream = await llm.astream_complete(prompt, **kwargs)
+        return stream, await anext(stream, None)
+
+    @staticmethod
+    async def _achain(route, started, first, stream):
+        failed = False
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        except Exception:
+            failed = True
+            raise
+        finally:
+            route.record_stream_end(time.monotonic() - started, error=failed)
+
+    def stats(self):
+        """Router counters and per-model health, latency and context cache state"""
+        now = time.monotonic()
+        with self._lock:
+            stats = {**self._counts}
+        stats.update({
+            'deadline_seconds': settings.LLM_DEADLINE,
+            'attempt_timeout_seconds': settings.LLM_ATTEMPT_TIMEOUT,
+            'order': [route.name for route in self.ordered_routes()],
+            'models': {route.name: route.stats(now) for route in self.routes},
+        })
+        return stats
+
+
+# Retries and circuit breaker around whole routed calls (see ai/resilience.py).
+# Quota errors aren't retried: the views answer them with QUOTA_EXCEEDED_MESSAGE
+llm_resilience = Resilient('llm', retryable=lambda error: not is_quota_error(error))
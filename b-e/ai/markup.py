@@ -0,0 +1,200 @@
+"""
+Wiki/markdown cleanup for LLM answers before they are shown and voiced.
+
+clean_wiki_markup applies the same substitutions, in the same order, as the
+original cleaner (ai/testdata/wiki_markup_corpus.json pins its output), but
+every pattern is compiled once, passes whose trigger character is absent are
+skipped with a plain substring test, and the formatting characters TTS would
+pronounce are deleted in one pass instead of three-character runs.
+clean_and_segment returns the segmentation of the cleaned text from the
+sentence spans used to place its paragraph breaks, tokenizing it only once.
+
+IncrementalCleaner cleans a token stream: it releases whole sentences as soon
+as they are complete, never cutting through a template, wiki link, HTML tag or
+''emphasis'' that is still open.
+"""
+
+import re
+
+from .segmenter import Segmentation, paragraph_groups, segment, sentence_spans
+
+# (triggers, pattern, replacement) in the order the cleaner applies them; a pass
+# can only match if one of its trigger substrings is present (line-anchored
+# patterns trigger on a newline followed by their first character)
+CLEANUP_PASSES = (
+    (('{{',), re.compile(r'\{\{[^{}]*\}\}'), ''),                  # Templates {{Infobox}}, {{Quote}}
+    (('[[',), re.compile(r'\[\[[^\]]*\]\]'), ''),                  # Wiki links [[Link|Display]]
+    (("'''",), re.compile(r"'''([^']*)'''"), r'\1'),               # Bold
+    (("''",), re.compile(r"''([^']*)''"), r'\1'),                  # Italic
+    (('*',), re.compile(r'\*([^*]*)\*'), r'\1'),                   # Bold *
+    (('/',), re.compile(r'/([^/]*)/'), r'\1'),                     # Italic /
+    (('\n=',), re.compile(r'^=+\s*(.*?)\s*=+$', re.MULTILINE), r'\1'),  # Headers == Header ==
+    (('\n*', '\n#'), re.compile(r'^[*#]+\s*', re.MULTILINE), ''),   # List markers
+    (('<',), re.compile(r'<[^>]+>'), ''),                          # HTML-like tags
+)
+# *, _, ` and ~ in any run length would be pronounced by TTS
+FORMATTING_CHARS = re.compile(r'[*_`~]+')
+RULES = (
+    ('--', re.compile(r'-{2,}')),    # --, ---
+    ('||', re.compile(r'\|{2,}')),   # Table separators
+)
+BLANK_LINES = re.compile(r'\n\s*\n')
+
+EXCESS_NEWLINES = re.compile(r'\n{3,}')
+EXCESS_SPACES = re.compile(r' {2,}')
+
+
+def clean_wiki_markup(text):
+    """
+    Clean wiki markup and formatting characters from text to make it readable.
+    Removes wiki templates, links, formatting, and special characters that would
+    be pronounced by TTS. Also adds natural paragraph breaks for better readability.
+    """
+    return add_paragraph_breaks(_strip_markup(text))
+
+
+def _strip_markup(text):
+    """clean_wiki_markup before its paragraph breaks"""
+    for triggers, pattern, replacement in CLEANUP_PASSES:
+        padded = '\n' + text  # So "\n=" also finds a header on the first line
+        if any(trigger in padded for trigger in triggers):
+            text = pattern.sub(replacement, text)
+
+    if any(char in text for char in '*_`~'):
+        text = FORMATTING_CHARS.sub('', text)
+    for trigger, pattern in RULES:
+        if trigger in text:
+            text = pattern.sub('', text)
+
+    # Clean up whitespace; this leaves no runs of 3+ newlines
+    if '\n' in text:
+        text = BLANK_LINES.sub('\n\n', text)
+        # Remove leading/trailing whitespace from each line
+        text = '\n'.join(line.strip() for line in text.split('\n'))
+
+    return text.strip()
+
+
+def add_paragraph_breaks(text):
+    """
+    Add natural paragraph breaks to improve readability.
+    Breaks paragraphs at logical points based on sentence structure and content.
+    """
+    return _paragraph_breaks(text)[0]
+
+
+def _paragraph_breaks(text):
+    """
+    add_paragraph_breaks, and the Segmentation of its result when it can be
+    read off the sentence spans used to build it (None otherwise)
+    """
+    # If text is very short, don't break it
+    if len(text) < 200:
+        return text, None
+
+    spans = sentence_spans(text)
+    if len(spans) < 3:
+        return text, None
+
+    paragraph_texts = []
+    paragraphs = []
+    sentences = []
+    position = 0
+    # The spans hold for the joined text unless a sentence is empty, starts or
+    # ends with whitespace, or the cleanup below changes the text
+    exact = True
+    for group in paragraph_groups(text, spans):
+        pieces = [text[start:end] for start, end in group]
+        paragraph_start = position
+        for piece in pieces:
+            # A sentence running over a blank line (after a heading, say) is
+            # segmented as one sentence per paragraph
+            parts = piece.split('\n\n')
+            exact = exact and all(part and part.strip() == part for part in parts)
+            for i, part in enumerate(parts):
+                if i:
+                    paragraphs.append((paragraph_start, position))
+                    position += 2
+                    paragraph_start = position
+                sentences.append((position, position + len(part)))
+                position += len(part)
+            position += 1  # The joining space
+        paragraphs.append((paragraph_start, position - 1))
+        position += 1  # "\n\n" is one character longer than a space
+        paragraph_texts.append(' '.join(pieces))
+    joined = '\n\n'.join(paragraph_texts)
+    result = joined
+    if '\n\n\n' in result:
+        result = EXCESS_NEWLINES.sub('\n\n', result)
+    if '  ' in result:
+        result = EXCESS_SPACES.sub(' ', result)
+    result = result.strip()
+    if exact and result == joined:
+        return result, Segmentation.from_spans(result, paragraphs, sentences)
+    return result, None
+
+
+def clean_and_segment(text):
+    """clean_wiki_markup plus the sentence/paragraph spans of the cleaned text"""
+    text, segmentation = _paragraph_breaks(_strip_markup(text))
+    return segmentation or segment(text)
+
+
+# Sentence ends the incremental cleaner may cut at: punctuation, then whitespace
+STREAM_BOUNDARY = re.compile(r'(?<=[.!?])(\s+)(?=\S)')
+EMPHASIS_RUN = re.compile(r"''+")
+
+
+def _has_open_markup(text):
+    """Whether text ends inside a template, wiki link, tag or ''emphasis''"""
+    return (
+        text.count('{{') > text.count('}}')
+        or text.count('[[') > text.count(']]')
+        or text.rfind('<') > text.rfind('>')
+        or len(EMPHASIS_RUN.findall(text)) % 2 == 1
+    )
+
+
+class IncrementalCleaner:
+    """
+    Clean text arriving chunk by chunk (e.g. LLM stream deltas).
+
+    feed() returns [(cleaned_sentence, separator), ...] for the sentences
+    completed so far, where separator is the whitespace that followed the
+    sentence in the raw text (callers use it to keep paragraph breaks);
+    finish() returns the same for whatever is left. A sentence boundary inside
+    open markup is skipped, so "{{Quote|Run. Now.}}" is cleaned as one unit.
+    Sentences that clean to nothing are dropped.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._scan_from = 0
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        pieces = []
+        start = 0
+        for match in STREAM_BOUNDARY.finditer(self._buffer, self._scan_from):
+            sentence = self._buffer[start:match.start()]
+            if _has_open_markup(sentence):
+                continue  # Keep going until the markup closes
+            self._emit(pieces, sentence, match.group(1))
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        # Whitespace at the end may still grow; rescan from just before it
+        self._scan_from = max(0, len(self._buffer.rstrip()) - 1)
+        return pieces
+
+    def finish(self):
+        pieces = []
+        self._emit(pieces, self._buffer, '')
+        self._buffer = ''
+        self._scan_from = 0
+        return pieces
+
+    @staticmethod
+    def _emit(pieces, sentence, separator):
+        cleaned = clean_wiki_markup(sentence)
+        if cleaned:
+            pieces.append((cleaned, separator))
@@ -0,0 +1,151 @@
+"""
+LLM usage metering shared by all workers (replaces ai/api_usage.json).
+
+record() only updates an in-process buffer, so the request path never touches
+disk. A background thread flushes the buffer every FLUSH_INTERVAL seconds into
+the shared state database with atomic upserts, so concurrent workers never
+lose increments. Counts, errors and latency sums are kept per day, per hour
+and per model. Counts are buffered per database (settings.AI_STATE_DB when
+they were recorded), so a later flush - from the thread or at exit - writes
+them where they belong even if the setting has changed since (as in tests).
+"""
+
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+
+from . import shared_state
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS api_usage (
+    day TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    latency_sum REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, hour, model)
+);
+'''
+
+# Seconds between background flushes of the in-process buffer
+FLUSH_INTERVAL = 2.0
+
+
+class UsageMeter:
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._buffer = {}  # database -> {(day, hour, model) -> [requests, errors, latency_sum]}
+        self._flusher = None
+
+    def record(self, model, latency=0.0, error=False):
+        """Count one LLM call (no I/O; flushed in the background)"""
+        now = datetime.now()
+        key = (now.strftime('%Y-%m-%d'), now.hour, model)
+        database = str(settings.AI_STATE_DB)
+        with self._lock:
+            counts = self._buffer.setdefault(database, {}).setdefault(key, [0, 0, 0.0])
+            counts[0] += 1
+            counts[1] += int(error)
+            counts[2] += latency
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='usage-meter', daemon=True)
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    @contextmanager
+    def measure(self, model):
+        """Record the wrapped LLM call's latency, counting an exception as an error"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record(model, time.perf_counter() - started, error=True)
+            raise
+        self.record(model, time.perf_counter() - started)
+
+    def flush(self):
+        """Write buffered counts to the shared database they were recorded for"""
+        with self._lock:
+            buffers, self._buffer = self._buffer, {}
+        error = None
+        for database, buffer in buffers.items():
+            try:
+                self._write(database, buffer)
+            except Exception as e:
+                # Keep the counts for the next flush rather than losing them
+                with self._lock:
+                    pending = self._buffer.setdefault(database, {})
+                    for key, (requests, errors, latency_sum) in buffer.items():
+                        counts = pending.setdefault(key, [0, 0, 0.0])
+                        counts[0] += requests
+                        counts[1] += errors
+                        counts[2] += latency_sum
+                error = e
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def _write(database, buffer):
+        conn = shared_state.connection(SCHEMA, path=database)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO api_usage (day, hour, model, requests, errors, latency_sum) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(day, hour, model) DO UPDATE SET '
+                'requests = requests + excluded.requests, errors = errors + excluded.errors, '
+                'latency_sum = latency_sum + excluded.latency_sum',
+                [(*key, *counts) for key, counts in buffer.items()],
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Usage meter flush failed: {e}")
+
+    def usage(self, day=None):
+        """Usage summary for one day (default today), including unflushed counts"""
+        self.flush()
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        conn = shared_state.connection(SCHEMA)
+        rows = conn.execute(
+            'SELECT hour, model, requests, errors, latency_sum FROM api_usage WHERE day = ? ORDER BY hour, model',
+            (day,),
+        ).fetchall()
+        by_hour = {}
+        by_model = {}
+        for hour, model, requests, errors, latency_sum in rows:
+            by_hour[hour] = by_hour.get(hour, 0) + requests
+            stats = by_model.setdefault(model, {'requests': 0, 'errors': 0, 'latency_sum': 0.0})
+            stats['requests'] += requests
+            stats['errors'] += errors
+            stats['latency_sum'] += latency_sum
+        for stats in by_model.values():
+            stats['avg_latency'] = round(stats['latency_sum'] / stats['requests'], 4) if stats['requests'] else 0.0
+            stats['latency_sum'] = round(stats['latency_sum'], 4)
+        return {
+            'date': day,
+            'requests': sum(by_hour.values()),
+            'errors': sum(stats['errors'] for stats in by_model.values()),
+            'by_hour': by_hour,
+            'by_model': by_model,
+        }
+
+
+usage_meter = UsageMeter()
@@ -0,0 +1,72 @@
+"""
+Minimal MPEG audio (Layer III) frame walking, enough to stitch edge-tts clips.
+
+edge-tts returns a bare stream of MP3 frames, so clips can be concatenated
+frame-for-frame; what the stitcher needs is each clip's exact playing time
+(frames x samples per frame / sample rate) to shift the next clip's word
+timings by.
+"""
+
+# Kbit/s by bitrate index, for Layer III
+BITRATES = {
+    'mpeg1': (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    'mpeg2': (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Version bits -> (name, sample rates by index)
+VERSIONS = {
+    0b11: ('mpeg1', (44100, 48000, 32000)),
+    0b10: ('mpeg2', (22050, 24000, 16000)),
+    0b00: ('mpeg2', (11025, 12000, 8000)),  # MPEG 2.5
+}
+LAYER_III = 0b01
+
+
+def id3_size(data, offset=0):
+    """Length of an ID3v2 tag starting at `offset`, or 0 if there is none"""
+    if data[offset:offset + 3] != b'ID3' or len(data) < offset + 10:
+        return 0
+    size = 0
+    for byte in data[offset + 6:offset + 10]:
+        size = (size << 7) | (byte & 0x7f)  # Syncsafe integer
+    footer = 10 if data[offset + 5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def parse_header(data, offset):
+    """(frame length in bytes, samples, sample rate) of the frame at `offset`, or None"""
+    if len(data) < offset + 4 or data[offset] != 0xff or data[offset + 1] & 0xe0 != 0xe0:
+        return None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    version = VERSIONS.get((b1 >> 3) & 0b11)
+    if version is None or (b1 >> 1) & 0b11 != LAYER_III:
+        return None
+    name, sample_rates = version
+    bitrate_index, rate_index, padding = b2 >> 4, (b2 >> 2) & 0b11, (b2 >> 1) & 1
+    if bitrate_index in (0, 15) or rate_index == 3:
+        return None  # Free format / reserved values
+    bitrate = BITRATES[name][bitrate_index] * 1000
+    sample_rate = sample_rates[rate_index]
+    if name == 'mpeg1':
+        return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+    return 72 * bitrate // sample_rate + padding, 576, sample_rate
+
+
+def duration(data):
+    """Playing time of an MP3 clip in seconds (0.0 if it has no parsable frames)"""
+    offset = id3_size(data)
+    seconds = 0.0
+    while True:
+        header = parse_header(data, offset)
+        if header is None:
+            return seconds
+        length, samples, sample_rate = header
+        seconds += samples / sample_rate
+        offset += length
+
+
+def concat(clips):
+    """Join MP3 clips into one stream, keeping only the first clip's ID3 tag"""
+    out = bytearray()
+    for i, clip in enumerate(clips):
+        out += memoryview(clip)[id3_size(clip) if i else 0:]
+    return out
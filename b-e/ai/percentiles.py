@@ -0,0 +1,12 @@
+"""
+Percentiles of recent latency samples, shared by the stage metrics, the TTS
+hedge delay, the LLM router's health checks and the retrieval stats.
+"""
+
+import math
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
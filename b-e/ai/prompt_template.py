@@ -0,0 +1,85 @@
+"""
+System prompt template shared by the Django app (ai.utils) and the CLI (main.py).
+
+The prompt file is read once and pre-split around its placeholders; the file's
+mtime is checked at most once per CHECK_INTERVAL seconds so edits are picked up
+without a restart, and the rendered prompt is cached until local midnight,
+when {current_date} changes. Rendering on the request path is therefore a
+cached string lookup instead of a file read plus str.replace.
+"""
+
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Placeholders the template understands; anything else in braces is literal text
+PLACEHOLDERS = {
+    'current_date': lambda now: now.strftime('%Y-%m-%d'),
+}
+PLACEHOLDER_PATTERN = re.compile(r'\{(' + '|'.join(PLACEHOLDERS) + r')\}')
+
+# Seconds between mtime checks of the prompt file
+CHECK_INTERVAL = 1.0
+
+
+class PromptTemplate:
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._parts = None  # Alternating literal text and placeholder names
+        self._next_check = 0.0
+        self._rendered = None
+        self._rendered_until = 0.0
+
+    def _load(self):
+        """(Re)read the file if its mtime changed; returns False if it is missing"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime = self._parts = self._rendered = None
+            return False
+        if mtime != self._mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+            # re.split with a capture group keeps the placeholder names at odd indexes
+            self._parts = PLACEHOLDER_PATTERN.split(text)
+            self._mtime = mtime
+            self._rendered = None
+        return True
+
+    def render(self):
+        """The prompt with placeholders filled in, or None if the file is missing"""
+        now = time.time()
+        with self._lock:
+            if now >= self._next_check:
+                self._next_check = now + CHECK_INTERVAL
+                if not self._load():
+                    return None
+            if self._parts is None:
+                return None
+            if self._rendered is None or now >= self._rendered_until:
+                current = datetime.fromtimestamp(now)
+                self._rendered = ''.join(
+                    PLACEHOLDERS[part](current) if i % 2 else part
+                    for i, part in enumerate(self._parts)
+                )
+                midnight = (current + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+                self._rendered_until = midnight.timestamp()
+            return self._rendered
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def render_prompt(path):
+    """Render the prompt file at `path` through its process-wide cached template"""
+    key = os.fspath(path)
+    template = _templates.get(key)
+    if template is None:
+        with _templates_lock:
+            template = _templates.setdefault(key, PromptTemplate(key))
+    return template.render()
@@ -0,0 +1,209 @@
+"""
+Retries with full-jitter backoff and circuit breakers for the LLM and TTS.
+
+A failing call used to be retried after time.sleep(2 ** attempt), holding a
+sync worker idle for seconds per request; in an outage every worker ended up
+asleep. Now:
+
+- Async callers (chat_async, the TTS engine's loop) retry in-process and wait
+  with asyncio.sleep, which hands the event loop to other requests.
+- Sync callers never sleep. A retryable failure raises RetryLater carrying the
+  backoff delay; the view answers 503 with Retry-After and the client repeats
+  the request (sending the attempt number) once the delay has passed, so the
+  worker is free in the meantime.
+
+Delays use "full jitter": a uniform random wait between 0 and
+min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt), so clients that failed
+together don't retry together.
+
+Each dependency also has a circuit breaker. Once at least BREAKER_MIN_CALLS
+calls in the last BREAKER_WINDOW seconds failed at a rate of
+BREAKER_ERROR_RATE or more, the breaker opens and calls fail fast with
+CircuitOpenError for BREAKER_OPEN_SECONDS. Then a single probe call is let
+through (half-open): success closes the breaker, failure opens it again.
+Breakers are per worker process; /ai/breakers/ shows their state.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Outcomes remembered per breaker (older ones also age out of BREAKER_WINDOW)
+OUTCOME_WINDOW = 100
+# Retry-After suggested while a half-open probe is in flight
+PROBE_RETRY_AFTER = 1.0
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Full-jitter delay before retry number attempt + 1"""
+    base = settings.RETRY_BASE_DELAY if base is None else base
+    cap = settings.RETRY_MAX_DELAY if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryLater(Exception):
+    """A retryable failure in a sync caller: try again after retry_after seconds"""
+
+    def __init__(self, retry_after, cause):
+        super().__init__(f"Retry in {retry_after:.2f}s: {cause}")
+        self.retry_after = retry_after
+        self.cause = cause
+
+
+class CircuitOpenError(Exception):
+    """The breaker is open: the call was not made"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=OUTCOME_WINDOW)  # (time, failed)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._counts = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead now"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            now = time.monotonic()
+            reopen_at = self._opened_at + settings.BREAKER_OPEN_SECONDS
+            if self._state == OPEN and now >= reopen_at:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            self._counts['rejected'] += 1
+            retry_after = reopen_at - now if self._state == OPEN else PROBE_RETRY_AFTER
+        raise CircuitOpenError(self.name, max(retry_after, PROBE_RETRY_AFTER))
+
+    def record_success(self):
+        with self._lock:
+            self._counts['successes'] += 1
+            self._outcomes.append((time.monotonic(), False))
+            if self._state == HALF_OPEN:
+                self._state = CLOSED
+                self._probing = False
+                self._outcomes.clear()
+
+    def record_failure(self):
+        with self._lock:
+            now = time.monotonic()
+            self._counts['failures'] += 1
+            self._outcomes.append((now, True))
+            if self._state == HALF_OPEN:
+                self._open(now)
+            elif self._state == CLOSED:
+                recent = [failed for at, failed in self._outcomes if now - at < settings.BREAKER_WINDOW]
+                if len(recent) >= settings.BREAKER_MIN_CALLS and \
+                        sum(recent) / len(recent) >= settings.BREAKER_ERROR_RATE:
+                    self._open(now)
+
+    def abandon(self):
+        """A call ended without an outcome (e.g. cancelled); free the probe slot"""
+        with self._lock:
+            self._probing = False
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probing = False
+        self._counts['opened'] += 1
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            recent = [failed for at, failed in self._outcomes if now - at < settings.BREAKER_WINDOW]
+            state = self._state
+            if state == OPEN and now >= self._opened_at + settings.BREAKER_OPEN_SECONDS:
+                state = HALF_OPEN  # The next call will be the probe
+            return {
+                'state': state,
+                'recent_calls': len(recent),
+                'recent_error_rate': round(sum(recent) / len(recent), 4) if recent else 0.0,
+                'open_for_seconds': round(max(0.0, self._opened_at + settings.BREAKER_OPEN_SECONDS - now), 1)
+                                    if state == OPEN else 0.0,
+                **self._counts,
+            }
+
+
+class Resilient:
+    """Retry policy plus circuit breaker for one dependency"""
+
+    def __init__(self, name, retryable=lambda error: True, attempts=None, base_delay=None, max_delay=None):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.retryable = retryable
+        self._attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._retries = 0
+
+    @property
+    def attempts(self):
+        return self._attempts or settings.RETRY_ATTEMPTS
+
+    def delay(self, attempt):
+        return backoff_delay(attempt, self.base_delay, self.max_delay)
+
+    def call(self, attempt, fn, *args, **kwargs):
+        """
+        One attempt of fn for a sync caller on its `attempt`-th try (0-based).
+        A retryable failure with tries left raises RetryLater instead of sleeping.
+        """
+        with self.guard():
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if self.retryable(e) and attempt + 1 < self.attempts:
+                    self._retries += 1
+                    raise RetryLater(self.delay(attempt), e) from e
+                raise
+
+    async def acall(self, fn, *args, **kwargs):
+        """await fn(...) with up to `attempts` tries, backing off with asyncio.sleep"""
+        for attempt in range(self.attempts):
+            try:
+                with self.guard():
+                    return await fn(*args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if not self.retryable(e) or attempt + 1 >= self.attempts:
+                    raise
+                self._retries += 1
+                await asyncio.sleep(self.delay(attempt))
+
+    @contextmanager
+    def guard(self):
+        """Run the wrapped call through the breaker, recording its outcome"""
+        self.breaker.before_call()
+        try:
+            yield
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.abandon()
+            raise
+        self.breaker.record_success()
+
+    def stats(self):
+        return {**self.breaker.stats(), 'retries': self._retries, 'max_attempts': self.attempts}
+
@@ -0,0 +1,180 @@
+"""
+Retrieval stage of the chat path: top-k wiki chunks from the local Chroma index.
+
+The scraped Resident Evil wiki (chroma/red_queen_knowledge, collection
+"resident_evil_knowledge") is queried from a persistent Chroma directory
+(RAG_CHROMA_PATH) and the best RAG_TOP_K chunks are put in front of the
+question, so the model answers from the wiki instead of from memory.
+
+Retrieval must never hold up a chat: the query runs on a dedicated thread
+and the request waits at most RAG_BUDGET_MS for it. A query that misses the
+budget is abandoned (the prompt goes out without context) and counted, and
+the first query in a process also pays for opening the index, so it usually
+misses and warms the index for the next one. Abandoned queries still waiting
+for the thread are cancelled, and one that only reaches the thread after its
+deadline is dropped, so a slow index can't build up a backlog of queries
+nobody is waiting for. If chromadb isn't installed or
+the index doesn't exist, retrieval is disabled and chat works as before.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from pathlib import Path
+
+from django.conf import settings
+
+from .markup import clean_wiki_markup
+from .percentiles import percentile
+
+logger = logging.getLogger(__name__)
+
+# Query latencies kept for the stage metric
+LATENCY_WINDOW = 200
+
+
+def open_chroma_collection(path, name):
+    """The persistent collection at `path`, or None if chromadb or the index is missing"""
+    try:
+        import chromadb
+    except ImportError:
+        logger.warning("chromadb is not installed; retrieval disabled")
+        return None
+    if not (Path(path) / 'chroma.sqlite3').exists():
+        # PersistentClient would silently create an empty index here
+        logger.warning(f"No Chroma index at {path}; retrieval disabled")
+        return None
+    client = chromadb.PersistentClient(path=str(path))
+    try:
+        return client.get_collection(name=name)
+    except Exception as e:
+        logger.warning(f"Chroma collection '{name}' unavailable ({e}); retrieval disabled")
+        return None
+
+
+class Retriever:
+    def __init__(self, open_collection=None, top_k=None, budget_ms=None, max_chunk_chars=None):
+        self.open_collection = open_collection or (
+            lambda: open_chroma_collection(settings.RAG_CHROMA_PATH, settings.RAG_COLLECTION)
+        )
+        self.top_k = top_k or settings.RAG_TOP_K
+        self.budget = (budget_ms or settings.RAG_BUDGET_MS) / 1000
+        self.max_chunk_chars = max_chunk_chars or settings.RAG_MAX_CHUNK_CHARS
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='retrieval')
+        self._collection = None
+        self._opened = False
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counts = {'queries': 0, 'hits': 0, 'empty': 0, 'over_budget': 0, 'dropped': 0, 'errors': 0, 'disabled': 0}
+
+    def _collection_or_none(self):
+        if not self._opened:
+            self._collection = self.open_collection()
+            self._opened = True
+        return self._collection
+
+    def _query(self, question, deadline):
+        """Runs on the retrieval thread; returns cleaned chunks, best first"""
+        collection = self._collection_or_none()
+        if collection is None:
+            return None
+        if time.monotonic() >= deadline:
+            self._count('dropped')  # Its request has already gone ahead without it
+            return []
+        started = time.perf_counter()
+        results = collection.query(query_texts=[question], n_results=self.top_k)
+        chunks = []
+        for document in (results.get('documents') or [[]])[0]:
+            chunk = clean_wiki_markup(document or '')[:self.max_chunk_chars]
+            if chunk:
+                chunks.append(chunk)
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+        return chunks
+
+    def _count(self, outcome):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def _outcome(self, future):
+        """Map a finished (or abandoned) query to its chunks and count it"""
+        if future.cancelled() or not future.done():
+            self._count('over_budget')
+            return []
+        try:
+            chunks = future.result()
+        except Exception as e:
+            logger.error(f"Retrieval failed: {e}")
+            self._count('errors')
+            return []
+        if chunks is None:
+            self._count('disabled')
+            return []
+        self._count('hits' if chunks else 'empty')
+        return chunks
+
+    def _abandon(self, future):
+        """Cancel a query that missed its budget if it hasn't started yet"""
+        if future.cancel():
+            self._count('dropped')
+
+    def retrieve(self, question):
+        """Top-k knowledge chunks for the question, or [] if none arrive within budget"""
+        if not settings.RAG_ENABLED:
+            return []
+        self._count('queries')
+        future = self._executor.submit(self._query, question, time.monotonic() + self.budget)
+        try:
+            future.result(timeout=self.budget)
+        except FutureTimeout:
+            self._abandon(future)
+        except Exception:
+            pass  # Reported by _outcome
+        return self._outcome(future)
+
+    async def aretrieve(self, question):
+        """Async retrieve: awaits the query thread without blocking the event loop"""
+        if not settings.RAG_ENABLED:
+            return []
+        self._count('queries')
+        future = self._executor.submit(self._query, question, time.monotonic() + self.budget)
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.budget)
+        except asyncio.TimeoutError:
+            self._abandon(future)
+        except Exception:
+            pass  # Reported by _outcome
+        return self._outcome(future)
+
+    def stats(self):
+        """Retrieval stage metric for this worker: outcomes and query latency"""
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = {
+                'enabled': settings.RAG_ENABLED,
+                'index_open': self._collection is not None,
+                'top_k': self.top_k,
+                'budget_ms': round(self.budget * 1000, 1),
+                **self._counts,
+            }
+        for pct in (50, 95, 99):
+            stats[f'latency_ms_p{pct}'] = round(percentile(latencies, pct) * 1000, 2) if latencies else None
+        return stats
+
+
+def with_context(prompt, question, chunks):
+    """The prompt with retrieved knowledge placed between instructions and question"""
+    if not chunks:
+        return f"{prompt}\n\n{question}" if prompt else question
+    context = '\n\n'.join(f"[{i}] {chunk}" for i, chunk in enumerate(chunks, 1))
+    knowledge = (
+        "Relevant knowledge from the Resident Evil wiki (use it if it answers the question):\n"
+        f"{context}"
+    )
+    return '\n\n'.join(part for part in (prompt, knowledge, question) if part)
+
+
+retriever = Retriever()
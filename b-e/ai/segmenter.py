@@ -0,0 +1,129 @@
+"""
+Sentence and paragraph segmentation shared by display formatting and TTS.
+
+Text is tokenized once, left to right, into character-offset spans: a sentence
+ends at terminal punctuation followed by whitespace and a capital letter, and
+a paragraph is the text between blank lines ("\n\n", which clean_wiki_markup
+guarantees). Callers slice the original string with the spans instead of
+re-splitting it: the chat views build text_html from the paragraph spans and
+the TTS chunker groups sentence spans into synthesis segments.
+"""
+
+import re
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+(?=[A-Z])')
+PARAGRAPH_SEPARATOR = '\n\n'
+
+TRANSITION_WORDS = ('however', 'therefore', 'moreover', 'furthermore', 'additionally',
+                    'consequently', 'similarly', 'likewise', 'in contrast', 'on the other hand',
+                    'meanwhile', 'subsequently', 'accordingly', 'thus', 'hence')
+# One alternation finds any transition word as a substring (like `word in sentence`)
+TRANSITION_PATTERN = re.compile('|'.join(map(re.escape, TRANSITION_WORDS)))
+
+
+def sentence_spans(text, start=0, end=None):
+    """
+    (start, end) offsets of the sentences in text[start:end], in one pass.
+    Spans cover the text between boundaries (the whitespace of a boundary
+    belongs to neither sentence), so joining them with single spaces gives the
+    same pieces as re.split on SENTENCE_BOUNDARY.
+    """
+    end = len(text) if end is None else end
+    spans = []
+    for match in SENTENCE_BOUNDARY.finditer(text, start, end):
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, end))
+    return spans
+
+
+def stripped(text, span):
+    """Narrow a span to exclude surrounding whitespace"""
+    start, end = span
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def paragraph_groups(text, spans):
+    """
+    Group sentence spans into display paragraphs of 2-4 sentences: a paragraph
+    ends after 4 sentences, once it exceeds 150 characters, after an
+    introduction longer than 100 characters, or at a sentence containing a
+    transition word. Lengths are kept as running totals, so this is linear in
+    the number of sentences.
+    """
+    groups = []
+    current = []
+    length = 0
+    for span in spans:
+        start, end = stripped(text, span)
+        current.append((start, end))
+        # Length of the paragraph's sentences joined with single spaces
+        length += (end - start) + (1 if len(current) > 1 else 0)
+        count = len(current)
+        should_break = count >= 4 or (
+            count >= 2 and (
+                length > 150
+                or (count == 2 and length > 100)
+                or TRANSITION_PATTERN.search(text[span[0]:span[1]].lower()) is not None
+            )
+        )
+        if should_break:
+            groups.append(current)
+            current = []
+            length = 0
+    if current:
+        groups.append(current)
+    return groups
+
+
+class Segmentation:
+    """
+    Sentence and paragraph spans of one text. Paragraph spans partition the
+    text around its "\n\n" separators; sentence spans are whitespace-stripped
+    and never cross a paragraph.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.paragraphs = []
+        self.sentences = []
+        start = 0
+        while True:
+            end = text.find(PARAGRAPH_SEPARATOR, start)
+            if end == -1:
+                end = len(text)
+            self.paragraphs.append((start, end))
+            for span in sentence_spans(text, start, end):
+                span = stripped(text, span)
+                if span[0] < span[1]:
+                    self.sentences.append(span)
+            if end == len(text):
+                break
+            start = end + len(PARAGRAPH_SEPARATOR)
+
+    @classmethod
+    def from_spans(cls, text, paragraphs, sentences):
+        """A Segmentation of text whose spans the caller already has"""
+        segmentation = cls.__new__(cls)
+        segmentation.text = text
+        segmentation.paragraphs = paragraphs
+        segmentation.sentences = sentences
+        return segmentation
+
+    def sentence_texts(self):
+        return [self.text[start:end] for start, end in self.sentences]
+
+    def paragraph_texts(self):
+        return [self.text[start:end] for start, end in self.paragraphs]
+
+    def html(self):
+        """The text with paragraph breaks and line breaks as <br> (same as replacing every newline)"""
+        return '<br><br>'.join(paragraph.replace('\n', '<br>') for paragraph in self.paragraph_texts())
+
+
+def segment(text):
+    return Segmentation(text)
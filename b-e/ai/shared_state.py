@@ -0,0 +1,60 @@
+"""
+SQLite-backed state shared by every worker process.
+
+gunicorn/uvicorn workers don't share memory, so caches and counters that all of
+them must see live in one small WAL-mode database (settings.AI_STATE_DB).
+Connections are per thread and in autocommit mode; callers that need several
+statements to be atomic wrap them in "BEGIN IMMEDIATE" ... "COMMIT".
+"""
+
+import sqlite3
+import threading
+
+from django.conf import settings
+
+_local = threading.local()
+
+COUNTERS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+
+def connection(schema=None, path=None):
+    """
+    Return this thread's connection to the shared state database (or to the
+    one at `path`), creating the tables in `schema` (a CREATE ... IF NOT
+    EXISTS script) on first use.
+    """
+    path = str(path or settings.AI_STATE_DB)
+    connections = _local.__dict__.setdefault('connections', {})
+    conn, schemas = connections.get(path, (None, None))
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        schemas = set()
+        connections[path] = (conn, schemas)
+    if schema and schema not in schemas:
+        conn.executescript(schema)
+        schemas.add(schema)
+    return conn
+
+
+def increment(name, amount=1):
+    """Atomically add to a named counter shared by all workers"""
+    conn = connection(COUNTERS_SCHEMA)
+    conn.execute(
+        'INSERT INTO counters (name, value) VALUES (?, ?) '
+        'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+        (name, amount),
+    )
+
+
+def counters(prefix=''):
+    """Current values of all counters whose name starts with `prefix`"""
+    conn = connection(COUNTERS_SCHEMA)
+    rows = conn.execute('SELECT name, value FROM counters WHERE substr(name, 1, ?) = ?', (len(prefix), prefix))
+    return dict(rows.fetchall())
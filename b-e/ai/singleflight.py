@@ -0,0 +1,162 @@
+"""
+Single-flight coalescing of identical work.
+
+While one caller computes the result for a key, other callers with the same
+key wait for it instead of repeating the work:
+
+- within a process, followers block on the leader's in-flight call (threads)
+  or await its future (asyncio);
+- across worker processes, the leader holds a row in the shared "inflight"
+  lock table; leaders in other processes wait for that row to disappear and
+  then read the published result through `lookup` (e.g. the answer cache).
+
+If nothing was published (the leader failed or its result isn't cacheable) the
+waiting process computes the result itself.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from . import shared_state
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+'''
+
+
+class _Call:
+    """A computation in progress in this process"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name, lock_timeout=60.0, poll_interval=0.1):
+        self.name = name
+        # A leader that crashed mid-flight stops blocking others after lock_timeout
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = {}
+
+    # Cross-process lock table
+
+    def _lock_key(self, key):
+        return f"{self.name}:{key}"
+
+    def _acquire(self, key):
+        """Try to become the leader for `key` across all workers"""
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM inflight WHERE key = ? AND expires < ?', (self._lock_key(key), now))
+            acquired = conn.execute(
+                'INSERT OR IGNORE INTO inflight (key, owner, expires) VALUES (?, ?, ?)',
+                (self._lock_key(key), f"{os.getpid()}:{threading.get_ident()}", now + self.lock_timeout),
+            ).rowcount == 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return acquired
+
+    def _release(self, key):
+        conn = shared_state.connection(SCHEMA)
+        conn.execute('DELETE FROM inflight WHERE key = ?', (self._lock_key(key),))
+
+    def _held(self, key):
+        conn = shared_state.connection(SCHEMA)
+        row = conn.execute(
+            'SELECT 1 FROM inflight WHERE key = ? AND expires >= ?', (self._lock_key(key), time.time())
+        ).fetchone()
+        return row is not None
+
+    # Threads (sync views)
+
+    def do(self, key, compute, lookup):
+        """
+        Return compute() for `key`, sharing one computation between concurrent
+        callers. `lookup()` returns a result published by another process, or None.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_processes(key, compute, lookup)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_across_processes(self, key, compute, lookup):
+        if self._acquire(key):
+            try:
+                return compute()
+            finally:
+                self._release(key)
+        # Another worker is computing it: wait for its lock to go, then read its result
+        deadline = time.monotonic() + self.lock_timeout
+        while self._held(key) and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+        result = lookup()
+        return result if result is not None else compute()
+
+    # asyncio (async views)
+
+    async def ado(self, key, compute, lookup):
+        """
+        Async variant of do(): `compute` returns an awaitable, `lookup` is a
+        plain (blocking) callable and runs in a thread.
+        """
+        loop = asyncio.get_running_loop()
+        future_key = (id(loop), key)
+        future = self._futures.get(future_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._futures[future_key] = loop.create_future()
+        try:
+            result = await self._arun_across_processes(key, compute, lookup)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved: followers re-raise it, nobody else needs warning
+            raise
+        finally:
+            del self._futures[future_key]
+
+    async def _arun_across_processes(self, key, compute, lookup):
+        if await asyncio.to_thread(self._acquire, key):
+            try:
+                return await compute()
+            finally:
+                await asyncio.to_thread(self._release, key)
+        deadline = time.monotonic() + self.lock_timeout
+        while await asyncio.to_thread(self._held, key) and time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+        result = await asyncio.to_thread(lookup)
+        return result if result is not None else await compute()
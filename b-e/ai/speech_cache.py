@@ -0,0 +1,114 @@
+"""
+Speech already voiced, keyed by (voice, text).
+
+Every clip the chat path generates is recorded here with its word timings, so
+replaying a message (/ai/speak/) returns the existing audio instead of calling
+Gemini and edge-tts again. Text that has never been voiced is synthesized once
+through the TTS engine and then served from the store.
+
+Like the answer cache, entries expire after SPEECH_CACHE_TTL seconds and the
+least recently used ones are evicted once SPEECH_CACHE_MAX_ENTRIES is
+exceeded. An entry whose clip the audio store has evicted is dropped when it
+is next looked up.
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+
+from django.conf import settings
+
+from . import audio_store, shared_state
+from .tts_engine import tts_engine
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS speech_cache (
+    voice TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    audio_digest TEXT NOT NULL,
+    word_timings TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (voice, text_hash)
+);
+CREATE INDEX IF NOT EXISTS speech_cache_last_used ON speech_cache (last_used);
+'''
+
+LINE_BREAK_TAG = re.compile(r'<br\s*/?>', re.IGNORECASE)
+HTML_TAG = re.compile(r'<[^>]+>')
+
+
+def message_text(content):
+    """
+    Recover the voiced plain text from a chat message as the frontend stores it
+    (text_html: newlines as <br>, possibly wrapped in highlight spans).
+    """
+    return HTML_TAG.sub('', LINE_BREAK_TAG.sub('\n', content)).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class SpeechCache:
+    """(voice, text) -> stored clip + word timings"""
+
+    def lookup(self, voice, text=None, digest_of_text=None):
+        """Cached {'audio_digest', 'word_timings'} for the text (or its hash), or None"""
+        key = digest_of_text or text_hash(text)
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        row = conn.execute(
+            'SELECT audio_digest, word_timings FROM speech_cache WHERE voice = ? AND text_hash = ? AND created > ?',
+            (voice, key, now - settings.SPEECH_CACHE_TTL),
+        ).fetchone()
+        # The clip may have been evicted from the audio store; then the entry is useless
+        if row is None or not audio_store.exists(row[0]):
+            if row is not None:
+                conn.execute('DELETE FROM speech_cache WHERE voice = ? AND text_hash = ?', (voice, key))
+            return None
+        conn.execute('UPDATE speech_cache SET last_used = ? WHERE voice = ? AND text_hash = ?', (now, voice, key))
+        return {'audio_digest': row[0], 'word_timings': json.loads(row[1])}
+
+    def remember(self, voice, text, audio_digest, word_timings):
+        """Record a clip generated elsewhere (e.g. by the chat view) and evict expired / least recently used entries"""
+        conn = shared_state.connection(SCHEMA)
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO speech_cache (voice, text_hash, audio_digest, word_timings, created, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (voice, text_hash(text), audio_digest, json.dumps(word_timings), now, now),
+            )
+            conn.execute('DELETE FROM speech_cache WHERE created <= ?', (now - settings.SPEECH_CACHE_TTL,))
+            evicted = conn.execute(
+                'DELETE FROM speech_cache WHERE rowid IN '
+                '(SELECT rowid FROM speech_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (settings.SPEECH_CACHE_MAX_ENTRIES,),
+            ).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if evicted:
+            shared_state.increment('speech_cache.evictions', evicted)
+
+    async def speak(self, text):
+        """
+        Return ({'audio_digest', 'word_timings'}, cached) for the text,
+        synthesizing it only if it has not been voiced before.
+        """
+        # The database and file work runs in threads, so async views don't block their event loop
+        cached = await asyncio.to_thread(self.lookup, tts_engine.voice, text)
+        if cached is not None:
+            return cached, True
+        audio_result = await tts_engine.synthesize(text)
+        digest = await asyncio.to_thread(audio_store.store_bytes, audio_result["audio"])
+        await asyncio.to_thread(self.remember, tts_engine.voice, text, digest, audio_result["word_timings"])
+        return {'audio_digest': digest, 'word_timings': audio_result["word_timings"]}, False
+
+
+speech_cache = SpeechCache()
@@ -0,0 +1,237 @@
+"""
+Progressive chat responses for /ai/chat/stream/.
+
+Text is forwarded sentence by sentence while the LLM is still generating, and
+each group of sentences is handed to a background TTS worker so audio segments
+(with their word timings) can be emitted as soon as they are voiced.
+
+stream_chat_events is the generator for WSGI. Under ASGI the server can only
+send events progressively from an async iterator (it would collect a sync
+generator into a list first), so chat_stream_async uses astream_chat_events,
+which awaits the LLM stream and voices segments in threads.
+
+Events are newline-delimited JSON objects with a "type" field:
+
+    {"type": "text", "delta": "..."}
+    {"type": "audio", "segment": 0, "text": "...", "audio_url": "/ai/audio/<sha256>.mp3", "filename": "...", "word_timings": [...]}
+    {"type": "audio_error", "segment": 0, "message": "..."}
+    {"type": "error", "error": "...", "quota_exceeded": false, "retry_after": 30}
+    {"type": "done", "text": "...", "text_html": "...", "turn": 3}
+
+retry_after (seconds) is only present when the LLM circuit breaker is open.
+Streams are not retried: text may already have been shown. turn is only
+present when the answer was added to the session's history (see
+ai/conversation.py).
+"""
+
+import asyncio
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from . import audio_store
+from .tts_engine import tts_engine
+from .llm_router import llm_resilience
+from .resilience import CircuitOpenError
+from .timing import stage, mark
+from .markup import IncrementalCleaner
+from .segmenter import segment
+from .utils import llm, load_system_prompt, is_quota_error, QUOTA_EXCEEDED_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+# The first audio segment is voiced as soon as one sentence is ready so the
+# avatar starts talking early; later segments batch sentences up to this size
+SEGMENT_TARGET_CHARS = 200
+
+
+def ndjson_event(event_type, **fields):
+    """Encode one stream event as a line of NDJSON"""
+    return (json.dumps({'type': event_type, **fields}) + '\n').encode('utf-8')
+
+
+def synthesize_segment(text):
+    """Voice one segment of cleaned text (runs on the TTS worker thread)"""
+    audio_result = tts_engine.synthesize_sync(text)
+    digest = audio_store.store_bytes(audio_result["audio"])
+    return {
+        'audio_url': audio_store.audio_url(digest),
+        'filename': f"{digest}.mp3",
+        'word_timings': audio_result["word_timings"],
+    }
+
+
+class _SegmentQueue:
+    """Ordered TTS jobs; results are released strictly in segment order"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts-stream')
+        self.pending = []
+        self.count = 0
+
+    def submit(self, text):
+        self._add(text, self.executor.submit(synthesize_segment, text))
+
+    def _add(self, text, future):
+        self.pending.append((self.count, text, future))
+        self.count += 1
+
+    def ready(self, wait=False):
+        """Yield audio events for finished segments at the head of the queue"""
+        while self.pending and (wait or self.pending[0][2].done()):
+            segment, text, future = self.pending.pop(0)
+            try:
+                result = future.result()
+                mark('first_audio')
+                yield ndjson_event('audio', segment=segment, text=text, **result)
+            except Exception as tts_error:
+                logger.warning(f"TTS generation failed for segment {segment}: {tts_error}")
+                yield ndjson_event('audio_error', segment=segment, message=str(tts_error))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _AsyncSegmentQueue(_SegmentQueue):
+    """
+    _SegmentQueue for async streams: each job is a task that voices its
+    segment in a thread once the previous segment is done
+    """
+
+    def __init__(self):
+        self.pending = []
+        self.count = 0
+
+    def submit(self, text):
+        previous = self.pending[-1][2] if self.pending else None
+        self._add(text, asyncio.ensure_future(self._synthesize(previous, text)))
+
+    @staticmethod
+    async def _synthesize(previous, text):
+        if previous is not None:
+            await asyncio.wait([previous])
+        return await asyncio.to_thread(synthesize_segment, text)
+
+    async def wait(self):
+        """Wait until every queued segment is voiced (or failed)"""
+        if self.pending:
+            await asyncio.wait([future for _, _, future in self.pending])
+
+    def shutdown(self):
+        for _, _, future in self.pending:
+            future.cancel()
+
+
+class _AnswerText:
+    """The cleaned answer as it streams in: text events for the client, segments for TTS"""
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.cleaner = IncrementalCleaner()
+        self.deltas = []
+        self.last_separator = ''
+        self.segment_text = ''
+
+    @property
+    def text(self):
+        return ''.join(self.deltas)
+
+    def feed(self, delta):
+        """Text events for the sentences an LLM chunk completes"""
+        for cleaned, separator in self.cleaner.feed(delta):
+            yield ndjson_event('text', delta=self._sentence(cleaned, separator))
+
+    def finish(self):
+        """Text events for the rest of the answer; queues its last segment"""
+        for cleaned, separator in self.cleaner.finish():
+            yield ndjson_event('text', delta=self._sentence(cleaned, separator))
+        if self.segment_text:
+            self.segments.submit(self.segment_text)
+            self.segment_text = ''
+
+    def _sentence(self, cleaned, separator):
+        """Queue a cleaned sentence for TTS and return its text delta"""
+        joiner = ''
+        if self.deltas:
+            joiner = '\n\n' if '\n\n' in self.last_separator else ' '
+        self.last_separator = separator
+        self.deltas.append(joiner + cleaned)
+        self.segment_text = f"{self.segment_text} {cleaned}".strip()
+        # Voice the first sentence straight away, then batch
+        if self.segments.count == 0 or len(self.segment_text) >= SEGMENT_TARGET_CHARS:
+            self.segments.submit(self.segment_text)
+            self.segment_text = ''
+        return self.deltas[-1]
+
+
+def done_event(answer_text, fields=None):
+    return ndjson_event('done', text=answer_text, text_html=segment(answer_text).html(), **(fields or {}))
+
+
+def error_event(error):
+    """The stream's closing error event for an exception"""
+    logger.error(f"Streaming chat failed: {error}")
+    if is_quota_error(error):
+        return ndjson_event('error', error=QUOTA_EXCEEDED_MESSAGE, quota_exceeded=True)
+    if isinstance(error, CircuitOpenError):
+        return ndjson_event('error', error='AI Service temporarily unavailable. Please try again later.',
+                            quota_exceeded=False, retry_after=math.ceil(error.retry_after))
+    return ndjson_event('error', error='AI Service temporarily unavailable. Please try again later.', quota_exceeded=False)
+
+
+def stream_chat_events(full_prompt, on_answer=None):
+    """
+    Generator of NDJSON events for one chat turn; on_answer, if given, is
+    called with the complete cleaned answer before the done event and may
+    return extra fields for it
+    """
+    segments = _SegmentQueue()
+    answer = _AnswerText(segments)
+    try:
+        # Includes the time the client takes to read the events sent meanwhile
+        with llm_resilience.guard(), stage('llm_stream'):
+            for chunk in llm.stream_complete(full_prompt, system_prompt=load_system_prompt()):
+                yield from answer.feed(chunk.delta or '')
+                yield from segments.ready()
+
+        yield from answer.finish()
+        yield from segments.ready(wait=True)
+
+        fields = on_answer(answer.text) if on_answer is not None else None
+        yield done_event(answer.text, fields)
+    except Exception as e:
+        yield error_event(e)
+    finally:
+        segments.shutdown()
+
+
+async def astream_chat_events(full_prompt, on_answer=None):
+    """
+    Async generator counterpart of stream_chat_events, for ASGI: LLM chunks
+    are awaited and segments are voiced in threads, so the server can send
+    each event as it is produced without blocking the event loop
+    """
+    segments = _AsyncSegmentQueue()
+    answer = _AnswerText(segments)
+    try:
+        with llm_resilience.guard(), stage('llm_stream'):
+            stream = await llm.astream_complete(full_prompt, system_prompt=load_system_prompt())
+            async for chunk in stream:
+                for event in answer.feed(chunk.delta or ''):
+                    yield event
+                for event in segments.ready():
+                    yield event
+
+        for event in answer.finish():
+            yield event
+        await segments.wait()
+        for event in segments.ready():
+            yield event
+
+        fields = await asyncio.to_thread(on_answer, answer.text) if on_answer is not None else None
+        yield done_event(answer.text, fields)
+    except Exception as e:
+        yield error_event(e)
+    finally:
+        segments.shutdown()
@@ -0,0 +1,122 @@
+"""
+Structured, asynchronous logging for the ai app (wired up by settings.LOGGING).
+
+The chat views used to print the raw request body and parsed data and log
+every step at ERROR level, formatting tracebacks inside the request; under
+load that output was a measurable share of request time. Now:
+
+- BackgroundQueueHandler only puts records on a bounded queue. A listener
+  thread formats them (JSON lines, tracebacks included) and writes them to
+  the stream, so a slow stdout pipe never stalls a request. When the queue is
+  full, records are dropped and counted rather than waited for.
+- Records carry their data as fields: logger.info('chat', extra={'fields':
+  {...}}) becomes one JSON object per line.
+- Bulky per-request detail (question text, answer previews) goes in
+  extra={'verbose': {...}} and is kept only for a LOG_SAMPLE_RATE sample of
+  records, chosen by VerboseSampler.
+- Step-by-step tracing is at DEBUG, below the default LOG_LEVEL.
+
+benchmarks/bench_logging.py compares the per-request cost with the old
+logging.
+"""
+
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# Records waiting for the listener thread before new ones are dropped
+QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and its fields"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if getattr(record, 'sampled', False):
+            entry.update(record.verbose)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class VerboseSampler(logging.Filter):
+    """Keep the verbose fields of a `rate` fraction of the records that have them"""
+
+    def __init__(self, rate=0.01):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'verbose', None):
+            record.sampled = random.random() < self.rate
+        return True
+
+
+class BackgroundQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a listener thread that formats and writes them to `stream`"""
+
+    def __init__(self, stream=None, maxsize=QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.target.setFormatter(JsonFormatter())
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Started on first use, and again in a forked worker (threads don't survive fork)
+        if self._listener_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._listener_pid != os.getpid():
+                self._listener = logging.handlers.QueueListener(self.queue, self.target)
+                self._listener.start()
+                self._listener_pid = os.getpid()
+
+    def prepare(self, record):
+        """
+        Resolve the message now (its arguments may change later) but leave
+        formatting, tracebacks included, to the listener thread
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """
+        Write everything queued so far (the listener is restarted on the next
+        record). logging.shutdown() calls this at exit.
+        """
+        with self._start_lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                self._listener.stop()
+                self._listener_pid = None
+        self.target.flush()
+
+    def close(self):
+        self.flush()
+        self.target.close()
+        super().close()
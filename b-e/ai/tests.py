@@ -1,3 +1,1302 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import importlib
+import io
+import json
+import logging
+import tempfile
+import os
+import re
+import threading
+import time
+import warnings
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import clear_url_caches
+
+from ai import audio_store, mp3, streaming, views
+from ai.answer_cache import normalize_question
+from ai.speech_cache import SCHEMA as SPEECH_CACHE_SCHEMA, speech_cache, text_hash
+from ai.singleflight import SingleFlight
+from ai.prompt_template import PromptTemplate
+from ai.metering import UsageMeter, usage_meter
+from ai.tts_module import TTSModule
+from ai.tts_engine import TTSEngine
+from ai.tts_backends import SyntheticBackend, get_backend
+from ai.markup import IncrementalCleaner, _paragraph_breaks, add_paragraph_breaks, clean_and_segment, clean_wiki_markup
+from ai.segmenter import segment, sentence_spans
+from ai.tts_module import sentence_groups
+from ai.retrieval import Retriever, open_chroma_collection
+from ai.conversation import conversations, estimate_tokens, session_key
+from ai.llm_router import LLMRouter, ModelRoute
+from ai.resilience import CircuitOpenError, Resilient, RetryLater
+from ai.admission import AdmissionRejected, admission
+from ai.timing import metrics
+from ai.structured_logging import BackgroundQueueHandler, VerboseSampler
+from ai.utils import MockLLM
+
+
+# One MPEG-2 Layer III frame as edge-tts sends them: 24 kHz, 48 kbit/s, mono, 0.024 s
+MP3_FRAME = bytes([0xff, 0xf3, 0x64, 0xc0]) + bytes(140)
+
+
+class FakeCommunicate:
+    """Offline edge_tts.Communicate: 0.3 s of frames and one WordBoundary per word"""
+
+    calls = []
+
+    def __init__(self, text, voice, boundary=None):
+        self.text = text
+        FakeCommunicate.calls.append(text)
+
+    async def stream(self):
+        await asyncio.sleep(0.01)
+        # Frame payload derived from the text, so different texts store different clips
+        frame = MP3_FRAME[:4] + hashlib.sha256(self.text.encode('utf-8')).digest().ljust(140, b'\0')
+        for i, word in enumerate(self.text.split()):
+            yield {'type': 'WordBoundary', 'offset': int(i * 0.3 * 10_000_000), 'duration': 2_000_000, 'text': word}
+            yield {'type': 'audio', 'data': frame * 12}  # 12 x 0.024 s = 0.288 s
+
+
+def fake_edge_tts():
+    return mock.patch('ai.tts_backends.edge_tts.Communicate', FakeCommunicate)
+
+
+class IsolatedStorageMixin:
+    """Keep generated audio and shared state out of the real project files during tests"""
+
+    def setUp(self):
+        super().setUp()
+        state_dir = Path(tempfile.mkdtemp(prefix='rq-state-'))
+        patcher = mock.patch('ai.audio_store.AUDIO_DIR', state_dir / 'generated_audio')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(audio_store.flush)  # Background writes land before the directory is unpatched
+        settings_override = override_settings(AI_STATE_DB=state_dir / 'ai_state.sqlite3')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(usage_meter.flush)  # Buffered LLM usage goes to this test's database
+
+
+class ChatStreamTests(IsolatedStorageMixin, TestCase):
+    def post_stream(self, question):
+        with fake_edge_tts():
+            response = self.client.post('/ai/chat/stream/', data={'question': question}, content_type='application/json')
+            body = b''.join(response.streaming_content)
+        return response, [json.loads(line) for line in body.decode('utf-8').splitlines()]
+
+    def test_streams_text_then_audio_then_done(self):
+        response, events = self.post_stream('Tell me about the Hive')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        types = [event['type'] for event in events]
+        self.assertEqual(types[0], 'text')
+        self.assertIn('audio', types)
+        self.assertEqual(types[-1], 'done')
+
+        done = events[-1]
+        streamed_text = ''.join(event['delta'] for event in events if event['type'] == 'text')
+        self.assertEqual(streamed_text, done['text'])
+        audio_events = [event for event in events if event['type'] == 'audio']
+        self.assertEqual([event['segment'] for event in audio_events], list(range(len(audio_events))))
+        self.assertEqual(' '.join(event['text'] for event in audio_events), done['text'].replace('\n\n', ' '))
+
+    def test_missing_question_is_rejected(self):
+        response = self.client.post('/ai/chat/stream/', data={}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class AsgiMixin:
+    """Serve requests through config.asgi.application, with the URLs routed as under ASGI"""
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(SERVER_INTERFACE='asgi')
+        settings_override.enable()
+        self.addCleanup(self.reload_urls)
+        self.addCleanup(settings_override.disable)
+        self.reload_urls()
+
+    @staticmethod
+    def reload_urls():
+        importlib.reload(importlib.import_module('ai.urls'))
+        importlib.reload(importlib.import_module('config.urls'))
+        clear_url_caches()
+
+    async def asgi_request(self, method, path, data=None):
+        """(status, [(perf_counter when sent, body chunk), ...]) for one request"""
+        with mock.patch.dict(os.environ):  # config.asgi sets DJANGO_SERVER_INTERFACE
+            from config.asgi import application
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'raw_path': path.encode('ascii'), 'query_string': b'',
+            'root_path': '', 'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+            'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+        }
+        finished = asyncio.Event()
+        requested = []
+        response = {'status': None, 'chunks': []}
+
+        async def receive():
+            if not requested:
+                requested.append(True)
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message.get('body'):
+                response['chunks'].append((time.perf_counter(), message['body']))
+
+        # As django.test.AsyncClient does: the test's database connection stays open
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            await application(scope, receive, send)
+        finally:
+            finished.set()
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        return response['status'], response['chunks']
+
+
+class AsgiChatStreamTests(AsgiMixin, IsolatedStorageMixin, TestCase):
+    async def test_events_are_sent_while_the_llm_is_still_generating(self):
+        llm_finished = []
+
+        async def astream_complete(prompt, system_prompt=None, **kwargs):
+            async def stream():
+                yield SimpleNamespace(delta='The Hive is sealed. The ')
+                await asyncio.sleep(0.5)
+                yield SimpleNamespace(delta='Red Queen is watching.')
+                llm_finished.append(time.perf_counter())
+            return stream()
+
+        with fake_edge_tts(), mock.patch.object(streaming.llm, 'astream_complete', astream_complete):
+            status, chunks = await self.asgi_request('POST', '/ai/chat/stream/', {'question': 'Tell me about the Hive'})
+
+        self.assertEqual(status, 200)
+        events = [json.loads(line) for _, body in chunks for line in body.decode('utf-8').splitlines()]
+        self.assertEqual(events[0], {'type': 'text', 'delta': 'The Hive is sealed.'})
+        self.assertIn('audio', [event['type'] for event in events])
+        self.assertEqual(events[-1]['type'], 'done')
+        self.assertEqual(events[-1]['text'], 'The Hive is sealed. The Red Queen is watching.')
+        # The first sentence went out before the LLM's half-second pause ended
+        self.assertLess(chunks[0][0], llm_finished[0] - 0.3)
+
+
+class AsgiEndpointTests(AsgiMixin, IsolatedStorageMixin, TestCase):
+    def body(self, chunks):
+        return b''.join(body for _, body in chunks)
+
+    async def test_no_response_is_collected_from_a_sync_iterator(self):
+        with warnings.catch_warnings(record=True) as caught, fake_edge_tts():
+            warnings.simplefilter('always')
+            status, chunks = await self.asgi_request('POST', '/ai/chat/stream/', {'question': 'Hello'})
+            self.assertEqual(status, 200)
+            self.assertEqual(json.loads(self.body(chunks).splitlines()[-1])['type'], 'done')
+
+            status, chunks = await self.asgi_request('POST', '/ai/speak/', {'text': 'Hello there.'})
+            spoken = json.loads(self.body(chunks))
+            self.assertEqual((status, spoken['cached']), (200, False))
+            status, chunks = await self.asgi_request('POST', '/ai/speak/', {'text': 'Hello there.'})
+            self.assertTrue(json.loads(self.body(chunks))['cached'])
+
+            await asyncio.to_thread(audio_store.flush)  # Served from disk, not memory
+            digest = Path(spoken['filename']).stem
+            status, chunks = await self.asgi_request('GET', spoken['audio_url'])
+            self.assertEqual(status, 200)
+            self.assertEqual(self.body(chunks), audio_store.audio_path(digest).read_bytes())
+
+        self.assertEqual([str(w.message) for w in caught if 'synchronous iterators' in str(w.message)], [])
+
+    async def test_waiting_for_a_clip_does_not_hold_up_other_audio_requests(self):
+        ready = await asyncio.to_thread(audio_store.store_bytes, b'clip already on disk', wait=True)
+        data = b'clip written by another worker'
+        digest = hashlib.sha256(data).hexdigest()
+        await asyncio.to_thread(
+            lambda: audio_store.shared_state.connection(audio_store.PENDING_SCHEMA).execute(
+                'INSERT INTO audio_pending (digest, queued) VALUES (?, ?)', (digest, time.time())
+            )
+        )
+        timer = threading.Timer(0.5, audio_store._write_pending, (digest, data, audio_store.AUDIO_DIR))
+        timer.start()
+        self.addCleanup(timer.join, 5)
+
+        started = time.perf_counter()
+        (waited, waited_chunks), (served, served_chunks) = await asyncio.gather(
+            self.asgi_request('GET', audio_store.audio_url(digest)),
+            self.asgi_request('GET', audio_store.audio_url(ready)),
+        )
+        self.assertEqual((waited, self.body(waited_chunks)), (200, data))
+        self.assertEqual((served, self.body(served_chunks)), (200, b'clip already on disk'))
+        # The clip on disk went out before the other one was written
+        self.assertLess(served_chunks[0][0] - started, 0.3)
+
+
+class AsyncChatTests(IsolatedStorageMixin, TestCase):
+    async def test_async_view_returns_voiced_answer(self):
+        request = RequestFactory().post('/ai/chat/', data={'question': 'Hello'}, content_type='application/json')
+        with fake_edge_tts():
+            response = await views.chat_async(request)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        self.assertNotIn('audio', data)
+        self.assertTrue(data['audio_url'].startswith('/ai/audio/'))
+        self.assertEqual(len(data['word_timings']), len(data['text'].split()))
+
+
+class AudioEndpointTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.digest = audio_store.store_bytes(bytes(range(200)), wait=True)
+        self.url = audio_store.audio_url(self.digest)
+
+    def test_full_clip_is_served_with_immutable_caching(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '200')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(200)))
+
+    def test_byte_range_returns_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/200')
+        self.assertEqual(response.content, bytes(range(10, 20)))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.content, bytes(range(195, 200)))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=500-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_unknown_digest_is_not_found_without_waiting(self):
+        started = time.monotonic()
+        self.assertEqual(self.client.get('/ai/audio/' + '0' * 64 + '.mp3').status_code, 404)
+        self.assertLess(time.monotonic() - started, audio_store.WRITE_WAIT / 2)
+
+    def test_waits_for_a_clip_another_worker_is_writing(self):
+        data = b'clip written by another worker'
+        digest = hashlib.sha256(data).hexdigest()
+        # What the other worker's store_bytes records before queueing the write
+        audio_store.shared_state.connection(audio_store.PENDING_SCHEMA).execute(
+            'INSERT INTO audio_pending (digest, queued) VALUES (?, ?)', (digest, time.time())
+        )
+        timer = threading.Timer(0.2, audio_store._write_pending, (digest, data, audio_store.AUDIO_DIR))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        response = self.client.get(audio_store.audio_url(digest))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+        timer.join(5)  # The pending row is cleared just after the file appears
+        self.assertFalse(audio_store.is_pending(digest))
+
+    def test_clip_is_served_from_memory_until_written(self):
+        written = threading.Event()
+        release = threading.Event()
+        write = audio_store._write
+
+        def slow_write(*args):
+            release.wait(5)
+            write(*args)
+            written.set()
+
+        data = b'in memory clip'
+        with mock.patch('ai.audio_store._write', slow_write):
+            digest = audio_store.store_bytes(data, wait=False)
+            self.assertIsNone(audio_store.audio_path(digest))
+            response = self.client.get(audio_store.audio_url(digest))
+            self.assertEqual(response.content, data)
+            response = self.client.get(audio_store.audio_url(digest), HTTP_RANGE='bytes=3-8')
+            self.assertEqual((response.status_code, response.content), (206, data[3:9]))
+            release.set()
+            self.assertTrue(written.wait(5))
+        audio_store.flush()
+        self.assertIsNone(audio_store.pending_clip(digest))
+        self.assertEqual(audio_store.audio_path(digest).read_bytes(), data)
+
+
+class AnswerCacheTests(IsolatedStorageMixin, TestCase):
+    def post_chat(self, question):
+        with fake_edge_tts():
+            return self.client.post('/ai/chat/', data={'question': question}, content_type='application/json')
+
+    def test_repeated_question_skips_the_llm(self):
+        first = self.post_chat('Who is Alice?')
+        with mock.patch.object(views.llm, 'complete', side_effect=AssertionError('LLM called on a cache hit')):
+            second = self.post_chat('  who is   ALICE? ')
+        self.assertEqual(first.json(), second.json())
+        stats = self.client.get('/ai/cache/').json()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+    @override_settings(ANSWER_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = views.answer_cache
+        for question in ('one', 'two'):
+            self.post_chat(question)
+        self.assertIsNotNone(cache.get('one'))  # "two" is now least recently used
+        self.post_chat('three')
+        self.assertIsNone(cache.get('two'))
+        self.assertIsNotNone(cache.get('one'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question('  Who  is\nWesker?! '), 'who is wesker')
+
+
+class SpeakTests(IsolatedStorageMixin, TestCase):
+    def post_speak(self, **data):
+        with fake_edge_tts():
+            return self.client.post('/ai/speak/', data=data, content_type='application/json')
+
+    def test_replaying_a_chat_answer_reuses_its_audio(self):
+        with fake_edge_tts():
+            chat = self.client.post('/ai/chat/', data={'question': 'Hello'}, content_type='application/json').json()
+        with mock.patch.object(views.llm, 'complete', side_effect=AssertionError('LLM called on replay')):
+            response = self.post_speak(text=chat['text_html'])
+        data = response.json()
+        self.assertTrue(data['cached'])
+        self.assertEqual(data['audio_url'], chat['audio_url'])
+        self.assertEqual(data['word_timings'], chat['word_timings'])
+
+    def test_new_text_is_synthesized_once(self):
+        first = self.post_speak(text='The <span class="bg-yellow-300">Hive</span> is sealed.')
+        self.assertFalse(first.json()['cached'])
+        self.assertEqual(first.json()['text'], 'The Hive is sealed.')
+        second = self.post_speak(hash=hashlib.sha256(b'The Hive is sealed.').hexdigest())
+        self.assertTrue(second.json()['cached'])
+        self.assertEqual(second.json()['audio_url'], first.json()['audio_url'])
+
+    @override_settings(SPEECH_CACHE_MAX_ENTRIES=2)
+    def test_entries_are_capped_and_dropped_with_their_clip(self):
+        digests = [audio_store.store_bytes(f"clip {i}".encode()) for i in range(3)]
+        for i, digest in enumerate(digests):
+            speech_cache.remember('voice', f"Line {i}.", digest, [])
+        self.assertIsNone(speech_cache.lookup('voice', 'Line 0.'))  # Least recently used
+        self.assertIsNotNone(speech_cache.lookup('voice', 'Line 1.'))
+        audio_store.flush()
+        audio_store.audio_path(digests[1]).unlink()  # Evicted from the audio store
+        self.assertIsNone(speech_cache.lookup('voice', 'Line 1.'))
+        conn = audio_store.shared_state.connection(SPEECH_CACHE_SCHEMA)
+        self.assertEqual(conn.execute('SELECT text_hash FROM speech_cache').fetchall(), [(text_hash('Line 2.'),)])
+        with override_settings(SPEECH_CACHE_TTL=0):
+            self.assertIsNone(speech_cache.lookup('voice', 'Line 2.'))
+
+    def test_unknown_hash_is_not_found(self):
+        response = self.post_speak(hash='0' * 64)
+        self.assertEqual(response.status_code, 404)
+
+
+class SingleFlightTests(IsolatedStorageMixin, TestCase):
+    def test_concurrent_identical_chats_share_one_llm_call(self):
+        calls = []
+        mock_complete = views.llm.complete
+
+        def slow_complete(prompt, **kwargs):
+            calls.append(prompt)
+            time.sleep(0.2)
+            return mock_complete(prompt, **kwargs)
+
+        factory = RequestFactory()
+        responses = []
+
+        def ask():
+            request = factory.post('/ai/chat/', data={'question': 'Who is Wesker?'}, content_type='application/json')
+            responses.append(views.chat(request))
+
+        with mock.patch.object(views.llm, 'complete', slow_complete), fake_edge_tts():
+            threads = [threading.Thread(target=ask) for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({response.content for response in responses}, {responses[0].content})
+
+    def test_waits_for_a_leader_in_another_process(self):
+        flight = SingleFlight('test', poll_interval=0.01)
+        published = {}
+        self.assertTrue(flight._acquire('key'))  # Another worker is computing 'key'
+
+        def other_worker_finishes():
+            time.sleep(0.1)
+            published['key'] = 'their result'
+            flight._release('key')
+
+        threading.Thread(target=other_worker_finishes).start()
+        result = flight.do('key', compute=lambda: 'our result', lookup=lambda: published.get('key'))
+        self.assertEqual(result, 'their result')
+
+
+class PromptTemplateTests(TestCase):
+    def setUp(self):
+        self.path = Path(tempfile.mkdtemp(prefix='rq-prompt-')) / 'system_prompt.txt'
+        self.path.write_text('Today is {current_date}. Keep {braces} as they are.', encoding='utf-8')
+
+    def test_renders_placeholders_and_caches(self):
+        template = PromptTemplate(self.path)
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.assertEqual(template.render(), f'Today is {today}. Keep {{braces}} as they are.')
+        with mock.patch('builtins.open', side_effect=AssertionError('prompt re-read')):
+            self.assertIs(template.render(), template.render())
+
+    def test_reloads_when_the_file_changes(self):
+        template = PromptTemplate(self.path)
+        template.render()
+        self.path.write_text('Updated prompt', encoding='utf-8')
+        stat = self.path.stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        with mock.patch('ai.prompt_template.time.time', return_value=time.time() + 5):
+            self.assertEqual(template.render(), 'Updated prompt')
+
+    def test_missing_file_renders_none(self):
+        self.assertIsNone(PromptTemplate(self.path.with_name('missing.txt')).render())
+
+
+class UsageMeterTests(IsolatedStorageMixin, TestCase):
+    def test_counts_from_several_workers_are_all_kept(self):
+        workers = [UsageMeter(flush_interval=3600) for _ in range(3)]
+
+        def hammer(meter):
+            for _ in range(200):
+                meter.record('gemini-2.5-flash', latency=0.01)
+            meter.flush()
+
+        threads = [threading.Thread(target=hammer, args=(meter,)) for meter in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        usage = workers[0].usage()
+        self.assertEqual(usage['requests'], 600)
+        self.assertAlmostEqual(usage['by_model']['gemini-2.5-flash']['avg_latency'], 0.01)
+
+    def test_chat_records_llm_calls(self):
+        meter = UsageMeter()
+        with fake_edge_tts(), mock.patch('ai.views.usage_meter', meter), mock.patch('ai.llm_router.usage_meter', meter):
+            self.client.post('/ai/chat/', data={'question': 'Hello'}, content_type='application/json')
+            usage = self.client.get('/ai/usage/').json()
+        self.assertEqual(usage['requests'], 1)
+        self.assertEqual(list(usage['by_model']), [views.llm_model])
+
+    def test_counts_are_flushed_to_the_database_they_were_recorded_for(self):
+        meter = UsageMeter(flush_interval=3600)
+        meter.record('gemini-2.5-flash')
+        with override_settings(AI_STATE_DB=Path(tempfile.mkdtemp(prefix='rq-state-')) / 'ai_state.sqlite3'):
+            meter.record('gemma-3-27b-it')
+            meter.flush()
+            self.assertEqual(list(meter.usage()['by_model']), ['gemma-3-27b-it'])
+        self.assertEqual(list(meter.usage()['by_model']), ['gemini-2.5-flash'])
+
+
+class AudioStoreTests(IsolatedStorageMixin, TestCase):
+    def store_clip(self, data, age):
+        digest = audio_store.store_bytes(data, wait=True)
+        stored_at = time.time() - age
+        os.utime(audio_store.audio_path(digest), (stored_at, stored_at))
+        return digest
+
+    @override_settings(AUDIO_STORE_MAX_BYTES=250)
+    def test_least_recently_used_clips_are_evicted_over_budget(self):
+        oldest = self.store_clip(b'a' * 100, age=300)
+        older = self.store_clip(b'b' * 100, age=200)
+        newer = self.store_clip(b'c' * 100, age=100)
+        audio_store.touch(oldest)  # Served just now
+
+        self.assertEqual(audio_store.evict(), 1)
+        self.assertIsNone(audio_store.audio_path(older))
+        self.assertIsNotNone(audio_store.audio_path(oldest))
+        self.assertIsNotNone(audio_store.audio_path(newer))
+        stats = self.client.get('/ai/audio/stats/').json()
+        self.assertEqual((stats['files'], stats['bytes'], stats['evicted_files']), (2, 200, 1))
+
+    @override_settings(AUDIO_STORE_MAX_AGE=60)
+    def test_expired_clips_and_abandoned_temp_files_are_removed(self):
+        expired = self.store_clip(b'old clip', age=120)
+        abandoned = audio_store.new_temp_path()
+        abandoned.write_bytes(b'half a clip')
+        os.utime(abandoned, (0, 0))
+
+        audio_store.evict()
+        self.assertIsNone(audio_store.audio_path(expired))
+        self.assertFalse(abandoned.exists())
+
+    def test_concurrent_writers_never_share_a_temp_file(self):
+        self.assertNotEqual(audio_store.new_temp_path(), audio_store.new_temp_path())
+
+
+
+class TTSModuleTests(TestCase):
+    def setUp(self):
+        FakeCommunicate.calls = []
+        patcher = fake_edge_tts()
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mp3_duration_counts_frames(self):
+        self.assertAlmostEqual(mp3.duration(MP3_FRAME * 10), 0.24)
+        tagged = b'ID3\x04\x00\x00\x00\x00\x00\x02' + b'\x00\x00'
+        self.assertAlmostEqual(mp3.duration(tagged + MP3_FRAME), 0.024)
+        self.assertEqual(mp3.concat([tagged + MP3_FRAME, tagged + MP3_FRAME]), tagged + MP3_FRAME * 2)
+
+    def test_long_text_is_voiced_in_parallel_sentence_groups(self):
+        sentences = [f"Sentence number {i} is here." for i in range(6)]
+        tts = TTSModule(segment_chars=60)
+        result = asyncio.run(tts.synthesize(' '.join(sentences)))
+
+        self.assertEqual(len(FakeCommunicate.calls), 3)
+        self.assertAlmostEqual(mp3.duration(result['audio']), 30 * 0.288)
+        timings = result['word_timings']
+        self.assertEqual([t['word'] for t in timings], ' '.join(sentences).split())
+        # Each group is 10 words = 2.88 s of audio, so the 11th word starts there
+        self.assertAlmostEqual(timings[10]['start'], 2.88)
+        self.assertAlmostEqual(timings[21]['start'], 2 * 2.88 + 0.3)
+        starts = [t['start'] for t in timings]
+        self.assertEqual(starts, sorted(starts))
+
+    def test_short_text_is_one_call(self):
+        result = asyncio.run(TTSModule().synthesize('Hello there. Goodbye.'))
+        self.assertEqual(FakeCommunicate.calls, ['Hello there. Goodbye.'])
+        self.assertEqual(len(result['word_timings']), 3)
+
+
+class SlowFirstCommunicate(FakeCommunicate):
+    """The first call stalls (a slow handshake); later calls answer normally"""
+
+    async def stream(self):
+        if len(FakeCommunicate.calls) == 1:
+            await asyncio.sleep(2)
+        async for chunk in super().stream():
+            yield chunk
+
+
+class TTSEngineTests(TestCase):
+    def setUp(self):
+        FakeCommunicate.calls = []
+
+    def test_slow_call_is_hedged_and_the_duplicate_wins(self):
+        engine = TTSEngine(hedge_delay=0.05)
+        started = time.monotonic()
+        with mock.patch('ai.tts_backends.edge_tts.Communicate', SlowFirstCommunicate):
+            result = engine.synthesize_sync('Hedge me please.')
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(len(result['word_timings']), 3)
+        stats = engine.stats()
+        self.assertEqual((stats['calls'], stats['hedges'], stats['hedge_wins']), (1, 1, 1))
+
+    def test_call_past_its_deadline_fails(self):
+        # A one-slot pool can't hedge, so the stalled call runs into the deadline
+        engine = TTSEngine(pool_size=1, deadline=0.2, hedge_delay=0.05)
+        with mock.patch('ai.tts_backends.edge_tts.Communicate', SlowFirstCommunicate):
+            with self.assertRaises(TimeoutError):
+                engine.synthesize_sync('Too slow.')
+        stats = engine.stats()
+        self.assertEqual((stats['timeouts'], stats['hedges'], stats['in_flight']), (1, 0, 0))
+
+    def test_async_callers_share_the_engine_loop(self):
+        engine = TTSEngine()
+        with fake_edge_tts():
+            results = asyncio.run(self.gather(engine, ['One.', 'Two words.', 'Now three words.']))
+        self.assertEqual([len(r['word_timings']) for r in results], [1, 2, 3])
+        self.assertEqual(engine.stats()['calls'], 3)
+
+    async def gather(self, engine, texts):
+        return await asyncio.gather(*(engine.synthesize(text) for text in texts))
+
+
+class TTSBackendTests(IsolatedStorageMixin, TestCase):
+    def test_synthetic_backend_is_deterministic_mp3_with_word_timings(self):
+        backend = SyntheticBackend(latency=0)
+        text = 'Hello there, Alice. The Hive is sealed!'
+        audio, timings = asyncio.run(backend.synthesize(text))
+
+        self.assertEqual(asyncio.run(backend.synthesize(text)), (audio, timings))
+        self.assertNotEqual(asyncio.run(backend.synthesize('Hello there, Alice.'))[0][:144], audio[:144])
+        self.assertEqual([t['word'] for t in timings], ['Hello', 'there', 'Alice', 'The', 'Hive', 'is', 'sealed'])
+        starts = [t['start'] for t in timings]
+        self.assertEqual(starts, sorted(starts))
+        # Sentence ends pause longer than word gaps, and the clip outlasts the last word
+        self.assertGreater(timings[3]['start'] - timings[2]['end'], timings[1]['start'] - timings[0]['end'])
+        self.assertGreater(mp3.duration(audio), timings[-1]['end'])
+        self.assertEqual(len(audio) % 144, 0)
+
+    def test_synthetic_latency_is_configurable(self):
+        started = time.monotonic()
+        asyncio.run(SyntheticBackend(latency=0.1).synthesize('Wait for it.'))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+    def test_backend_follows_settings(self):
+        with override_settings(TTS_BACKEND='synthetic'):
+            self.assertEqual(TTSModule().voice, 'synthetic')
+            self.assertIsInstance(get_backend(), SyntheticBackend)
+        self.assertEqual(TTSModule().voice, 'en-GB-MaisieNeural')
+        with self.assertRaises(ImproperlyConfigured):
+            get_backend('festival')
+
+    @override_settings(TTS_BACKEND='synthetic', TTS_SYNTHETIC_LATENCY=0)
+    def test_chat_runs_offline_on_the_synthetic_backend(self):
+        FakeCommunicate.calls = []
+        with fake_edge_tts():
+            response = self.client.post('/ai/chat/', data={'question': 'Who is the Red Queen?'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(FakeCommunicate.calls, [])
+        self.assertTrue(data['audio_url'].startswith('/ai/audio/'))
+        self.assertEqual(len(data['word_timings']), len(data['text'].split()))
+        audio = self.client.get(data['audio_url'])
+        self.assertGreater(mp3.duration(b''.join(audio.streaming_content) if audio.streaming else audio.content),
+                           data['word_timings'][-1]['end'])
+
+
+class WikiMarkupTests(TestCase):
+    corpus = json.loads((Path(__file__).parent / 'testdata' / 'wiki_markup_corpus.json').read_text(encoding='utf-8'))
+
+    def test_output_matches_golden_corpus(self):
+        for case in self.corpus:
+            with self.subTest(case['name']):
+                self.assertEqual(clean_wiki_markup(case['input']), case['expected'])
+
+    def stream(self, text, chunk_size):
+        cleaner = IncrementalCleaner()
+        pieces = []
+        for i in range(0, len(text), chunk_size):
+            pieces += cleaner.feed(text[i:i + chunk_size])
+        return pieces + cleaner.finish()
+
+    def test_incremental_output_does_not_depend_on_chunking(self):
+        text = next(case['input'] for case in self.corpus if case['name'] == 'long_gemini_answer')
+        whole = self.stream(text, len(text))
+        self.assertGreater(len(whole), 5)
+        for chunk_size in (1, 3, 17):
+            self.assertEqual(self.stream(text, chunk_size), whole)
+        self.assertEqual([cleaned for cleaned, _ in whole], [clean_wiki_markup(cleaned) for cleaned, _ in whole])
+
+    def test_incremental_cleaner_waits_for_open_markup_to_close(self):
+        cleaner = IncrementalCleaner()
+        self.assertEqual(cleaner.feed('Intro. {{Quote|Run. Now.'), [('Intro.', ' ')])
+        self.assertEqual(cleaner.feed('}} The **Hive** is sealed.\n\nNext'), [('The Hive is sealed.', '\n\n')])
+        self.assertEqual(cleaner.finish(), [('Next', '')])
+
+
+class SegmenterTests(TestCase):
+    text = "The Hive is sealed. Red Queen watches.\nAlice wakes up.\n\nHowever, the team arrives. e.g. lowercase stays.\n\n"
+
+    def test_sentence_and_paragraph_spans(self):
+        segmented = segment(self.text)
+        self.assertEqual(segmented.sentence_texts(), [
+            'The Hive is sealed.', 'Red Queen watches.', 'Alice wakes up.',
+            'However, the team arrives. e.g. lowercase stays.',
+        ])
+        self.assertEqual(segmented.paragraph_texts(), [
+            'The Hive is sealed. Red Queen watches.\nAlice wakes up.',
+            'However, the team arrives. e.g. lowercase stays.',
+            '',
+        ])
+        self.assertEqual(segmented.html(), self.text.replace('\n', '<br>'))
+
+    def test_spans_match_regex_split(self):
+        text = next(case['input'] for case in WikiMarkupTests.corpus if case['name'] == 'history_article')
+        self.assertEqual(
+            [text[start:end] for start, end in sentence_spans(text)],
+            re.split(r'(?<=[.!?])\s+(?=[A-Z])', text),
+        )
+
+    def test_clean_and_segment_reuses_the_paragraph_spans(self):
+        for case in WikiMarkupTests.corpus:
+            with self.subTest(case['name']):
+                segmented, expected = clean_and_segment(case['input']), segment(clean_wiki_markup(case['input']))
+                self.assertEqual((segmented.text, segmented.paragraphs, segmented.sentences),
+                                 (expected.text, expected.paragraphs, expected.sentences))
+        answer = 'Key facts\n\n' + ' '.join(f"Sentence number {i} is about the Hive." for i in range(12))
+        with mock.patch('ai.markup.segment', side_effect=AssertionError('text segmented twice')):
+            segmented = clean_and_segment(answer)
+        self.assertEqual(segmented.sentence_texts()[:2], ['Key facts', 'Sentence number 0 is about the Hive.'])
+        self.assertEqual(segmented.html(), segment(clean_wiki_markup(answer)).html())
+
+    @staticmethod
+    def regex_paragraph_breaks(text):
+        """add_paragraph_breaks as it was before the segmenter (re.split on sentence ends)"""
+        if len(text) < 200:
+            return text
+        sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text)
+        if len(sentences) < 3:
+            return text
+        transition_words = ['however', 'therefore', 'moreover', 'furthermore', 'additionally',
+                            'consequently', 'similarly', 'likewise', 'in contrast', 'on the other hand',
+                            'meanwhile', 'subsequently', 'accordingly', 'thus', 'hence']
+        paragraphs = []
+        current_paragraph = []
+        for sentence in sentences:
+            current_paragraph.append(sentence.strip())
+            count = len(current_paragraph)
+            combined = ' '.join(current_paragraph)
+            should_break = 2 <= count <= 4 and (
+                len(combined) > 150
+                or any(word in sentence.lower() for word in transition_words)
+                or (count == 2 and len(combined) > 100)
+            )
+            if should_break or count >= 4:
+                paragraphs.append(combined)
+                current_paragraph = []
+        if current_paragraph:
+            paragraphs.append(' '.join(current_paragraph))
+        result = '\n\n'.join(paragraphs)
+        result = re.sub(r'\n{3,}', '\n\n', result)
+        result = re.sub(r' {2,}', ' ', result)
+        return result.strip()
+
+    def test_paragraph_breaks_match_the_regex_implementation(self):
+        sentences = ' '.join(f"Sentence number {i} is about the Hive." for i in range(8))
+        cases = [
+            sentences,
+            '\n\n\n' + sentences + '\n\n\n',
+            sentences.replace(' is ', '  is '),
+            sentences.replace('Hive. ', 'Hive.\n\n\n'),
+            sentences.replace('Hive. ', 'Hive. \n\n '),
+            'Key facts\n\n' + sentences,
+            'Key facts \n\n\n' + sentences,
+        ]
+        for text in cases:
+            with self.subTest(text=text):
+                result, segmented = _paragraph_breaks(text)
+                self.assertEqual(result, self.regex_paragraph_breaks(text))
+                self.assertEqual(add_paragraph_breaks(text), result)
+                if segmented is not None:
+                    expected = segment(result)
+                    self.assertEqual((segmented.paragraphs, segmented.sentences),
+                                     (expected.paragraphs, expected.sentences))
+
+    def test_tts_chunker_uses_the_callers_spans(self):
+        segmented = clean_and_segment(' '.join(f"Sentence number {i} is **here**." for i in range(6)))
+        with mock.patch('ai.tts_module.segment', side_effect=AssertionError('text segmented twice')):
+            groups = sentence_groups(segmented.text, 60, segmented.sentences)
+        self.assertEqual(groups, [
+            'Sentence number 0 is here. Sentence number 1 is here.',
+            'Sentence number 2 is here. Sentence number 3 is here.',
+            'Sentence number 4 is here. Sentence number 5 is here.',
+        ])
+
+
+class FakeCollection:
+    """Chroma collection stand-in: returns the first n documents, optionally slowly"""
+
+    def __init__(self, documents, delay=0.0):
+        self.documents = documents
+        self.delay = delay
+        self.queries = []
+
+    def query(self, query_texts, n_results):
+        self.queries.append((query_texts, n_results))
+        time.sleep(self.delay)
+        return {'documents': [self.documents[:n_results]]}
+
+
+class RetrievalTests(TestCase):
+    documents = ["'''Alice''' escaped the Hive with the antivirus.{{Cite}}", 'The Red Queen sealed the Hive.', 'Umbrella.']
+
+    def test_top_k_chunks_are_cleaned_and_placed_before_the_question(self):
+        collection = FakeCollection(self.documents)
+        retriever = Retriever(open_collection=lambda: collection, top_k=2, budget_ms=1000)
+        chunks = retriever.retrieve('Who escaped the Hive?')
+        self.assertEqual(chunks, ['Alice escaped the Hive with the antivirus.', 'The Red Queen sealed the Hive.'])
+        self.assertEqual(collection.queries, [(['Who escaped the Hive?'], 2)])
+
+        prompt = views.build_full_prompt('Who escaped the Hive?', chunks)
+        self.assertTrue(prompt.startswith('Relevant knowledge from the Resident Evil wiki'))
+        self.assertTrue(prompt.endswith('[2] The Red Queen sealed the Hive.\n\nWho escaped the Hive?'))
+        self.assertNotIn('Umbrella', prompt)
+        self.assertEqual(retriever.stats()['hits'], 1)
+
+    def test_query_over_budget_is_skipped(self):
+        retriever = Retriever(open_collection=lambda: FakeCollection(self.documents, delay=0.3), budget_ms=20)
+        started = time.monotonic()
+        self.assertEqual(retriever.retrieve('Who escaped the Hive?'), [])
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.assertEqual(asyncio.run(retriever.aretrieve('Who escaped the Hive?')), [])
+        stats = retriever.stats()
+        self.assertEqual((stats['queries'], stats['over_budget'], stats['hits']), (2, 2, 0))
+
+    def test_abandoned_queries_do_not_pile_up(self):
+        collection = FakeCollection(self.documents, delay=0.2)
+        retriever = Retriever(open_collection=lambda: collection, budget_ms=20)
+        for _ in range(5):
+            self.assertEqual(retriever.retrieve('Who escaped the Hive?'), [])
+        retriever._executor.submit(lambda: None).result(timeout=5)  # Queue drained
+        self.assertEqual(len(collection.queries), 1)
+        stats = retriever.stats()
+        self.assertEqual((stats['over_budget'], stats['dropped']), (5, 4))
+
+    def test_missing_index_disables_retrieval(self):
+        with tempfile.TemporaryDirectory() as path:
+            retriever = Retriever(open_collection=lambda: open_chroma_collection(path, 'resident_evil_knowledge'))
+            self.assertEqual(retriever.retrieve('Who escaped the Hive?'), [])
+            self.assertEqual(os.listdir(path), [])
+        self.assertEqual(retriever.stats()['disabled'], 1)
+        self.assertEqual(views.build_full_prompt('Hello', []), 'Hello')
+
+
+# Session ids in the format clients generate (see ai/conversation.py)
+SESSION_1 = 'c3Vic2NyaWJlci1zZXNzaW9uLTE'
+SESSION_2 = 'c3Vic2NyaWJlci1zZXNzaW9uLTI'
+
+
+class ConversationTests(IsolatedStorageMixin, TestCase):
+    def post_chat(self, question, session_id):
+        with fake_edge_tts():
+            return self.client.post(
+                '/ai/chat/', data={'question': question, 'session_id': session_id}, content_type='application/json'
+            )
+
+    def test_follow_up_prompt_carries_the_previous_turn(self):
+        first = self.post_chat('Who is Alice?', SESSION_1)
+        prompts = []
+        complete = views.llm.complete
+        with mock.patch.object(views.llm, 'complete', side_effect=lambda prompt, **kwargs: prompts.append(prompt) or complete(prompt, **kwargs)):
+            self.post_chat('Who is Alice?', SESSION_1)  # Same text, but now a follow-up: not a cache hit
+            self.post_chat('Who is Alice?', SESSION_2)  # A new session is answered from the cache
+        self.assertEqual(len(prompts), 1)
+        self.assertIn(f"Recent conversation:\nUser: Who is Alice?\nRed Queen: {first.json()['text']}", prompts[0])
+        self.assertTrue(prompts[0].endswith('\n\nUser: Who is Alice?'))
+        self.assertEqual(len(conversations.context(SESSION_1).turns), 2)
+
+    @override_settings(CONVERSATION_MAX_TURNS=3)
+    def test_older_turns_are_folded_into_the_summary(self):
+        for i in range(10):
+            conversations.record('s', f"Question {i}?", f"Answer {i}. More detail.")
+        context = conversations.context('s')
+        self.assertEqual(context.turns, [(f"Question {i}?", f"Answer {i}. More detail.") for i in (7, 8, 9)])
+        self.assertEqual(context.summary.split('\n'), [f"- Asked: Question {i}? Answered: Answer {i}." for i in range(7)])
+
+    @override_settings(CONVERSATION_TOKEN_BUDGET=400, CONVERSATION_SUMMARY_TOKENS=100)
+    def test_history_stays_within_the_token_budget(self):
+        for i in range(40):
+            conversations.record('s', f"Tell me about B.O.W. number {i}.", f"Specimen {i} escaped. " + 'Detail. ' * 40)
+            self.assertLessEqual(estimate_tokens(conversations.context('s').render()), 420)  # Headers aside
+        context = conversations.context('s')
+        oldest_kept = 40 - len(context.turns)
+        self.assertGreater(len(context.turns), 0)
+        self.assertEqual(context.turns[0][0], f"Tell me about B.O.W. number {oldest_kept}.")
+        self.assertTrue(context.summary.endswith(f"Answered: Specimen {oldest_kept - 1} escaped."))
+
+    @override_settings(CONVERSATION_MAX_TURNS=3)
+    def test_forgetting_from_a_turn_truncates_turns_and_summary(self):
+        turns = [conversations.record('s', f"Question {i}?", f"Answer {i}.") for i in range(8)]
+        self.assertEqual(turns, list(range(1, 9)))
+        conversations.forget('s', from_turn=4)  # Folded into the summary already
+        context = conversations.context('s')
+        self.assertEqual(context.turns, [])
+        self.assertEqual(context.summary.split('\n'), [f"- Asked: Question {i}? Answered: Answer {i}." for i in range(3)])
+        self.assertEqual(conversations.record('s', 'Question 3, edited?', 'Answer.'), 4)
+
+    def test_edited_question_replaces_its_turn(self):
+        first = self.post_chat('Who is Alice?', SESSION_1).json()
+        second = self.post_chat('Who is Wesker?', SESSION_1).json()
+        self.assertEqual((first['turn'], second['turn']), (1, 2))
+        prompts = []
+        complete = views.llm.complete
+        with mock.patch.object(views.llm, 'complete', side_effect=lambda prompt, **kwargs: prompts.append(prompt) or complete(prompt, **kwargs)):
+            with fake_edge_tts():
+                edited = self.client.post('/ai/chat/', data={
+                    'question': 'Who is Albert Wesker?', 'session_id': SESSION_1, 'replaces_turn': second['turn'],
+                }, content_type='application/json').json()
+        self.assertEqual(edited['turn'], 2)
+        self.assertIn('User: Who is Alice?', prompts[0])
+        self.assertNotIn('Who is Wesker?', prompts[0])
+        self.assertEqual([question for question, _ in conversations.context(SESSION_1).turns],
+                         ['Who is Alice?', 'Who is Albert Wesker?'])
+
+    def test_invalid_session_ids_are_ignored(self):
+        self.assertIsNone(session_key(None))
+        self.assertIsNone(session_key(''))
+        self.assertIsNone(session_key(True))
+        self.assertIsNone(session_key('x' * 200))
+        self.assertIsNone(session_key(1712345678901))  # Date.now(): guessable
+        self.assertIsNone(session_key('1712345678901'))
+        self.assertIsNone(session_key(SESSION_1 + ' '))
+        self.assertEqual(session_key('0b7c1e8a-3f4d-4c2b-9a6e-5d8f7e6a1b2c'), '0b7c1e8a-3f4d-4c2b-9a6e-5d8f7e6a1b2c')
+        self.assertEqual(session_key(SESSION_1), SESSION_1)
+
+
+class ContextCacheTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = MockLLM()
+        route = ModelRoute(self.llm, self.llm.caches)
+        self.cache = route.context_cache
+        patchers = [
+            mock.patch.object(views, 'llm', LLMRouter([route])),
+            mock.patch.object(views, 'load_system_prompt', side_effect=lambda: self.system_prompt),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.system_prompt = 'You are the Red Queen. Today is 2026-10-17.'
+
+    def ask(self, question):
+        with fake_edge_tts():
+            return self.client.post('/ai/chat/', data={'question': question}, content_type='application/json')
+
+    def test_system_prompt_is_sent_once_per_cache_lifetime(self):
+        prompts = []
+        complete = self.llm.complete
+        with mock.patch.object(self.llm, 'complete', side_effect=lambda prompt, generation_config=None: (
+                prompts.append((prompt, generation_config)) or complete(prompt, generation_config))):
+            for question in ('Who is Alice?', 'What is the Hive?', 'Who is Wesker?'):
+                self.assertEqual(self.ask(question).status_code, 200)
+        self.assertEqual(self.llm.prefix_sends, 1)
+        self.assertEqual(prompts[0], ('Who is Alice?', {'cached_content': 'cachedContents/mock-1'}))
+        self.assertEqual({config['cached_content'] for _, config in prompts}, {'cachedContents/mock-1'})
+        self.assertEqual(self.cache.stats()['created'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+    def test_changed_prompt_or_expiry_creates_a_new_entry(self):
+        self.ask('Who is Alice?')
+        self.system_prompt = 'You are the Red Queen. Today is 2026-10-18.'  # New day
+        self.ask('What is the Hive?')
+        with override_settings(LLM_CONTEXT_CACHE_TTL=60):
+            self.system_prompt = 'You are the Red Queen, edited.'
+            self.ask('Who is Wesker?')
+            with mock.patch('ai.context_cache.time.time', return_value=time.time() + 61):
+                self.assertEqual(self.cache.generation_config(self.system_prompt), {'cached_content': 'cachedContents/mock-4'})
+        self.assertEqual(self.llm.prefix_sends, 4)
+        self.assertEqual(self.llm.caches.get('cachedContents/mock-2'), 'You are the Red Queen. Today is 2026-10-18.')
+
+    def test_uncacheable_prompt_is_sent_as_system_instruction(self):
+        with mock.patch.object(self.llm.caches, 'create', side_effect=ValueError('400 INVALID_ARGUMENT: too few tokens')):
+            self.ask('Who is Alice?')
+            self.ask('What is the Hive?')
+            self.assertEqual(self.llm.caches.create.call_count, 1)  # Not retried on every request
+        self.assertEqual(self.llm.prefix_sends, 2)
+        self.assertEqual(self.cache.generation_config(self.system_prompt), {'system_instruction': self.system_prompt})
+        self.assertEqual(self.cache.stats()['errors'], 1)
+
+    def test_entry_is_created_without_blocking_other_requests(self):
+        started, release = threading.Event(), threading.Event()
+        create = self.llm.caches.create
+
+        def slow_create(**kwargs):
+            started.set()
+            release.wait(5)
+            return create(**kwargs)
+
+        with mock.patch.object(self.llm.caches, 'create', side_effect=slow_create):
+            creator = threading.Thread(target=self.cache.cached_name, args=(self.system_prompt,))
+            creator.start()
+            self.assertTrue(started.wait(5))
+            # The lock isn't held across the network call, and nobody else creates meanwhile
+            self.assertEqual(self.cache.generation_config(self.system_prompt), {'system_instruction': self.system_prompt})
+            self.assertIsNone(self.cache.stats()['cached_content'])
+            release.set()
+            creator.join(5)
+            self.assertEqual(self.llm.caches.create.call_count, 1)
+        self.assertEqual(self.cache.generation_config(self.system_prompt), {'cached_content': 'cachedContents/mock-1'})
+
+    def test_async_calls_create_the_entry_off_the_event_loop(self):
+        threads = []
+        create = self.llm.caches.create
+        router = LLMRouter([ModelRoute(self.llm, self.llm.caches)])
+        with mock.patch.object(self.llm.caches, 'create', side_effect=lambda **kwargs: (
+                threads.append(threading.current_thread()) or create(**kwargs))):
+            asyncio.run(router.acomplete('Who is Alice?', system_prompt=self.system_prompt))
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+
+@override_settings(LLM_DEADLINE=2, LLM_ATTEMPT_TIMEOUT=0.2, LLM_FAILURE_COOLDOWN=30, LLM_QUOTA_COOLDOWN=60,
+                   LLM_SLOW_LATENCY=0.05, LLM_CONTEXT_CACHE=False)
+class LLMRouterTests(IsolatedStorageMixin, TestCase):
+    def router(self, *models):
+        return LLMRouter([ModelRoute(model, model.caches) for model in models])
+
+    def test_slow_model_fails_over_and_cools_down(self):
+        primary = MockLLM('mock-gemini-2.5-flash', latency=1.0)
+        router = self.router(primary, MockLLM('mock-gemini-2.0-flash-lite'))
+        started = time.monotonic()
+        self.assertIn('You asked', router.complete('Who is Alice?'))
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(router.ordered_routes()[0].name, 'mock-gemini-2.0-flash-lite')
+        stats = router.stats()
+        self.assertEqual((stats['requests'], stats['failovers']), (1, 1))
+        self.assertEqual(stats['models']['mock-gemini-2.5-flash']['timeouts'], 1)
+
+        with mock.patch('ai.llm_router.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(router.ordered_routes()[0].name, 'mock-gemini-2.5-flash')
+
+    def test_quota_error_fails_over_in_sync_async_and_stream_calls(self):
+        quota = Exception("429 RESOURCE_EXHAUSTED. Quota exceeded for gemini-2.5-flash")
+        primary = MockLLM('mock-gemini-2.5-flash', error=quota)
+        fallback = MockLLM('mock-gemini-2.0-flash-lite')
+        for call in (
+            lambda router: router.complete('Tell me a joke'),
+            lambda router: asyncio.run(router.acomplete('Tell me a joke')),
+            lambda router: ''.join(chunk.delta for chunk in router.stream_complete('Tell me a joke')),
+            lambda router: asyncio.run(self.join_astream(router, 'Tell me a joke')),
+        ):
+            router = self.router(primary, fallback)
+            self.assertIn('(Test mode joke)', str(call(router)))
+            self.assertEqual(router.stats()['models']['mock-gemini-2.5-flash']['quota_errors'], 1)
+
+    async def join_astream(self, router, prompt):
+        return ''.join([chunk.delta async for chunk in await router.astream_complete(prompt)])
+
+    def test_exhausted_chain_raises_the_last_error(self):
+        quota = Exception("429 RESOURCE_EXHAUSTED")
+        router = self.router(MockLLM('a', error=quota), MockLLM('b', error=quota))
+        with self.assertRaises(Exception) as raised:
+            router.complete('Hello')
+        self.assertIs(raised.exception, quota)
+        self.assertEqual(router.stats()['exhausted'], 1)
+
+    def test_other_errors_do_not_fail_over(self):
+        fallback = MockLLM('b')
+        router = self.router(MockLLM('a', error=ValueError('400 INVALID_ARGUMENT')), fallback)
+        with mock.patch.object(fallback, 'complete', side_effect=AssertionError('failed over')):
+            with self.assertRaises(ValueError):
+                router.complete('Hello')
+
+    def test_streams_record_time_to_first_chunk_apart_from_whole_calls(self):
+        for astream in (False, True):
+            router = self.router(MockLLM('a'))
+            with mock.patch('ai.llm_router.usage_meter') as meter:
+                if astream:
+                    chunks = asyncio.run(self.join_astream(router, 'Hello'))
+                else:
+                    chunks = []
+                    for chunk in router.stream_complete('Hello'):
+                        chunks.append(chunk)
+                        time.sleep(0.01)  # A client reading slowly
+                self.assertTrue(chunks)
+                stats = router.stats()['models']['a']
+                self.assertIsNone(stats['latency_p50'])
+                self.assertIsNotNone(stats['first_chunk_p50'])
+                self.assertEqual(stats['calls'], 1)
+                meter.record.assert_called_once_with('a', mock.ANY, error=False)
+                if not astream:
+                    self.assertGreater(meter.record.call_args[0][1], stats['first_chunk_p50'])
+
+    def test_slow_models_are_tried_after_fast_ones(self):
+        router = self.router(MockLLM('slow'), MockLLM('fast'))
+        for _ in range(5):
+            router.routes[0].record_success(0.08)
+        self.assertEqual([route.name for route in router.ordered_routes()], ['fast', 'slow'])
+
+
+@override_settings(RETRY_ATTEMPTS=3, RETRY_BASE_DELAY=0.01, RETRY_MAX_DELAY=0.02, BREAKER_ERROR_RATE=0.5,
+                   BREAKER_WINDOW=60, BREAKER_MIN_CALLS=4, BREAKER_OPEN_SECONDS=30)
+class ResilienceTests(IsolatedStorageMixin, TestCase):
+    def failing(self, *args, **kwargs):
+        raise ValueError('500 INTERNAL')
+
+    def test_breaker_opens_past_the_error_rate_and_fails_fast(self):
+        policy = Resilient('test')
+        for _ in range(4):
+            with self.assertRaises(ValueError):
+                policy.call(2, self.failing)  # Last attempt: the error itself is raised
+        calls = mock.Mock()
+        with self.assertRaises(CircuitOpenError) as raised:
+            policy.call(0, calls)
+        calls.assert_not_called()
+        self.assertGreater(raised.exception.retry_after, 29)
+        self.assertEqual(policy.stats()['state'], 'open')
+
+        # After the open period one probe goes through; its success closes the breaker
+        with mock.patch('ai.resilience.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertEqual(policy.stats()['state'], 'half_open')
+            self.assertEqual(policy.call(0, lambda: 'ok'), 'ok')
+        self.assertEqual(policy.stats()['state'], 'closed')
+
+    def test_sync_retry_is_handed_to_the_client(self):
+        policy = Resilient('test')
+        with self.assertRaises(RetryLater) as raised:
+            policy.call(0, self.failing)
+        self.assertLessEqual(raised.exception.retry_after, 0.01)
+        self.assertIsInstance(raised.exception.cause, ValueError)
+
+    def test_chat_answers_503_with_retry_after_instead_of_sleeping(self):
+        with mock.patch('ai.views.llm_resilience', Resilient('llm')), \
+                mock.patch.object(views.llm, 'complete', side_effect=self.failing), \
+                mock.patch('time.sleep', side_effect=AssertionError('slept')):
+            response = self.client.post('/ai/chat/', data={'question': 'Hello'}, content_type='application/json')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(response.json()['retry_after'], 1)
+
+            response = self.client.post('/ai/chat/', data={'question': 'Hello', 'attempt': 2},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 500)
+            self.assertFalse(response.has_header('Retry-After'))
+
+    def test_async_calls_retry_with_backoff(self):
+        policy = Resilient('test')
+        fn = mock.AsyncMock(side_effect=[ValueError('500 INTERNAL'), 'answer'])
+        self.assertEqual(asyncio.run(policy.acall(fn, 'prompt')), 'answer')
+        self.assertEqual(fn.await_count, 2)
+        self.assertEqual(policy.stats()['retries'], 1)
+
+    def test_breakers_endpoint(self):
+        data = self.client.get('/ai/breakers/').json()
+        self.assertEqual(set(data), {'llm', 'tts'})
+        self.assertIn(data['llm']['state'], ('closed', 'open', 'half_open'))
+
+
+@override_settings(ADMISSION_ENABLED=True, ADMISSION_CLIENT_RATE=6, ADMISSION_CLIENT_BURST=2, LLM_DAILY_QUOTA=1000,
+                   ADMISSION_GLOBAL_BURST=10, ADMISSION_MAX_WAIT=0, ADMISSION_TRUST_FORWARDED=False)
+class AdmissionTests(IsolatedStorageMixin, TestCase):
+    def chat(self, question, **extra):
+        with fake_edge_tts():
+            return self.client.post('/ai/chat/', data={'question': question}, content_type='application/json', **extra)
+
+    def test_client_over_its_burst_is_rejected_with_retry_after(self):
+        for question in ('Who is Alice?', 'Who is Wesker?'):
+            self.assertEqual(self.chat(question).status_code, 200)
+        response = self.chat('Who is Leon?')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '10')  # One token per 10 s at 6 per minute
+        self.assertEqual(response.json()['retry_after'], 10)
+        # Other clients have their own buckets
+        self.assertEqual(self.chat('Who is Leon?', REMOTE_ADDR='10.0.0.2').status_code, 200)
+        self.assertEqual(admission.stats()['rejected'], {'ip': 1})
+
+    @override_settings(ADMISSION_CLIENT_RATE=120, ADMISSION_CLIENT_BURST=1, ADMISSION_MAX_WAIT=1)
+    def test_short_waits_are_queued(self):
+        request = RequestFactory().post('/ai/chat/')
+        self.assertEqual(admission.reserve(admission.client_buckets(request)), 0)
+        self.assertAlmostEqual(admission.reserve(admission.client_buckets(request)), 0.5, places=1)
+        self.assertAlmostEqual(admission.reserve(admission.client_buckets(request)), 1.0, places=1)
+        with self.assertRaises(AdmissionRejected):
+            admission.reserve(admission.client_buckets(request))
+        self.assertEqual(admission.stats()['queued'], 2)
+
+    @override_settings(LLM_DAILY_QUOTA=2)
+    def test_only_llm_calls_spend_the_daily_budget(self):
+        self.assertEqual(self.chat('Who is Alice?').status_code, 200)
+        self.assertEqual(self.chat('Who is Alice?', REMOTE_ADDR='10.0.0.2').status_code, 200)  # Answer cache hit
+        self.assertEqual(self.chat('Who is Wesker?', REMOTE_ADDR='10.0.0.2').status_code, 200)
+        self.assertEqual(admission.stats()['llm_calls_admitted_today'], 2)
+
+        response = self.chat('Who is Leon?', REMOTE_ADDR='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(response.json()['retry_after'], 0)
+        self.assertEqual(admission.stats()['rejected'], {'daily': 1})
+
+    def test_rejected_requests_are_not_charged(self):
+        request = RequestFactory().post('/ai/chat/')
+        buckets = admission.client_buckets(request, SESSION_1) + admission.quota_buckets()
+        admission.reserve(buckets)
+        admission.reserve(buckets)
+        with self.assertRaises(AdmissionRejected) as raised:
+            admission.reserve(buckets)
+        self.assertEqual(raised.exception.reason, 'ip')
+        self.assertEqual(admission.stats()['llm_calls_admitted_today'], 2)
+
+
+class TimingTests(IsolatedStorageMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset()
+
+    def test_chat_reports_its_stages_in_server_timing(self):
+        with fake_edge_tts():
+            response = self.client.post('/ai/chat/', data={'question': 'Hello'}, content_type='application/json')
+        stages = dict(item.split(';dur=') for item in response['Server-Timing'].split(', '))
+        for name in ('admission', 'cache', 'retrieval', 'llm', 'markup', 'tts', 'store', 'serialize'):
+            self.assertGreaterEqual(float(stages[name]), 0)
+
+        text = self.client.get('/ai/metrics/').content.decode('utf-8')
+        self.assertIn('# TYPE red_queen_stage_seconds summary', text)
+        self.assertRegex(text, r'red_queen_stage_seconds\{stage="tts",quantile="0.95"\} \d+\.\d+')
+        self.assertIn('red_queen_ttfb_seconds_count{endpoint="chat"} 1', text)
+        self.assertIn('red_queen_first_audio_seconds_count{endpoint="chat"} 1', text)
+        self.assertIn('red_queen_request_seconds_count{endpoint="chat"} 1', text)
+
+    def test_stream_marks_first_byte_and_first_audio(self):
+        with fake_edge_tts():
+            response = self.client.post('/ai/chat/stream/', data={'question': 'Tell me about the Hive'},
+                                        content_type='application/json')
+            self.assertIn('retrieval;dur=', response['Server-Timing'])
+            b''.join(response.streaming_content)
+        snapshot = metrics.snapshot()
+        endpoint = (('endpoint', 'chat_stream'),)
+        ttfb, first_audio, total = (snapshot[name][endpoint][0][0] for name in ('ttfb', 'first_audio', 'request'))
+        self.assertLessEqual(ttfb, first_audio)
+        self.assertLessEqual(first_audio, total)
+        self.assertEqual(snapshot['stage'][(('stage', 'llm_stream'),)][1], 1)
+
+    def test_quantiles_over_recent_samples(self):
+        for ms in range(1, 101):
+            metrics.observe('stage', ms / 1000, stage='llm')
+        text = metrics.prometheus()
+        self.assertIn('red_queen_stage_seconds{stage="llm",quantile="0.5"} 0.050000', text)
+        self.assertIn('red_queen_stage_seconds{stage="llm",quantile="0.99"} 0.099000', text)
+        self.assertIn('red_queen_stage_seconds_sum{stage="llm"} 5.050000', text)
+
+
+class StructuredLoggingTests(IsolatedStorageMixin, TestCase):
+    def handler(self, rate):
+        stream = io.StringIO()
+        handler = BackgroundQueueHandler(stream)
+        handler.addFilter(VerboseSampler(rate))
+        test_logger = logging.getLogger(f'ai.tests.structured.{rate}')
+        test_logger.propagate = False
+        test_logger.addHandler(handler)
+        self.addCleanup(test_logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return test_logger, handler, stream
+
+    def lines(self, handler, stream):
+        handler.flush()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_records_are_written_as_json_by_the_listener_thread(self):
+        test_logger, handler, stream = self.handler(rate=1.0)
+        writers = []
+        handler.target.emit = mock.Mock(side_effect=lambda record, emit=handler.target.emit: (
+            writers.append(threading.current_thread()), emit(record)))
+        test_logger.warning('chat %s', 'failed', extra={'fields': {'status': 500}, 'verbose': {'question': 'Hi'}})
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            test_logger.exception('Unexpected error')
+
+        first, second = self.lines(handler, stream)
+        self.assertEqual((first['level'], first['message'], first['status'], first['question']),
+                         ('WARNING', 'chat failed', 500, 'Hi'))
+        self.assertIn('ValueError: boom', second['exception'])
+        self.assertNotIn(threading.current_thread(), writers)
+
+    def test_verbose_fields_are_sampled(self):
+        test_logger, handler, stream = self.handler(rate=0.0)
+        test_logger.info('chat', extra={'fields': {'status': 200}, 'verbose': {'question': 'Hi'}})
+        [line] = self.lines(handler, stream)
+        self.assertEqual(line['status'], 200)
+        self.assertNotIn('question', line)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        test_logger, handler, stream = self.handler(rate=0.0)
+        handler._ensure_listener = lambda: None  # No listener draining the queue
+        handler.queue.maxsize = 2
+        for i in range(5):
+            test_logger.info('chat %d', i)
+        self.assertEqual(handler.dropped, 3)
+
+    def test_chat_logs_one_info_line(self):
+        with fake_edge_tts(), self.assertLogs('ai.views', 'DEBUG') as logs:
+            self.client.post('/ai/chat/', data={'question': 'Hello'}, content_type='application/json')
+        chat_records = [record for record in logs.records if record.getMessage() == 'chat']
+        self.assertEqual(len(chat_records), 1)
+        self.assertEqual(chat_records[0].fields['status'], 200)
+        self.assertFalse([record for record in logs.records if record.levelno >= logging.ERROR])
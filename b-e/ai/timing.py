@@ -0,0 +1,247 @@
+"""
+Per-stage latency of chat requests: Server-Timing headers and /ai/metrics/.
+
+Views decorated with @timed(endpoint) get a RequestTimer for the request.
+Code anywhere on the request path wraps its steps in `with stage('llm'):`;
+the duration goes to the current request's timer (if any) and to the stage's
+summary. When the view returns, the stages measured so far are sent as a
+Server-Timing header, so browser dev tools show where a slow chat spent its
+time. Besides the stages, each request records:
+
+- ttfb: until the first byte of the response is ready (the whole JSON
+  response, or the first event of a stream);
+- first_audio: until the first voiced audio can be fetched (the JSON answer
+  with its audio_url, or a stream's first audio event);
+- request: until the response is complete.
+
+/ai/metrics/ renders the summaries in the Prometheus text format, with
+p50/p95/p99 over each series' latest SAMPLE_WINDOW samples plus all-time
+_sum and _count. Like the other stats, metrics are per worker process.
+"""
+
+import contextvars
+import inspect
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from .percentiles import percentile
+
+# Recent samples per series used for the quantiles
+SAMPLE_WINDOW = 1000
+QUANTILES = (50, 95, 99)
+
+_current = contextvars.ContextVar('request_timer', default=None)
+
+
+class Summary:
+    def __init__(self):
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Metrics:
+    """Latency summaries keyed by metric name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}  # (name, labels) -> Summary
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._series.get(key)
+            if summary is None:
+                summary = self._series[key] = Summary()
+            summary.samples.append(seconds)
+            summary.count += 1
+            summary.sum += seconds
+
+    def snapshot(self):
+        """{name: {labels: (samples, count, sum)}}"""
+        with self._lock:
+            snapshot = {}
+            for (name, labels), summary in sorted(self._series.items()):
+                snapshot.setdefault(name, {})[labels] = (list(summary.samples), summary.count, summary.sum)
+            return snapshot
+
+    def prometheus(self):
+        """All summaries in the Prometheus text exposition format"""
+        lines = []
+        for name, series in self.snapshot().items():
+            metric = f"red_queen_{name}_seconds"
+            lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {metric} summary")
+            for labels, (samples, count, total) in series.items():
+                for pct in QUANTILES:
+                    quantile = (*labels, ('quantile', str(pct / 100)))
+                    lines.append(f"{metric}{format_labels(quantile)} {percentile(samples, pct):.6f}")
+                lines.append(f"{metric}_sum{format_labels(labels)} {total:.6f}")
+                lines.append(f"{metric}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+HELP = {
+    'stage': 'Time spent in each stage of a chat request',
+    'ttfb': 'Time until the first byte of the response is ready',
+    'first_audio': 'Time until the first audio of the answer can be fetched',
+    'request': 'Time until the response is complete',
+}
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+metrics = Metrics()
+
+
+class RequestTimer:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> seconds, in the order first measured
+        self.marks = {}  # 'ttfb' / 'first_audio' -> seconds since the start
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def mark(self, name):
+        """Record the time since the start as `name`, once per request"""
+        with self._lock:
+            if name in self.marks:
+                return
+            self.marks[name] = time.perf_counter() - self.started
+        metrics.observe(name, self.marks[name], endpoint=self.endpoint)
+
+    def server_timing(self):
+        """Server-Timing header value for the stages measured so far"""
+        with self._lock:
+            stages = list(self.stages.items())
+        return ', '.join(f"{server_timing_name(name)};dur={seconds * 1000:.1f}" for name, seconds in stages)
+
+    def finish(self):
+        metrics.observe('request', time.perf_counter() - self.started, endpoint=self.endpoint)
+
+
+def server_timing_name(name):
+    return re.sub(r'[^A-Za-z0-9_-]', '_', name)
+
+
+@contextmanager
+def stage(name):
+    """Time a step of the current request (errors included)"""
+    timer = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.observe('stage', seconds, stage=name)
+        if timer is not None:
+            timer.add(name, seconds)
+
+
+def mark(name):
+    """Mark ttfb / first_audio on the current request, if it is timed"""
+    timer = _current.get()
+    if timer is not None:
+        timer.mark(name)
+
+
+def elapsed():
+    """Seconds since the current request started (0 outside a timed request)"""
+    timer = _current.get()
+    return time.perf_counter() - timer.started if timer is not None else 0.0
+
+
+def _respond(timer, response):
+    """Add Server-Timing; streams are observed as the server consumes them"""
+    if response.streaming:
+        response['Server-Timing'] = timer.server_timing()
+        observe = _aobserve_stream if response.is_async else _observe_stream
+        response.streaming_content = observe(timer, response.streaming_content)
+        return response
+    timer.mark('ttfb')
+    response['Server-Timing'] = timer.server_timing()
+    timer.finish()
+    return response
+
+
+def _observe_stream(timer, content):
+    """
+    Iterate a streaming body with the request's timer current, so stages and
+    marks inside the generator are attributed to the request
+    """
+    iterator = iter(content)
+    try:
+        while True:
+            token = _current.set(timer)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _current.reset(token)
+            timer.mark('ttfb')
+            yield chunk
+    finally:
+        timer.finish()
+
+
+async def _aobserve_stream(timer, content):
+    """_observe_stream for async streaming bodies"""
+    iterator = aiter(content)
+    try:
+        while True:
+            token = _current.set(timer)
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                return
+            finally:
+                _current.reset(token)
+            timer.mark('ttfb')
+            yield chunk
+    finally:
+        timer.finish()
+
+
+def timed(endpoint):
+    """Decorator for (sync or async) views whose stages should be timed"""
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                timer = RequestTimer(endpoint)
+                token = _current.set(timer)
+                try:
+                    response = await view(request, *args, **kwargs)
+                finally:
+                    _current.reset(token)
+                return _respond(timer, response)
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            timer = RequestTimer(endpoint)
+            token = _current.set(timer)
+            try:
+                response = view(request, *args, **kwargs)
+            finally:
+                _current.reset(token)
+            return _respond(timer, response)
+        return wrapper
+    return decorator
@@ -0,0 +1,147 @@
+"""
+Speech backends behind TTSModule, chosen with settings.TTS_BACKEND.
+
+A backend voices one segment of text: `await backend.synthesize(text)`
+returns (MP3 bytes, word timings in seconds from the start of the clip).
+TTSModule does everything around that call: it splits long answers into
+sentence groups, stitches the clips together and shifts their timings, and
+TTSEngine adds deadlines, hedging and retries. Clips are cached under the
+backend's `voice`, so switching backends never serves one backend's audio
+for another.
+
+- "edge": Microsoft's online voices through edge-tts (the default).
+- "synthetic": offline and deterministic. It returns silent MP3 frames as
+  long as the text would take to say, with word boundaries spaced by word
+  length and punctuation, after TTS_SYNTHETIC_LATENCY seconds (plus
+  TTS_SYNTHETIC_CHAR_LATENCY per character). End-to-end tests and load
+  tests can use it to run without the network.
+
+Other backends are registered with @register_backend(name). TTS_BACKEND can
+also be the dotted path of a backend class.
+"""
+
+import asyncio
+import hashlib
+import math
+import string
+
+import edge_tts
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+BACKENDS = {}
+
+
+def register_backend(name):
+    """Class decorator: make a backend selectable as TTS_BACKEND = name"""
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def get_backend(name=None):
+    """A new instance of the backend called `name` (default settings.TTS_BACKEND)"""
+    name = name or settings.TTS_BACKEND
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    if '.' in name:
+        return import_string(name)()
+    raise ImproperlyConfigured(f"Unknown TTS_BACKEND {name!r}; choose from {', '.join(sorted(BACKENDS))}")
+
+
+class TTSBackend:
+    name = None
+    voice = None  # Clips are cached under this
+
+    async def synthesize(self, text):
+        """One call: (MP3 bytes, word timings relative to the clip start)"""
+        raise NotImplementedError
+
+
+@register_backend('edge')
+class EdgeTTSBackend(TTSBackend):
+    # Use the British child female voice that best matches the reference
+    voice = "en-GB-MaisieNeural"  # British child female voice
+
+    async def synthesize(self, text):
+        communicate = edge_tts.Communicate(text, self.voice, boundary="WordBoundary")
+
+        audio = bytearray()
+        word_timings = []
+
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                audio += chunk["data"]
+            elif chunk["type"] == "WordBoundary":
+                start_seconds = chunk["offset"] / 10_000_000  # Convert to seconds
+                end_seconds = (chunk["offset"] + chunk["duration"]) / 10_000_000
+                word = chunk["text"]
+                word_timings.append({
+                    "word": word,
+                    "start": start_seconds,
+                    "end": end_seconds
+                })
+
+        return audio, word_timings
+
+
+# The synthetic voice's pace: seconds per character of a word (at least
+# MIN_WORD_SECONDS), the gap after each word and the longer pauses after
+# punctuation, with silence before the first word and after the last
+SECONDS_PER_CHAR = 0.07
+MIN_WORD_SECONDS = 0.12
+WORD_GAP = 0.05
+PAUSES = {',': 0.15, ';': 0.2, ':': 0.2, '.': 0.35, '!': 0.35, '?': 0.35}
+LEAD_IN = 0.1
+TAIL = 0.3
+
+# Frames as edge-tts sends them: MPEG-2 Layer III, 24 kHz, 48 kbit/s, mono.
+# 144 bytes each: the header, 9 bytes of zeroed side information (no main
+# data, so the frame decodes to silence) and ancillary bytes
+FRAME_HEADER = bytes([0xff, 0xf3, 0x64, 0xc0])
+FRAME_BYTES = 144
+SIDE_INFO_BYTES = 9
+FRAME_SECONDS = 576 / 24000
+
+
+def synthetic_timings(text):
+    """Word timings of `text` at the synthetic voice's pace, and the clip's length"""
+    word_timings = []
+    position = LEAD_IN
+    for token in text.split():
+        word = token.strip(string.punctuation)
+        if not word:
+            continue  # Lone punctuation ("-", "...") isn't spoken
+        length = max(MIN_WORD_SECONDS, len(word) * SECONDS_PER_CHAR)
+        word_timings.append({"word": word, "start": round(position, 3), "end": round(position + length, 3)})
+        position += length + WORD_GAP + PAUSES.get(token[-1], 0.0)
+    return word_timings, position + TAIL
+
+
+def silent_frames(seconds, text):
+    """Silent MP3 frames lasting `seconds` (rounded up to whole frames)"""
+    # The text's digest as ancillary data, so different texts make different clips
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    ancillary_bytes = FRAME_BYTES - len(FRAME_HEADER) - SIDE_INFO_BYTES
+    ancillary = (digest * math.ceil(ancillary_bytes / len(digest)))[:ancillary_bytes]
+    frame = FRAME_HEADER + bytes(SIDE_INFO_BYTES) + ancillary
+    return bytearray(frame * math.ceil(seconds / FRAME_SECONDS))
+
+
+@register_backend('synthetic')
+class SyntheticBackend(TTSBackend):
+    voice = "synthetic"
+
+    def __init__(self, latency=None, char_latency=None):
+        self.latency = settings.TTS_SYNTHETIC_LATENCY if latency is None else latency
+        self.char_latency = settings.TTS_SYNTHETIC_CHAR_LATENCY if char_latency is None else char_latency
+
+    async def synthesize(self, text):
+        delay = self.latency + self.char_latency * len(text)
+        if delay:
+            await asyncio.sleep(delay)
+        word_timings, seconds = synthetic_timings(text)
+        return silent_frames(seconds, text), word_timings
@@ -0,0 +1,158 @@
+"""
+Process-wide TTS engine with deadlines and hedged requests.
+
+Every chat used to build its own TTSModule and, in the sync views, its own
+event loop just to drive edge-tts. The engine instead keeps one warm event
+loop on a background thread for the lifetime of the worker; all synthesis
+runs there, sync callers block on it and async callers await it, so the loop,
+its executor and the resolver state are set up once.
+
+edge-tts opens a fresh websocket per Communicate (its ClientSession owns and
+closes the connector), so connections themselves can't be pooled. What the
+engine controls is the tail: each edge-tts call has a deadline, at most
+TTS_POOL_SIZE calls run at once, and a call that is slower than the
+TTS_HEDGE_PERCENTILE of recent calls gets a duplicate request - whichever
+answers first wins and the other is cancelled. Hedges are only issued while
+the pool has a free slot, so they never pile onto an overloaded worker.
+
+The same applies to any backend selected by TTS_BACKEND (ai/tts_backends.py).
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from .percentiles import percentile
+from .resilience import Resilient
+from .tts_module import TTSModule
+
+# Successful call latencies kept for the hedge percentile
+LATENCY_WINDOW = 200
+# Calls needed before the percentile replaces TTS_HEDGE_DELAY
+MIN_SAMPLES = 20
+# Never hedge sooner than this, however fast recent calls were
+MIN_HEDGE_DELAY = 0.25
+
+# Retries and circuit breaker around each segment (see ai/resilience.py). A call
+# that hit its deadline isn't retried; the views fall back to an error message
+tts_resilience = Resilient('tts', retryable=lambda error: not isinstance(error, TimeoutError),
+                           attempts=2, base_delay=0.25, max_delay=2.0)
+
+
+class TTSEngine(TTSModule):
+    def __init__(self, pool_size=None, deadline=None, hedge_percentile=None, hedge_delay=None, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_size = pool_size or settings.TTS_POOL_SIZE
+        self.deadline = deadline or settings.TTS_DEADLINE
+        self.hedge_percentile = hedge_percentile or settings.TTS_HEDGE_PERCENTILE
+        self.initial_hedge_delay = hedge_delay or settings.TTS_HEDGE_DELAY
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counts = {'calls': 0, 'errors': 0, 'timeouts': 0, 'hedges': 0, 'hedge_wins': 0}
+        self._in_flight = 0
+        self._start_lock = threading.Lock()
+        self._loop = None
+        self._pool = None
+
+    # The engine's event loop
+
+    def _engine_loop(self):
+        with self._start_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='tts-engine', daemon=True).start()
+                self._pool = asyncio.Semaphore(self.pool_size)
+                self._loop = loop
+        return self._loop
+
+    async def synthesize(self, text: str, sentences=None) -> dict:
+        """TTSModule.synthesize, run on the engine's loop (awaitable from any loop)"""
+        loop = self._engine_loop()
+        if asyncio.get_running_loop() is loop:
+            return await super().synthesize(text, sentences)
+        future = asyncio.run_coroutine_threadsafe(super().synthesize(text, sentences), loop)
+        return await asyncio.wrap_future(future)
+
+    def synthesize_sync(self, text: str, sentences=None) -> dict:
+        """Blocking synthesize for sync views and worker threads"""
+        future = asyncio.run_coroutine_threadsafe(super().synthesize(text, sentences), self._engine_loop())
+        return future.result()
+
+    # Hedged, deadline-bound edge-tts calls (always on the engine loop)
+
+    def hedge_delay(self):
+        """Seconds to wait on a call before hedging it"""
+        if len(self._latencies) < MIN_SAMPLES:
+            return self.initial_hedge_delay
+        return max(MIN_HEDGE_DELAY, percentile(self._latencies, self.hedge_percentile))
+
+    async def _attempt(self, text):
+        async with self._pool:
+            self._in_flight += 1
+            started = time.monotonic()
+            try:
+                result = await super()._synthesize_segment(text)
+            finally:
+                self._in_flight -= 1
+            self._latencies.append(time.monotonic() - started)
+            return result
+
+    async def _synthesize_segment(self, text):
+        return await tts_resilience.acall(self._hedged_segment, text)
+
+    async def _hedged_segment(self, text):
+        self._counts['calls'] += 1
+        deadline = time.monotonic() + self.deadline
+        hedge_at = time.monotonic() + self.hedge_delay()
+        primary = asyncio.ensure_future(self._attempt(text))
+        attempts = {primary}
+        hedged = False
+        error = None
+        try:
+            while attempts:
+                wake_at = deadline if hedged else min(hedge_at, deadline)
+                done, _ = await asyncio.wait(
+                    attempts, timeout=max(0.0, wake_at - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    attempts.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._counts['hedge_wins'] += 1
+                        return task.result()
+                    error = task.exception()
+                if time.monotonic() >= deadline:
+                    self._counts['timeouts'] += 1
+                    raise TimeoutError(f"TTS call exceeded its {self.deadline}s deadline")
+                if not done and not hedged and not self._pool.locked():
+                    self._counts['hedges'] += 1
+                    attempts.add(asyncio.ensure_future(self._attempt(text)))
+                    hedged = True
+                elif not done:
+                    hedged = True  # Pool is full: wait out the deadline instead
+            self._counts['errors'] += 1
+            raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def stats(self):
+        """Pool occupancy, hedge counters and recent latency percentiles (this worker)"""
+        latencies = list(self._latencies)
+        stats = {
+            'backend': self.backend.name,
+            'pool_size': self.pool_size,
+            'in_flight': self._in_flight,
+            'deadline_seconds': self.deadline,
+            'hedge_percentile': self.hedge_percentile,
+            'hedge_delay_seconds': round(self.hedge_delay(), 4),
+            **self._counts,
+        }
+        for pct in (50, 95, 99):
+            stats[f'latency_p{pct}'] = round(percentile(latencies, pct), 4) if latencies else None
+        return stats
+
+
+tts_engine = TTSEngine()
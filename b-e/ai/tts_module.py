@@ -3,53 +3,112 @@ Simple British Child Female Voice TTS Module
 """
 
 import asyncio
-import edge_tts
-from pathlib import Path
-import time
+
+from . import audio_store, mp3
+from .segmenter import segment
+from .tts_backends import get_backend
+
+# Long answers are voiced as groups of whole sentences of about this many
+# characters, synthesized concurrently and stitched back together
+SEGMENT_CHARS = 300
+MAX_CONCURRENCY = 4
+
+
+def sentence_groups(text, target_chars=SEGMENT_CHARS, sentences=None):
+    """
+    Split text into runs of whole sentences of roughly target_chars each.
+    `sentences` are the text's sentence spans if the caller already has them
+    (see ai/segmenter.py); groups are slices of the text between them.
+    """
+    if sentences is None:
+        sentences = segment(text).sentences
+    groups = []
+    group_start = group_end = None
+    for start, end in sentences:
+        if group_start is not None and (group_end - group_start) + (end - start) >= target_chars:
+            groups.append(text[group_start:group_end])
+            group_start = None
+        if group_start is None:
+            group_start = start
+        group_end = end
+    if group_start is not None:
+        groups.append(text[group_start:group_end])
+    return groups
+
 
 class TTSModule:
-    def __init__(self):
-        # Use the British child female voice that best matches the reference
-        self.voice = "en-GB-MaisieNeural"  # British child female voice
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, segment_chars=SEGMENT_CHARS, backend=None):
+        self.max_concurrency = max_concurrency
+        self.segment_chars = segment_chars  # None voices the text in one call
+        self._backend = backend  # None follows settings.TTS_BACKEND (see ai/tts_backends.py)
 
-    async def generate_speech_with_timings(self, text: str) -> dict:
-        """Generate speech from text and extract word-level timings."""
-        # Use path relative to the ai directory with timestamp
-        timestamp = int(time.time() * 1000)  # milliseconds for uniqueness
-        output_path = Path(__file__).parent / "generated_audio" / f"speech_{timestamp}.mp3"
-        output_path.parent.mkdir(exist_ok=True)
-
-        communicate = edge_tts.Communicate(text, self.voice, boundary="WordBoundary")
-        
-        word_timings = []
-        
-        with open(output_path, "wb") as audio_file:
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    audio_file.write(chunk["data"])
-                elif chunk["type"] == "WordBoundary":
-                    start_seconds = chunk["offset"] / 10_000_000  # Convert to seconds
-                    end_seconds = (chunk["offset"] + chunk["duration"]) / 10_000_000
-                    word = chunk["text"]
+    @property
+    def backend(self):
+        return self._backend or get_backend()
+
+    @property
+    def voice(self):
+        return self.backend.voice
+
+    async def synthesize(self, text: str, sentences=None) -> dict:
+        """
+        Generate speech and word-level timings entirely in memory.
+        Returns {"audio": MP3 bytes (a bytearray), "word_timings": [...], "voice": ...};
+        callers hand the bytes to audio_store.store_bytes or straight to a response.
+
+        Text longer than one segment is split into sentence groups that are
+        synthesized concurrently (at most max_concurrency at a time); the MP3
+        frames are joined in order and each group's word timings are shifted by
+        the playing time of the groups before it. Pass the text's sentence
+        spans as `sentences` to skip segmenting it again.
+        """
+        groups = sentence_groups(text, self.segment_chars, sentences) if self.segment_chars else [text]
+        if len(groups) <= 1:
+            audio, word_timings = await self._synthesize_segment(text)
+        else:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+
+            async def bounded(group):
+                async with semaphore:
+                    return await self._synthesize_segment(group)
+
+            results = await asyncio.gather(*(bounded(group) for group in groups))
+            audio = mp3.concat([segment_audio for segment_audio, _ in results])
+            word_timings = []
+            offset = 0.0
+            for segment_audio, segment_timings in results:
+                for timing in segment_timings:
                     word_timings.append({
-                        "word": word,
-                        "start": start_seconds,
-                        "end": end_seconds
+                        "word": timing["word"],
+                        "start": timing["start"] + offset,
+                        "end": timing["end"] + offset
                     })
-        
+                # Fall back to the last word's end if the frames can't be parsed
+                offset += mp3.duration(segment_audio) or (segment_timings[-1]["end"] if segment_timings else 0.0)
+
         return {
-            "audio_path": str(output_path),
-            "word_timings": word_timings
+            "audio": audio,
+            "word_timings": word_timings,
+            "voice": self.voice
         }
 
-    async def generate_speech(self, text: str) -> str:
-        """Generate speech from text using Edge-TTS."""
-        # Use path relative to the ai directory with timestamp
-        timestamp = int(time.time() * 1000)  # milliseconds for uniqueness
-        output_path = Path(__file__).parent / "generated_audio" / f"speech_{timestamp}.mp3"
-        output_path.parent.mkdir(exist_ok=True)
+    async def _synthesize_segment(self, text):
+        """One backend call: (MP3 bytes, word timings relative to the clip start)"""
+        return await self.backend.synthesize(text)
 
-        communicate = edge_tts.Communicate(text, self.voice)
-        await communicate.save(str(output_path))
+    async def generate_speech_with_timings(self, text: str) -> dict:
+        """
+        File-based variant of synthesize: the audio is written to a unique
+        temporary file that callers move into the audio store with
+        audio_store.store_file.
+        """
+        result = await self.synthesize(text)
+        output_path = audio_store.new_temp_path()
+        output_path.write_bytes(result.pop("audio"))
+        return {"audio_path": str(output_path), **result}
 
-        return str(output_path)
+    async def generate_speech(self, text: str) -> str:
+        """Generate speech from text; returns the stored clip's path."""
+        result = await self.synthesize(text)
+        digest = audio_store.store_bytes(result["audio"], wait=True)
+        return str(audio_store.audio_path(digest))
@@ -1,7 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# Under ASGI (config/asgi.py) the chat, speech and audio endpoints are served by native async views
+asgi = settings.SERVER_INTERFACE == 'asgi'
+chat_view = views.chat_async if asgi else views.chat
+chat_stream_view = views.chat_stream_async if asgi else views.chat_stream
+speak_view = views.speak_async if asgi else views.speak
+audio_view = views.audio_async if asgi else views.audio
+
 urlpatterns = [
     path('', views.hello, name='hello'),
-    path('chat/', views.chat, name='chat'),
+    path('chat/', chat_view, name='chat'),
+    path('chat/stream/', chat_stream_view, name='chat_stream'),
+    path('audio/<str:digest>.mp3', audio_view, name='audio'),
+    path('audio/stats/', views.audio_stats, name='audio_stats'),
+    path('tts/stats/', views.tts_stats, name='tts_stats'),
+    path('llm/stats/', views.llm_stats, name='llm_stats'),
+    path('admission/', views.admission_stats, name='admission_stats'),
+    path('breakers/', views.breaker_stats, name='breaker_stats'),
+    path('retrieval/stats/', views.retrieval_stats, name='retrieval_stats'),
+    path('speak/', speak_view, name='speak'),
+    path('cache/', views.cache_stats, name='cache_stats'),
+    path('usage/', views.usage, name='usage'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
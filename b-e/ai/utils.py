@@ -2,24 +2,84 @@
 Initializes Llama Index's Google AI integration for Django.
 """
 
+import asyncio
 import os
+import re
 import sys
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
 from dotenv import load_dotenv
 from django.conf import settings
 
 # Load environment variables (in case settings.py hasn't loaded them yet)
 load_dotenv()
+from llama_index.core.base.llms.types import CompletionResponse
 from llama_index.llms.google_genai import GoogleGenAI
 
+from .prompt_template import render_prompt
+# Quota detection lives with the router, which fails over on it; imported here for existing callers
+from .llm_router import LLMRouter, ModelRoute, is_quota_error
+# The markup cleaner lives in ai/markup.py; imported here for existing callers
+from .markup import clean_wiki_markup, add_paragraph_breaks
+
+class MockCachedContents:
+    """
+    Stand-in for the google-genai client's `caches` API: cached system
+    instructions that expire after their ttl, referenced by name
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        self.contents = {}
+
+    def create(self, model, config):
+        ttl = float(config['ttl'].rstrip('s'))
+        name = f"cachedContents/mock-{len(self.contents) + 1}"
+        self.contents[name] = (config['system_instruction'], time.time() + ttl)
+        self.llm.prefix_sends += 1  # Creating the entry uploads the prompt once
+        return SimpleNamespace(name=name, model=model,
+                               expire_time=datetime.now(timezone.utc) + timedelta(seconds=ttl))
+
+    def get(self, name):
+        system_instruction, expires = self.contents.get(name, (None, 0))
+        if time.time() >= expires:
+            raise ValueError(f"403 PERMISSION_DENIED. CachedContent not found (or expired): {name}")
+        return system_instruction
+
+
 class MockLLM:
-    """Mock LLM for testing that doesn't use API calls"""
+    """
+    Mock LLM for testing that doesn't use API calls. `latency` (seconds) delays
+    each call, and `error`, if set, is raised after it, so failover can be tested.
+    """
     
-    def __init__(self, model="mock-gemini-2.5-flash"):
+    def __init__(self, model="mock-gemini-2.5-flash", latency=0.0, error=None):
         self.model = model
+        self.latency = latency
+        self.error = error
+        self.caches = MockCachedContents(self)
+        self.prefix_sends = 0  # Times the system prompt was sent, inline or to the cache
+
+    def _system_instruction(self, generation_config):
+        """The request's system instruction, resolving cached content like Gemini does"""
+        config = generation_config or {}
+        if config.get('cached_content'):
+            return self.caches.get(config['cached_content'])
+        if config.get('system_instruction'):
+            self.prefix_sends += 1
+        return config.get('system_instruction')
     
-    def complete(self, prompt):
+    def complete(self, prompt, generation_config=None):
         """Return a mock response based on the prompt"""
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(prompt, generation_config)
+
+    def _respond(self, prompt, generation_config):
+        if self.error is not None:
+            raise self.error
+        self._system_instruction(generation_config)
         # Simple mock responses based on prompt content
         prompt_lower = prompt.lower()
         
@@ -43,6 +103,30 @@ class MockLLM:
         else:
             return f"This is a test response from Red Queen AI. You asked: '{prompt[:100]}{'...' if len(prompt) > 100 else ''}'\n\nI'm currently in test mode, so I'm not using your Gemini API quota. To switch to live mode, set TEST_MODE=false in your environment variables."
 
+    async def acomplete(self, prompt, generation_config=None):
+        """Async variant of complete, like GoogleGenAI.acomplete"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(prompt, generation_config)
+
+    def stream_complete(self, prompt, generation_config=None):
+        """Yield the mock response word by word, like GoogleGenAI.stream_complete"""
+        text = ""
+        for delta in re.findall(r'\S+\s*', str(self.complete(prompt, generation_config))):
+            text += delta
+            yield CompletionResponse(text=text, delta=delta)
+
+    async def astream_complete(self, prompt, generation_config=None):
+        """Async variant of stream_complete, like GoogleGenAI.astream_complete"""
+        response = str(await self.acomplete(prompt, generation_config))
+
+        async def gen():
+            text = ""
+            for delta in re.findall(r'\S+\s*', response):
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+        return gen()
+
 def handle_google_ai_error(e):
     error_str = str(e)
     
@@ -77,152 +161,43 @@ modelTypes = [
 ]
 chosenModelType = modelTypes[1]  # Default = modelTypes[0]
 
-# Initialize LLM based on test mode
+def fallback_chain():
+    """The chosen model first, then the other modelTypes in order (if LLM_FALLBACK is on)"""
+    if not getattr(settings, 'LLM_FALLBACK', True):
+        return [chosenModelType]
+    return [chosenModelType] + [model for model in modelTypes if model != chosenModelType]
+
+def create_route(model):
+    """A router entry for one model: its client and the google-genai caches API it uses"""
+    if test_mode:
+        client = MockLLM(model=f"mock-{model}", latency=getattr(settings, 'MOCK_LLM_LATENCY', 0.0))
+        return ModelRoute(client, client.caches)
+    # GoogleGenAI exposes no caches API of its own, so use its google-genai client's
+    client = GoogleGenAI(
+        # https://ai.google.dev/gemini-api/docs/models
+        model=model,
+        api_key=settings.GOOGLE_API_KEY,
+    )
+    return ModelRoute(client, client._client.caches)
+
+# Initialize LLM based on test mode; calls fail over along the chain (ai/llm_router.py)
 if test_mode:
-    llm = MockLLM(model=f"mock-{chosenModelType}")
+    llm = LLMRouter([create_route(model) for model in fallback_chain()])
     print(f"✅ Mock AI initialized successfully ({chosenModelType} - TEST MODE)")
 else:
     # Initialize Google API Key & Model with error handling
     try:
-        llm = GoogleGenAI(
-            # https://ai.google.dev/gemini-api/docs/models
-            model=chosenModelType,
-            api_key=settings.GOOGLE_API_KEY,
-        )
-        print(f"✅ Google AI initialized successfully ({chosenModelType})")
+        llm = LLMRouter([create_route(model) for model in fallback_chain()])
+        print(f"✅ Google AI initialized successfully ({' -> '.join(fallback_chain())})")
     except Exception as e:
         print(handle_google_ai_error(e))
         sys.exit(1)
 
+QUOTA_EXCEEDED_MESSAGE = "🤖 Red Queen AI: I've reached my daily conversation limit with my current plan. This is normal for the free tier! Please try again tomorrow when my quota resets, or consider upgrading to a paid plan for unlimited conversations.\n\n💡 Tip: You can continue chatting with existing messages in your session - I remember our conversation history!"
+
 def load_system_prompt():
-    """Load the system prompt from file"""
-    try:
-        with open(settings.SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
-            prompt = f.read()
-        # Replace date placeholder
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        prompt = prompt.replace('{current_date}', current_date)
-        return prompt
-    except FileNotFoundError:
+    """Load the system prompt (cached template, reloaded when the file changes)"""
+    prompt = render_prompt(settings.SYSTEM_PROMPT_PATH)
+    if prompt is None:
         print(f"⚠️  System prompt file not found. Using default behavior.")
-        return None
-
-def clean_wiki_markup(text):
-    """
-    Clean wiki markup and formatting characters from text to make it readable.
-    Removes wiki templates, links, formatting, and special characters that would
-    be pronounced by TTS. Also adds natural paragraph breaks for better readability.
-    """
-    import re
-
-    # Remove wiki templates like {{Infobox character}}, {{Quote}}, etc.
-    text = re.sub(r'\{\{[^{}]*\}\}', '', text)
-
-    # Remove wiki links [[Link|Display]] or [[Link]]
-    text = re.sub(r'\[\[[^\]]*\]\]', '', text)
-
-    # Remove emphasis markup: '''bold''', ''italic'', *bold*, etc.
-    text = re.sub(r"'''([^']*)'''", r'\1', text)  # Bold
-    text = re.sub(r"''([^']*)''", r'\1', text)    # Italic
-    text = re.sub(r'\*([^*]*)\*', r'\1', text)    # Bold *
-    text = re.sub(r'/([^/]*)/', r'\1', text)      # Italic /
-
-    # Remove headers: == Header ==, === Subheader ===, etc.
-    text = re.sub(r'^=+\s*(.*?)\s*=+$', r'\1', text, flags=re.MULTILINE)
-
-    # Remove list markers: *, #, etc. at beginning of lines
-    text = re.sub(r'^[*#]+\s*', '', text, flags=re.MULTILINE)
-
-    # Remove HTML-like tags (basic cleanup)
-    text = re.sub(r'<[^>]+>', '', text)
-
-    # Remove special formatting characters that TTS would pronounce
-    text = re.sub(r'[*_`~]{1,3}', '', text)  # Remove *, **, ***, _, __, ___, `, ``, ```, ~, ~~, ~~~
-    text = re.sub(r'[-]{2,}', '', text)      # Remove --, ---, etc.
-    text = re.sub(r'[|]{2,}', '', text)      # Remove ||, |||, etc. (table separators)
-
-    # Clean up whitespace first
-    text = re.sub(r'\n\s*\n', '\n\n', text)  # Multiple newlines to double
-    text = re.sub(r'\n{3,}', '\n\n', text)   # More than 2 newlines to double
-
-    # Remove leading/trailing whitespace from each line
-    lines = [line.strip() for line in text.split('\n')]
-    text = '\n'.join(lines)
-
-    # Remove empty lines at start/end
-    text = text.strip()
-
-    # Add natural paragraph breaks
-    text = add_paragraph_breaks(text)
-
-    return text
-
-def add_paragraph_breaks(text):
-    """
-    Add natural paragraph breaks to improve readability.
-    Breaks paragraphs at logical points based on sentence structure and content.
-    """
-    import re
-
-    # If text is very short, don't break it
-    if len(text) < 200:
-        return text
-
-    # Split into sentences (basic sentence detection)
-    # Look for periods, question marks, exclamation points followed by spaces and capital letters
-    sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text)
-
-    if len(sentences) < 3:
-        return text
-
-    # Group sentences into paragraphs
-    paragraphs = []
-    current_paragraph = []
-    sentence_count = 0
-
-    for sentence in sentences:
-        current_paragraph.append(sentence.strip())
-        sentence_count += 1
-
-        # Create a paragraph break after 2-4 sentences, or when we hit certain keywords
-        should_break = False
-
-        # Break after 2-4 sentences
-        if sentence_count >= 2 and sentence_count <= 4:
-            # Check if this would be a good break point
-            combined = ' '.join(current_paragraph)
-
-            # Break if the paragraph is getting long (over 150 characters)
-            if len(combined) > 150:
-                should_break = True
-
-            # Break before certain transition words
-            transition_words = ['however', 'therefore', 'moreover', 'furthermore', 'additionally',
-                              'consequently', 'similarly', 'likewise', 'in contrast', 'on the other hand',
-                              'meanwhile', 'subsequently', 'accordingly', 'thus', 'hence']
-
-            sentence_lower = sentence.lower()
-            if any(word in sentence_lower for word in transition_words):
-                should_break = True
-
-            # Break after introductory sentences
-            if sentence_count == 2 and len(combined) > 100:
-                should_break = True
-
-        if should_break or sentence_count >= 4:
-            paragraphs.append(' '.join(current_paragraph))
-            current_paragraph = []
-            sentence_count = 0
-
-    # Add any remaining sentences
-    if current_paragraph:
-        paragraphs.append(' '.join(current_paragraph))
-
-    # Join paragraphs with double newlines
-    result = '\n\n'.join(paragraphs)
-
-    # Clean up any excessive spacing
-    result = re.sub(r'\n{3,}', '\n\n', result)
-    result = re.sub(r' {2,}', ' ', result)
-
-    return result.strip()
\ No newline at end of file
+    return prompt
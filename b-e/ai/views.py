@@ -1,51 +1,95 @@
-from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.conf import settings
+import asyncio
 import json
-import os
+import math
+import re
 import logging
-from datetime import datetime
-from pathlib import Path
-from .utils import llm, load_system_prompt, clean_wiki_markup
-from .tts_module import TTSModule
+from .utils import llm, load_system_prompt, is_quota_error, QUOTA_EXCEEDED_MESSAGE
+from .markup import clean_and_segment
+from .tts_engine import tts_engine, tts_resilience
+from .llm_router import llm_resilience
+from .resilience import RetryLater, CircuitOpenError
+from . import audio_store
+from .answer_cache import AnswerCache
+from .speech_cache import speech_cache, message_text
+from .singleflight import SingleFlight
+from .metering import usage_meter
+from .streaming import stream_chat_events, astream_chat_events
+from .retrieval import retriever, with_context
+from .conversation import conversations, session_key, turn_number
+from .admission import admission, AdmissionRejected
+from .timing import metrics, stage, mark, timed, elapsed
 
 logger = logging.getLogger(__name__)
 
+llm_model = getattr(llm, 'model', 'unknown')
+
+# Voiced answers to repeated questions, shared by all workers
+answer_cache = AnswerCache(namespace=llm_model)
+# Coalesces concurrent identical chat requests into one LLM + TTS computation
+chat_flight = SingleFlight('chat')
+
 # Create your views here.
 
-def log_api_usage():
-    """Log daily API usage count"""
-    usage_file = os.path.join(os.path.dirname(__file__), 'api_usage.json')
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    # Read current usage
-    if os.path.exists(usage_file):
-        try:
-            with open(usage_file, 'r') as f:
-                usage = json.load(f)
-        except (json.JSONDecodeError, IOError):
-            usage = {}
-    else:
-        usage = {}
-    
-    # Reset if new day
-    if usage.get('date') != today:
-        usage = {'date': today, 'count': 0}
-    
-    # Increment count
-    usage['count'] += 1
-    
-    # Write back
-    try:
-        with open(usage_file, 'w') as f:
-            json.dump(usage, f, indent=2)
-    except IOError:
-        pass  # Silently fail if can't write
-    
-    # Log to Django logs
-    logger.info(f"Gemini API usage: {usage['count']} requests today ({today})")
+# Returned when the LLM can't answer (with retry_after when a retry may succeed)
+SERVICE_UNAVAILABLE_MESSAGE = 'AI Service temporarily unavailable. Please try again later.'
+# Returned when admission control turns a request away (with retry_after)
+RATE_LIMITED_MESSAGE = 'Too many requests. Please wait a moment and try again.'
+# Spoken when the answer itself could not be voiced; never stored as a turn
+TTS_FALLBACK_MESSAGE = "I'm sorry, there was an error generating the audio response. Please try again."
+
+
+def build_full_prompt(question, chunks=(), history=None):
+    """
+    Prefix the user's question with the knowledge chunks retrieved for it (see
+    ai/retrieval.py) and the session's conversation history (see
+    ai/conversation.py). The system prompt is not part of it: it goes with
+    each call as the system instruction (see ai/context_cache.py).
+    """
+    if history:
+        question = f"{history.render()}\n\nUser: {question}"
+    return with_context(None, question, chunks)
+
+
+def session_history(session_id, replaces_turn=None):
+    """
+    The session's conversation history for the next prompt. replaces_turn is
+    the turn an edited question replaces: it and the turns after it are
+    forgotten first
+    """
+    if replaces_turn is not None:
+        conversations.forget(session_id, from_turn=replaces_turn)
+    return conversations.context(session_id)
+
+
+def remember_turn(session_id, question, response_data):
+    """Add an answered question to the session's server-side history; returns its turn number"""
+    answer = response_data.get('text')
+    if session_id and answer and answer != TTS_FALLBACK_MESSAGE:
+        return conversations.record(session_id, question, answer)
+    return None
+
+
+def audio_response_data(text, audio_result, text_html=None):
+    """
+    Build the JSON payload for a voiced answer from an in-memory TTS result.
+    The audio itself is not embedded: the client fetches it from the
+    content-addressed audio URL.
+    """
+    digest = audio_store.store_bytes(audio_result["audio"])
+    # Remember the clip so replaying this message needs no LLM or TTS call
+    speech_cache.remember(audio_result["voice"], text, digest, audio_result["word_timings"])
+    response_data = {'text': text}  # Plain text for TTS
+    if text_html is not None:
+        response_data['text_html'] = text_html  # HTML formatted text for display
+    response_data.update({
+        'audio_url': audio_store.audio_url(digest),
+        'filename': f"{digest}.mp3",
+        'word_timings': audio_result["word_timings"]
+    })
+    return response_data
 
 
 def hello(request):
@@ -56,146 +100,591 @@ def hello(request):
         message = "Hello from Red Queen AI!"
     return JsonResponse({'message': message, 'llm_model': getattr(llm, 'model', 'gemini-2.5-flash')})
 
+
+def llm_failure(error):
+    """(response_data, status) for an LLM call that failed for good or should be retried later"""
+    if isinstance(error, AdmissionRejected):
+        return rejected(error)
+    if is_quota_error(error):
+        # Quota exceeded - return user-friendly message
+        return {
+            'answer': QUOTA_EXCEEDED_MESSAGE,
+            'quota_exceeded': True
+        }, 200
+    if isinstance(error, (RetryLater, CircuitOpenError)):
+        return {
+            'error': SERVICE_UNAVAILABLE_MESSAGE,
+            'retry_after': max(1, math.ceil(error.retry_after)),
+        }, 503
+    return {'error': SERVICE_UNAVAILABLE_MESSAGE}, 500
+
+
+def rejected(error):
+    """(response_data, status) for a request turned away by admission control"""
+    return {
+        'error': RATE_LIMITED_MESSAGE,
+        'retry_after': max(1, math.ceil(error.retry_after)),
+    }, 429
+
+
+def chat_response(response_data, status):
+    """JsonResponse for a chat result, with Retry-After when the client should try again"""
+    with stage('serialize'):
+        response = JsonResponse(response_data, status=status)
+    if 'retry_after' in response_data:
+        response['Retry-After'] = str(response_data['retry_after'])
+    if 'audio_url' in response_data:
+        mark('first_audio')
+    return response
+
+
+def generate_answer(question, history=None, attempt=0):
+    """
+    Ask the LLM, clean and voice the answer. Returns (response_data, status)
+    rather than a response so concurrent identical requests can share it.
+    Answers that depend on conversation history are not cached. attempt is
+    the client's try number for this question (0 for the first).
+    """
+    with stage('retrieval'):
+        chunks = retriever.retrieve(question)
+    full_prompt = build_full_prompt(question, chunks, history)
+    
+    logger.debug("Full prompt prepared: %.100s...", full_prompt)  # Log first 100 chars
+    
+    try:
+        # Only requests that reach the LLM spend the global quota budget
+        with stage('admission'):
+            admission.admit(admission.quota_buckets())
+        logger.debug("Calling LLM for attempt %d", attempt + 1)
+        # A retryable failure raises RetryLater rather than sleeping here; the
+        # client repeats the request after Retry-After (see ai/resilience.py)
+        with stage('llm'):
+            answer = llm_resilience.call(attempt, llm.complete, full_prompt, system_prompt=load_system_prompt())
+    except Exception as e:
+        logger.warning(f"LLM call failed on attempt {attempt + 1}: {e}")
+        return llm_failure(e)
+    answer_text = str(answer)
+    
+    logger.debug("LLM response received: %.100s...", answer_text)
+    
+    # Clean wiki markup and formatting from the response; the sentence
+    # and paragraph spans are shared by the HTML and TTS below
+    with stage('markup'):
+        segmented = clean_and_segment(answer_text)
+        answer_text = segmented.text
+        
+        # Paragraph and line breaks as HTML breaks for frontend display
+        answer_text_html = segmented.html()
+    
+    # Generate speech from the answer (use original text for TTS, not HTML)
+    try:
+        with stage('tts'):
+            audio_result = tts_engine.synthesize_sync(answer_text, segmented.sentences)
+        
+        # Return JSON response with both text and audio
+        with stage('store'):
+            response_data = audio_response_data(answer_text, audio_result, answer_text_html)
+            if not history:
+                answer_cache.put(question, response_data)
+        return response_data, 200
+        
+    except Exception as tts_error:
+        logger.warning(f"TTS generation failed: {tts_error}")
+        # Generate fallback audio for the error
+        try:
+            fallback_text = TTS_FALLBACK_MESSAGE
+            with stage('tts'):
+                audio_result = tts_engine.synthesize_sync(fallback_text)
+            
+            # Return JSON response with both text and audio
+            return audio_response_data(fallback_text, audio_result), 200
+        except Exception as fallback_error:
+            logger.error(f"Fallback TTS also failed: {fallback_error}")
+            # Last resort: return a simple beep or error tone
+            # For now, return JSON as final fallback
+            return {'error': 'Audio generation failed', 'message': str(tts_error)}, 200
+
+
+def log_chat(question, session_id, response_data, status):
+    """One structured line per chat request; the question and answer text only for a sample"""
+    logger.info('chat', extra={
+        'fields': {
+            'status': status,
+            'question_chars': len(question),
+            'session': bool(session_id),
+            'voiced': 'audio_url' in response_data,
+            'ms': round(elapsed() * 1000, 1),
+        },
+        'verbose': {'question': question, 'answer': response_data.get('text', '')[:200]},
+    })
+
+
+def retry_attempt(value):
+    """The client's 0-based try number from a request payload (0 if absent or invalid)"""
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    return 0
+
+
+def cached_answer(question):
+    """Answer cache lookup in generate_answer's (response_data, status) form"""
+    with stage('cache'):
+        cached = answer_cache.get(question)
+    return (cached, 200) if cached is not None else None
+
+
 @csrf_exempt
+@timed('chat')
 def chat(request):
-    print(f"Chat request received: method={request.method}, body={request.body}, content_type={request.META.get('CONTENT_TYPE')}")
-    logger.error(f"Chat request received: method={request.method}, body={request.body}")
     if request.method == 'OPTIONS':
         return JsonResponse({})
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
     try:
         data = json.loads(request.body)
-        print(f"Parsed data: {data}")
-        logger.error(f"Parsed data: {data}")
         question = data.get('question', '')
         if not question:
-            print("Question is required but missing")
-            logger.error("Question is required but missing")
             return JsonResponse({'error': 'Question is required'}, status=400)
-        
-        system_prompt = load_system_prompt()
-        if system_prompt:
-            full_prompt = system_prompt + "\n\n" + question
+        session_id = session_key(data.get('session_id'))
+        replaces_turn = turn_number(data.get('replaces_turn'))
+        attempt = retry_attempt(data.get('attempt'))
+        try:
+            with stage('admission'):
+                admission.admit(admission.client_buckets(request, session_id))
+        except AdmissionRejected as e:
+            return chat_response(*rejected(e))
+        with stage('history'):
+            history = session_history(session_id, replaces_turn) if session_id else None
+
+        if history:
+            # Follow-ups depend on the conversation, so they bypass the shared answer cache
+            response_data, status = generate_answer(question, history, attempt)
+        elif (cached := cached_answer(question)) is not None:
+            response_data, status = cached
         else:
-            full_prompt = question
-        
-        logger.error(f"Full prompt prepared: {full_prompt[:100]}...")  # Log first 100 chars
-        
-        # Try up to 3 times with exponential backoff
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Only log API usage in live mode
-                if not getattr(settings, 'TEST_MODE', False):
-                    log_api_usage()
-                logger.error(f"Calling LLM for attempt {attempt + 1}")
-                answer = llm.complete(full_prompt)
-                answer_text = str(answer)
-                
-                logger.error(f"LLM response received: {answer_text[:100]}...")
-                
-                # Clean wiki markup and formatting from the response
-                answer_text = clean_wiki_markup(answer_text)
-                
-                # Convert newlines to HTML breaks for frontend display
-                answer_text_html = answer_text.replace('\n', '<br>')
-                
-                # Generate speech from the answer (use original text for TTS, not HTML)
-                tts = TTSModule()
-                
-                # Handle async TTS generation in sync context
-                import asyncio
-                try:
-                    # Create a new event loop for this thread
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    audio_result = loop.run_until_complete(tts.generate_speech_with_timings(answer_text))
-                    audio_path = audio_result["audio_path"]
-                    word_timings = audio_result["word_timings"]
-                    loop.close()
-                    
-                    # Return both text and audio
-                    with open(audio_path, 'rb') as audio_file:
-                        audio_data = audio_file.read()
-                    
-                    # Get the filename from the generated path
-                    filename = Path(audio_path).name
-                    
-                    # Return JSON response with both text and audio
-                    import base64
-                    response_data = {
-                        'text': answer_text,  # Plain text for TTS
-                        'text_html': answer_text_html,  # HTML formatted text for display
-                        'audio': base64.b64encode(audio_data).decode('utf-8'),
-                        'filename': filename,
-                        'word_timings': word_timings
-                    }
-                    return JsonResponse(response_data)
-                    
-                except Exception as tts_error:
-                    logger.error(f"TTS generation failed: {tts_error}")
-                    # Generate fallback audio for the error
-                    try:
-                        fallback_text = "I'm sorry, there was an error generating the audio response. Please try again."
-                        loop = asyncio.new_event_loop()
-                        asyncio.set_event_loop(loop)
-                        audio_result = loop.run_until_complete(tts.generate_speech_with_timings(fallback_text))
-                        audio_path = audio_result["audio_path"]
-                        word_timings = audio_result["word_timings"]
-                        loop.close()
-                        
-                        with open(audio_path, 'rb') as audio_file:
-                            audio_data = audio_file.read()
-                        
-                        filename = Path(audio_path).name
-                        
-                        # Return JSON response with both text and audio
-                        import base64
-                        response_data = {
-                            'text': fallback_text,
-                            'audio': base64.b64encode(audio_data).decode('utf-8'),
-                            'filename': filename,
-                            'word_timings': word_timings
-                        }
-                        return JsonResponse(response_data)
-                    except Exception as fallback_error:
-                        logger.error(f"Fallback TTS also failed: {fallback_error}")
-                        # Last resort: return a simple beep or error tone
-                        # For now, return JSON as final fallback
-                        return JsonResponse({'error': 'Audio generation failed', 'message': str(tts_error)})
-                
-            except Exception as e:
-                error_str = str(e)
-                logger.error(f"LLM call failed on attempt {attempt + 1}: {error_str}")
-                if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str or "quota exceeded" in error_str.lower():
-                    # Quota exceeded - return user-friendly message
-                    logger.error("Quota exceeded, returning user message")
-                    return JsonResponse({
-                        'answer': "🤖 Red Queen AI: I've reached my daily conversation limit with my current plan. This is normal for the free tier! Please try again tomorrow when my quota resets, or consider upgrading to a paid plan for unlimited conversations.\n\n💡 Tip: You can continue chatting with existing messages in your session - I remember our conversation history!",
-                        'quota_exceeded': True
-                    })
-                elif attempt == max_retries - 1:  # Last attempt
-                    print(f"Chat API Error (final attempt): {str(e)}")
-                    print(f"Error type: {type(e)}")
-                    import traceback
-                    print(f"Traceback: {traceback.format_exc()}")
-                    logger.error(f"Final attempt failed: {str(e)}")
-                    return JsonResponse({'error': f'AI Service temporarily unavailable. Please try again later.'}, status=500)
-                else:
-                    # Wait before retrying (exponential backoff)
-                    import time
-                    wait_time = 2 ** attempt  # 1, 2, 4 seconds
-                    print(f"Chat API Error (attempt {attempt + 1}): {str(e)}. Retrying in {wait_time}s...")
-                    logger.error(f"Retrying after {wait_time}s")
-                    time.sleep(wait_time)
+            # Identical questions already being answered (by this or another worker)
+            # wait for that answer instead of calling the LLM again
+            response_data, status = chat_flight.do(
+                answer_cache.key(question),
+                lambda: generate_answer(question, attempt=attempt),
+                lambda: cached_answer(question),
+            )
+        with stage('history'):
+            turn = remember_turn(session_id, question, response_data)
+        if turn is not None:
+            response_data = {**response_data, 'turn': turn}
+        log_chat(question, session_id, response_data, status)
+        return chat_response(response_data, status)
     except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error: {e}")
+        logger.warning(f"JSON decode error: {e}")
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
-        logger.error(f"Unexpected error in chat view: {str(e)}")
-        print(f"Chat API Error: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
+        # The traceback is formatted by the logging thread, not in the request
+        logger.exception(f"Unexpected error in chat view: {e}")
         return JsonResponse({'error': f'AI Error: {str(e)}'}, status=500)
+
+
+async def generate_answer_async(question, history=None):
+    """Async counterpart of generate_answer, used by chat_async"""
+    with stage('retrieval'):
+        chunks = await retriever.aretrieve(question)
+    full_prompt = build_full_prompt(question, chunks, history)
+
+    try:
+        with stage('admission'):
+            await admission.aadmit(admission.quota_buckets())
+        # Retries back off with asyncio.sleep, so the event loop keeps serving others
+        with stage('llm'):
+            answer = await llm_resilience.acall(llm.acomplete, full_prompt, system_prompt=load_system_prompt())
+    except Exception as e:
+        logger.warning(f"LLM call failed: {e}")
+        return llm_failure(e)
+
+    # Clean wiki markup and formatting from the response
+    with stage('markup'):
+        segmented = clean_and_segment(str(answer))
+        answer_text = segmented.text
+        answer_text_html = segmented.html()
+
+    try:
+        with stage('tts'):
+            audio_result = await tts_engine.synthesize(answer_text, segmented.sentences)
+        with stage('store'):
+            response_data = await asyncio.to_thread(audio_response_data, answer_text, audio_result, answer_text_html)
+            if not history:
+                await asyncio.to_thread(answer_cache.put, question, response_data)
+        return response_data, 200
+    except Exception as tts_error:
+        logger.warning(f"TTS generation failed: {tts_error}")
+        try:
+            fallback_text = TTS_FALLBACK_MESSAGE
+            with stage('tts'):
+                audio_result = await tts_engine.synthesize(fallback_text)
+            response_data = await asyncio.to_thread(audio_response_data, fallback_text, audio_result)
+            return response_data, 200
+        except Exception as fallback_error:
+            logger.error(f"Fallback TTS also failed: {fallback_error}")
+            return {'error': 'Audio generation failed', 'message': str(tts_error)}, 200
+
+
+@csrf_exempt
+@timed('chat')
+async def chat_async(request):
+    """
+    Native async chat view, served for /ai/chat/ under ASGI (config/asgi.py).
+    Awaits the LLM's async completion and edge-tts streaming directly, so one
+    worker process can keep many conversations in flight. Same JSON contract
+    as the sync chat view.
+    """
+    if request.method == 'OPTIONS':
+        return JsonResponse({})
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON decode error: {e}")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    question = data.get('question', '')
+    if not question:
+        return JsonResponse({'error': 'Question is required'}, status=400)
+    session_id = session_key(data.get('session_id'))
+    replaces_turn = turn_number(data.get('replaces_turn'))
+    try:
+        with stage('admission'):
+            await admission.aadmit(admission.client_buckets(request, session_id))
+    except AdmissionRejected as e:
+        return chat_response(*rejected(e))
+    with stage('history'):
+        history = await asyncio.to_thread(session_history, session_id, replaces_turn) if session_id else None
+
+    if history:
+        # Follow-ups depend on the conversation, so they bypass the shared answer cache
+        response_data, status = await generate_answer_async(question, history)
+    elif (cached := await asyncio.to_thread(cached_answer, question)) is not None:
+        response_data, status = cached
+    else:
+        # Identical questions already being answered (by this or another worker)
+        # wait for that answer instead of calling the LLM again
+        response_data, status = await chat_flight.ado(
+            answer_cache.key(question),
+            lambda: generate_answer_async(question),
+            lambda: cached_answer(question),
+        )
+    with stage('history'):
+        turn = await asyncio.to_thread(remember_turn, session_id, question, response_data)
+    if turn is not None:
+        response_data = {**response_data, 'turn': turn}
+    log_chat(question, session_id, response_data, status)
+    return chat_response(response_data, status)
+
+
+def parse_speak_request(request):
+    """(text, text_hash, None) for a /ai/speak/ request, or (None, None, error response)"""
+    if request.method == 'OPTIONS':
+        return None, None, JsonResponse({})
+    if request.method != 'POST':
+        return None, None, JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON decode error: {e}")
+        return None, None, JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    text = message_text(data.get('text', ''))
+    text_hash = data.get('hash', '')
+    if not text and not text_hash:
+        return None, None, JsonResponse({'error': 'Text or hash is required'}, status=400)
+    return text, text_hash, None
+
+
+def speak_response(response_data, result, cached):
+    response_data.update({
+        'audio_url': audio_store.audio_url(result['audio_digest']),
+        'filename': f"{result['audio_digest']}.mp3",
+        'word_timings': result['word_timings'],
+        'cached': cached
+    })
+    return JsonResponse(response_data)
+
+
+@csrf_exempt
+def speak(request):
+    """
+    Replay a message's speech without calling the LLM. POST {"text": ...} with
+    the message content (text_html is fine) or {"hash": ...}, the sha256 of the
+    plain text. Audio is synthesized only if the text was never voiced before.
+    """
+    text, text_hash, error_response = parse_speak_request(request)
+    if error_response is not None:
+        return error_response
+
+    if text:
+        try:
+            result, cached = asyncio.run(speech_cache.speak(text))
+        except Exception as tts_error:
+            logger.warning(f"TTS generation failed: {tts_error}")
+            return JsonResponse({'error': 'Audio generation failed'}, status=500)
+        response_data = {'text': text, 'text_html': text.replace('\n', '<br>')}
+    else:
+        result, cached = speech_cache.lookup(tts_engine.voice, digest_of_text=text_hash), True
+        if result is None:
+            return JsonResponse({'error': 'No audio for that hash'}, status=404)
+        response_data = {}
+    return speak_response(response_data, result, cached)
+
+
+@csrf_exempt
+async def speak_async(request):
+    """
+    Native async speak, served for /ai/speak/ under ASGI: awaits the synthesis
+    on the server's event loop instead of starting an event loop per request
+    """
+    text, text_hash, error_response = parse_speak_request(request)
+    if error_response is not None:
+        return error_response
+
+    if text:
+        try:
+            result, cached = await speech_cache.speak(text)
+        except Exception as tts_error:
+            logger.warning(f"TTS generation failed: {tts_error}")
+            return JsonResponse({'error': 'Audio generation failed'}, status=500)
+        response_data = {'text': text, 'text_html': text.replace('\n', '<br>')}
+    else:
+        result = await asyncio.to_thread(speech_cache.lookup, tts_engine.voice, digest_of_text=text_hash)
+        if result is None:
+            return JsonResponse({'error': 'No audio for that hash'}, status=404)
+        cached, response_data = True, {}
+    return speak_response(response_data, result, cached)
+
+
+def prometheus_metrics(request):
+    """Per-stage, time-to-first-byte and time-to-first-audio latency of this worker, for Prometheus"""
+    return HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def usage(request):
+    """LLM usage for a day (?date=YYYY-MM-DD, default today): per hour and per model"""
+    return JsonResponse(usage_meter.usage(request.GET.get('date')))
+
+
+def cache_stats(request):
+    """Answer cache hit/miss counters for capacity planning"""
+    return JsonResponse(answer_cache.stats())
+
+
+def audio_stats(request):
+    """Generated audio held on disk and evicted so far"""
+    return JsonResponse(audio_store.stats())
+
+
+def llm_stats(request):
+    """Model fallback order, failovers and per-model health for this worker"""
+    return JsonResponse(llm.stats())
+
+
+def breaker_stats(request):
+    """Circuit breaker state and retry counters for the LLM and TTS in this worker"""
+    return JsonResponse({'llm': llm_resilience.stats(), 'tts': tts_resilience.stats()})
+
+
+def tts_stats(request):
+    """TTS engine pool, hedging and latency metrics for this worker"""
+    return JsonResponse(tts_engine.stats())
+
+
+def admission_stats(request):
+    """Admitted, queued and rejected requests, and today's use of the daily LLM budget"""
+    return JsonResponse(admission.stats())
+
+
+def retrieval_stats(request):
+    """Retrieval stage outcomes and query latency for this worker"""
+    return JsonResponse(retriever.stats())
+
+
+@csrf_exempt
+@timed('chat_stream')
+def chat_stream(request):
+    """
+    Streaming variant of chat: returns NDJSON events (see ai/streaming.py) so the
+    client can show text and start playing audio before the full answer is voiced.
+    The JSON /ai/chat/ endpoint remains for older clients.
+    """
+    if request.method == 'OPTIONS':
+        return JsonResponse({})
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON decode error: {e}")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    question = data.get('question', '')
+    if not question:
+        return JsonResponse({'error': 'Question is required'}, status=400)
+
+    session_id = session_key(data.get('session_id'))
+    replaces_turn = turn_number(data.get('replaces_turn'))
+    try:
+        # Streams always call the LLM
+        with stage('admission'):
+            admission.admit(admission.client_buckets(request, session_id) + admission.quota_buckets())
+    except AdmissionRejected as e:
+        return chat_response(*rejected(e))
+    with stage('history'):
+        history = session_history(session_id, replaces_turn) if session_id else None
+    with stage('retrieval'):
+        chunks = retriever.retrieve(question)
+    full_prompt = build_full_prompt(question, chunks, history)
+
+    def on_answer(answer_text):
+        turn = remember_turn(session_id, question, {'text': answer_text})
+        return {'turn': turn} if turn is not None else None
+
+    response = StreamingHttpResponse(stream_chat_events(full_prompt, on_answer), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the stream
+    return response
+
+
+@csrf_exempt
+@timed('chat_stream')
+async def chat_stream_async(request):
+    """
+    Native async chat_stream, served for /ai/chat/stream/ under ASGI: the
+    events come from an async generator, so each one is sent as soon as it is
+    produced rather than after the whole answer
+    """
+    if request.method == 'OPTIONS':
+        return JsonResponse({})
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON decode error: {e}")
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    question = data.get('question', '')
+    if not question:
+        return JsonResponse({'error': 'Question is required'}, status=400)
+
+    session_id = session_key(data.get('session_id'))
+    replaces_turn = turn_number(data.get('replaces_turn'))
+    try:
+        # Streams always call the LLM
+        with stage('admission'):
+            await admission.aadmit(admission.client_buckets(request, session_id) + admission.quota_buckets())
+    except AdmissionRejected as e:
+        return chat_response(*rejected(e))
+    with stage('history'):
+        history = await asyncio.to_thread(session_history, session_id, replaces_turn) if session_id else None
+    with stage('retrieval'):
+        chunks = await retriever.aretrieve(question)
+    full_prompt = build_full_prompt(question, chunks, history)
+
+    def on_answer(answer_text):
+        turn = remember_turn(session_id, question, {'text': answer_text})
+        return {'turn': turn} if turn is not None else None
+
+    response = StreamingHttpResponse(astream_chat_events(full_prompt, on_answer), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Don't let proxies buffer the stream
+    return response
+
+
+# Audio URLs are content hashes, so a clip never changes once served
+AUDIO_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+BYTE_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_byte_range(range_header, size):
+    """
+    Parse a single-range HTTP Range header into inclusive (start, end) offsets.
+    Returns None when there is no usable range (serve the whole file) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    match = BYTE_RANGE_PATTERN.match(range_header.strip()) if range_header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the final N bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(range_header)
+    return start, end
+
+
+@require_http_methods(['GET', 'HEAD'])
+def audio(request, digest):
+    """
+    Serve a generated clip as raw MP3 bytes with Range and immutable caching.
+    Clips whose background write hasn't finished are served from memory.
+    """
+    return audio_response(request, digest)
+
+
+@require_http_methods(['GET', 'HEAD'])
+async def audio_async(request, digest):
+    """
+    Native async audio, served for /ai/audio/ under ASGI: waiting for a clip
+    another worker is writing and reading it run in a worker thread, not in
+    the single thread that sync views share. A whole clip is read into the
+    response, as ASGI would otherwise collect the file's sync iterator before
+    sending it anyway.
+    """
+    return await asyncio.to_thread(audio_response, request, digest, stream_file=False)
+
+
+def audio_response(request, digest, stream_file=True):
+    """The response to an audio request; stream_file=False reads a whole clip into memory"""
+    clip = audio_store.pending_clip(digest)
+    path = None
+    if clip is None:
+        # Another worker may still be writing a clip it has just handed out
+        path = audio_store.audio_path(digest) or audio_store.wait_for(digest)
+        if path is None:
+            return JsonResponse({'error': 'Audio not found'}, status=404)
+
+    audio_store.touch(digest)  # Recently used clips survive eviction
+    etag = f'"{digest}"'
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+    else:
+        size = len(clip) if clip is not None else path.stat().st_size
+        try:
+            byte_range = parse_byte_range(request.headers.get('Range'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if clip is not None:
+            start, end = byte_range or (0, size - 1)
+            response = HttpResponse(memoryview(clip)[start:end + 1], content_type='audio/mpeg')
+            if byte_range is not None:
+                response.status_code = 206
+                response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        elif byte_range is None and stream_file:
+            response = FileResponse(open(path, 'rb'), content_type='audio/mpeg')
+        elif byte_range is None:
+            response = HttpResponse(path.read_bytes(), content_type='audio/mpeg')
+            response['Content-Length'] = str(size)
+        else:
+            start, end = byte_range
+            with open(path, 'rb') as audio_file:
+                audio_file.seek(start)
+                response = HttpResponse(audio_file.read(end - start + 1), status=206, content_type='audio/mpeg')
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = AUDIO_CACHE_CONTROL
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Concurrency benchmark: sync chat view (WSGI, gunicorn sync workers) vs the
+native async chat view (ASGI, config/asgi.py).
+
+Runs offline against MockLLM with an injected LLM/TTS latency, so the numbers
+show how many conversations a deployment keeps in flight rather than Gemini or
+edge-tts speed. The WSGI case emulates N sync workers with N threads (each
+worker handles one request at a time); the ASGI case runs every request on a
+single event loop, i.e. one worker process.
+
+Usage:
+    python benchmarks/bench_chat_concurrency.py --requests 50 --workers 2 --llm-latency 0.5 --tts-latency 0.3
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Setup Django in test mode (MockLLM, no API quota used)
+os.environ['TEST_MODE'] = 'true'
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Fresh shared state and audio store per run, so earlier runs' cached answers don't skew it
+STATE_DIR = tempfile.mkdtemp(prefix='rq-bench-')
+os.environ['AI_STATE_DB'] = os.path.join(STATE_DIR, 'ai_state.sqlite3')
+
+import django
+django.setup()
+
+from django.conf import settings
+from django.test import RequestFactory
+from ai import audio_store, views
+
+audio_store.AUDIO_DIR = Path(STATE_DIR) / 'generated_audio'
+
+
+def install_latency(llm_latency, tts_latency):
+    """Give MockLLM and TTS a fixed latency so the benchmark measures concurrency"""
+    mock_complete = views.llm.complete
+
+    def complete(prompt, **kwargs):
+        time.sleep(llm_latency)
+        return mock_complete(prompt, **kwargs)
+
+    async def acomplete(prompt, **kwargs):
+        await asyncio.sleep(llm_latency)
+        return mock_complete(prompt, **kwargs)
+
+    views.llm.complete = complete
+    views.llm.acomplete = acomplete
+    settings.TTS_BACKEND = 'synthetic'
+    settings.TTS_SYNTHETIC_LATENCY = tts_latency
+
+
+def make_request(factory, index):
+    # A distinct question per request so the answer cache never short-circuits the run
+    question = f'Who created the Red Queen? (#{index})'
+    return factory.post('/ai/chat/', data={'question': question}, content_type='application/json')
+
+
+def run_wsgi(total, workers):
+    factory = RequestFactory()
+    latencies = []
+
+    def one_request(index):
+        start = time.perf_counter()
+        response = views.chat(make_request(factory, index))
+        assert response.status_code == 200, response.content
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(one_request, i) for i in range(total)]:
+            future.result()
+    return time.perf_counter() - start, latencies
+
+
+def run_asgi(total):
+    factory = RequestFactory()
+    latencies = []
+
+    async def one_request(index):
+        start = time.perf_counter()
+        response = await views.chat_async(make_request(factory, total + index))
+        assert response.status_code == 200, response.content
+        latencies.append(time.perf_counter() - start)
+
+    async def run_all():
+        await asyncio.gather(*(one_request(i) for i in range(total)))
+
+    start = time.perf_counter()
+    asyncio.run(run_all())
+    return time.perf_counter() - start, latencies
+
+
+def report(label, total, wall, latencies):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<28} {wall:8.2f}s  {total / wall:8.1f} req/s  p50 {p50:6.2f}s  p99 {p99:6.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=50, help='Concurrent chat requests to issue')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn sync workers to emulate for WSGI')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per LLM call')
+    parser.add_argument('--tts-latency', type=float, default=0.3, help='Seconds per TTS call')
+    args = parser.parse_args()
+
+    install_latency(args.llm_latency, args.tts_latency)
+
+    print(f"{args.requests} concurrent requests, LLM {args.llm_latency}s + TTS {args.tts_latency}s each")
+    wall, latencies = run_wsgi(args.requests, args.workers)
+    report(f"WSGI ({args.workers} sync workers)", args.requests, wall, latencies)
+    wall, latencies = run_asgi(args.requests)
+    report("ASGI (1 worker, async)", args.requests, wall, latencies)
+
+
+if __name__ == "__main__":
+    main()
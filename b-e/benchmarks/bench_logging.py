@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-request logging cost of the chat view before and after
+ai/structured_logging.py.
+
+"legacy" replays what ai.views.chat used to log for every request: the raw
+body and parsed data printed and logged at ERROR, plus the prompt, LLM call
+and response lines, all written synchronously (and, on the error path, the
+traceback formatted and printed inside the request). "structured" logs what
+the view logs now: DEBUG tracing below the configured level and one sampled
+INFO line per request, handed to BackgroundQueueHandler.
+
+Output goes to a temporary file; --sink-latency adds a delay per write to
+emulate a slow stdout pipe (e.g. a log shipper under load). Times are the
+cost seen by the request; for "structured" the time the listener thread then
+needs to drain the queue is reported separately.
+
+Usage:
+    python benchmarks/bench_logging.py --requests 5000 --sink-latency 0.0001
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.structured_logging import BackgroundQueueHandler, VerboseSampler
+
+QUESTION = 'Who created the Red Queen and why did she seal the Hive?'
+ANSWER = ("The Red Queen was created by the Umbrella Corporation to oversee the Hive. " * 8).strip()
+PROMPT = f"Relevant knowledge:\n{'The Hive is an underground facility. ' * 20}\n\nUser: {QUESTION}"
+
+
+class SlowStream:
+    """File stream whose writes take `latency` extra seconds"""
+
+    def __init__(self, file, latency):
+        self.file = file
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def legacy_logger(stream):
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    log = logging.getLogger('bench.legacy')
+    log.handlers = [handler]
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+    return log
+
+
+def structured_logger(stream, sample_rate):
+    handler = BackgroundQueueHandler(stream)
+    handler.addFilter(VerboseSampler(sample_rate))
+    log = logging.getLogger('bench.structured')
+    log.handlers = [handler]
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    return log, handler
+
+
+def legacy_request(log, out, fail):
+    """The logging the chat view did per request before structured logging"""
+    body = json.dumps({'question': QUESTION, 'session_id': 'session-1'}).encode('utf-8')
+    data = json.loads(body)
+    print(f"Chat request received: method=POST, body={body}, content_type=application/json", file=out)
+    log.error(f"Chat request received: method=POST, body={body}")
+    print(f"Parsed data: {data}", file=out)
+    log.error(f"Parsed data: {data}")
+    log.error(f"Full prompt prepared: {PROMPT[:100]}...")
+    log.error(f"Calling LLM for attempt {1}")
+    if fail:
+        try:
+            raise ValueError('500 INTERNAL')
+        except ValueError as e:
+            log.error(f"Unexpected error in chat view: {str(e)}")
+            print(f"Chat API Error: {str(e)}", file=out)
+            print(f"Error type: {type(e)}", file=out)
+            print(f"Traceback: {traceback.format_exc()}", file=out)
+        return
+    log.error(f"LLM response received: {ANSWER[:100]}...")
+
+
+def structured_request(log, fail):
+    """The logging the chat view does per request now"""
+    log.debug("Full prompt prepared: %.100s...", PROMPT)
+    log.debug("Calling LLM for attempt %d", 1)
+    if fail:
+        try:
+            raise ValueError('500 INTERNAL')
+        except ValueError as e:
+            log.exception(f"Unexpected error in chat view: {e}")
+        return
+    log.debug("LLM response received: %.100s...", ANSWER)
+    log.info('chat', extra={
+        'fields': {'status': 200, 'question_chars': len(QUESTION), 'session': True, 'voiced': True, 'ms': 812.4},
+        'verbose': {'question': QUESTION, 'answer': ANSWER[:200]},
+    })
+
+
+def run(requests, sink_latency, sample_rate, fail):
+    label = 'error path' if fail else 'success path'
+    with tempfile.TemporaryFile('w+') as legacy_file, tempfile.TemporaryFile('w+') as structured_file:
+        legacy_out = SlowStream(legacy_file, sink_latency)
+        log = legacy_logger(legacy_out)
+        started = time.perf_counter()
+        for _ in range(requests):
+            legacy_request(log, legacy_out, fail)
+        legacy = (time.perf_counter() - started) / requests
+
+        log, handler = structured_logger(SlowStream(structured_file, sink_latency), sample_rate)
+        started = time.perf_counter()
+        for _ in range(requests):
+            structured_request(log, fail)
+        structured = (time.perf_counter() - started) / requests
+        started = time.perf_counter()
+        handler.close()
+        drain = time.perf_counter() - started
+        log.handlers = []
+
+        legacy_bytes, structured_bytes = legacy_file.tell(), structured_file.tell()
+
+    print(f"{label:<14} legacy {legacy * 1e6:9.1f} us/req  {legacy_bytes / requests:7.0f} B/req")
+    print(f"{'':<14} struct {structured * 1e6:9.1f} us/req  {structured_bytes / requests:7.0f} B/req"
+          f"  ({legacy / structured:.1f}x less; listener drained the rest in {drain:.2f}s,"
+          f" {handler.dropped} dropped)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=5000, help='Requests to simulate per variant')
+    parser.add_argument('--sink-latency', type=float, default=0.0, help='Extra seconds per write to the log sink')
+    parser.add_argument('--sample-rate', type=float, default=0.01, help='LOG_SAMPLE_RATE for the verbose fields')
+    args = parser.parse_args()
+
+    print(f"{args.requests} requests, sink latency {args.sink_latency * 1e6:.0f} us/write, "
+          f"verbose fields sampled at {args.sample_rate}")
+    for fail in (False, True):
+        run(args.requests, args.sink_latency, args.sample_rate, fail)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+TTS benchmark: one edge-tts call per answer vs sentence-parallel synthesis.
+
+By default synthesis uses the offline "synthetic" backend (ai/tts_backends.py)
+with a synthesis time that grows with text length (--base-latency +
+--char-latency per character), so the numbers show how wall time scales with
+answer length rather than network noise. Pass --live to call the real
+edge-tts service instead.
+
+Usage:
+    python benchmarks/bench_tts_parallel.py --lengths 200 800 1600 3200 --concurrency 4
+    python benchmarks/bench_tts_parallel.py --live --lengths 400 1600
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['TEST_MODE'] = 'true'
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+import django
+django.setup()
+
+from ai import tts_module
+from ai.tts_backends import EdgeTTSBackend, SyntheticBackend
+from ai.tts_module import TTSModule
+
+SENTENCE = "The Red Queen monitors every system in the Hive and reports anomalies. "
+def answer_of_length(chars):
+    return (SENTENCE * (chars // len(SENTENCE) + 1))[:chars].rsplit(' ', 1)[0] + '.'
+
+
+def time_synthesis(tts, text, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        asyncio.run(tts.synthesize(text))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[200, 800, 1600, 3200], help='Answer lengths in characters')
+    parser.add_argument('--concurrency', type=int, default=tts_module.MAX_CONCURRENCY, help='Concurrent edge-tts calls')
+    parser.add_argument('--segment-chars', type=int, default=tts_module.SEGMENT_CHARS, help='Target characters per segment')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per measurement (best is reported)')
+    parser.add_argument('--base-latency', type=float, default=0.4, help='Offline: seconds per edge-tts call')
+    parser.add_argument('--char-latency', type=float, default=0.002, help='Offline: extra seconds per character')
+    parser.add_argument('--live', action='store_true', help='Call the real edge-tts service')
+    args = parser.parse_args()
+
+    if args.live:
+        backend = EdgeTTSBackend()
+    else:
+        backend = SyntheticBackend(latency=args.base_latency, char_latency=args.char_latency)
+
+    single = TTSModule(segment_chars=None, backend=backend)
+    parallel = TTSModule(max_concurrency=args.concurrency, segment_chars=args.segment_chars, backend=backend)
+
+    print(f"{'chars':>6}  {'single call':>12}  {'parallel':>10}  {'speedup':>8}")
+    for length in args.lengths:
+        text = answer_of_length(length)
+        single_time = time_synthesis(single, text, args.repeats)
+        parallel_time = time_synthesis(parallel, text, args.repeats)
+        print(f"{len(text):>6}  {single_time:>11.2f}s  {parallel_time:>9.2f}s  {single_time / parallel_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
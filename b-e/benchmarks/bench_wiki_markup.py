@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: the original clean_wiki_markup (fifteen re.sub passes with
+patterns looked up on every call) vs the compiled cleaner in ai/markup.py.
+
+Inputs are built from the golden corpus (ai/testdata/wiki_markup_corpus.json)
+repeated to each target length: "answer" uses the Gemini-style answer and the
+wiki article (typical chat output), "markup" every corpus case (all passes
+fire). The two cleaners are checked to agree on every input before timing.
+
+Usage:
+    python benchmarks/bench_wiki_markup.py --lengths 500 2000 8000 32000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+# Add the project root to Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai import markup
+
+CORPUS_PATH = os.path.join(os.path.dirname(markup.__file__), 'testdata', 'wiki_markup_corpus.json')
+
+
+def legacy_clean_wiki_markup(text):
+    """The cleaner as it was before ai/markup.py, kept as the baseline"""
+    text = re.sub(r'\{\{[^{}]*\}\}', '', text)
+    text = re.sub(r'\[\[[^\]]*\]\]', '', text)
+    text = re.sub(r"'''([^']*)'''", r'\1', text)
+    text = re.sub(r"''([^']*)''", r'\1', text)
+    text = re.sub(r'\*([^*]*)\*', r'\1', text)
+    text = re.sub(r'/([^/]*)/', r'\1', text)
+    text = re.sub(r'^=+\s*(.*?)\s*=+$', r'\1', text, flags=re.MULTILINE)
+    text = re.sub(r'^[*#]+\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'[*_`~]{1,3}', '', text)
+    text = re.sub(r'[-]{2,}', '', text)
+    text = re.sub(r'[|]{2,}', '', text)
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = '\n'.join(line.strip() for line in text.split('\n'))
+    return legacy_add_paragraph_breaks(text.strip())
+
+
+def legacy_add_paragraph_breaks(text):
+    if len(text) < 200:
+        return text
+    sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z])', text)
+    if len(sentences) < 3:
+        return text
+    transition_words = ['however', 'therefore', 'moreover', 'furthermore', 'additionally',
+                        'consequently', 'similarly', 'likewise', 'in contrast', 'on the other hand',
+                        'meanwhile', 'subsequently', 'accordingly', 'thus', 'hence']
+    paragraphs = []
+    current_paragraph = []
+    sentence_count = 0
+    for sentence in sentences:
+        current_paragraph.append(sentence.strip())
+        sentence_count += 1
+        should_break = False
+        if 2 <= sentence_count <= 4:
+            combined = ' '.join(current_paragraph)
+            if len(combined) > 150:
+                should_break = True
+            if any(word in sentence.lower() for word in transition_words):
+                should_break = True
+            if sentence_count == 2 and len(combined) > 100:
+                should_break = True
+        if should_break or sentence_count >= 4:
+            paragraphs.append(' '.join(current_paragraph))
+            current_paragraph = []
+            sentence_count = 0
+    if current_paragraph:
+        paragraphs.append(' '.join(current_paragraph))
+    result = '\n\n'.join(paragraphs)
+    result = re.sub(r'\n{3,}', '\n\n', result)
+    result = re.sub(r' {2,}', ' ', result)
+    return result.strip()
+
+
+def answer_of_length(corpus_text, chars):
+    return (corpus_text * (chars // len(corpus_text) + 1))[:chars]
+
+
+def per_call(func, text, repeats):
+    timer = timeit.Timer(lambda: func(text))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeats, number=number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[500, 2000, 8000, 32000], help='Answer lengths in characters')
+    parser.add_argument('--repeats', type=int, default=7, help='Timing repeats (best is reported)')
+    args = parser.parse_args()
+
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        corpus = json.load(f)
+    for case in corpus:
+        assert legacy_clean_wiki_markup(case['input']) == case['expected'], case['name']
+    inputs = {
+        'answer': '\n\n'.join(case['input'] for case in corpus if case['name'] in ('long_gemini_answer', 'history_article')),
+        'markup': '\n\n'.join(case['input'] for case in corpus if case['input'].strip()),
+    }
+
+    print(f"{'input':<7}  {'chars':>7}  {'original':>10}  {'compiled':>10}  {'speedup':>8}")
+    for name, source in inputs.items():
+        for length in args.lengths:
+            text = answer_of_length(source, length)
+            assert markup.clean_wiki_markup(text) == legacy_clean_wiki_markup(text)
+            original = per_call(legacy_clean_wiki_markup, text, args.repeats)
+            compiled = per_call(markup.clean_wiki_markup, text, args.repeats)
+            print(f"{name:<7}  {length:>7}  {original * 1e6:>8.1f}us  {compiled * 1e6:>8.1f}us  {original / compiled:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Load test for /ai/chat/: how many concurrent conversations a deployment sustains.
+
+Starts the real server for a worker model, offline (MockLLM with
+--llm-latency per call and the synthetic TTS backend with --tts-latency; see
+benchmarks/loadtest_settings.py), and drives it with either:
+
+- closed-loop load: --concurrency clients, each sending its next request as
+  soon as the previous one is answered, or
+- open-loop load: --rate requests per second arriving as a Poisson process,
+  however slow the server gets. Latency is measured from the scheduled
+  arrival, so a backlog shows up as latency.
+
+Worker models: "sync" and "gthread" (gunicorn, --workers processes, gthread
+with --threads each) and "asgi" (uvicorn, --workers processes). --url drives
+an already running server instead (add --server-pid to measure its memory).
+
+Reports throughput, p50/p90/p99 latency, error rate and peak RSS per worker
+process, and saves them as JSON (benchmarks/results/ by default) together
+with the commit and configuration. --compare prints saved runs side by side.
+
+Usage:
+    python benchmarks/loadtest.py --server asgi --workers 2 --concurrency 20 --duration 30
+    python benchmarks/loadtest.py --server gthread --workers 2 --threads 8 --rate 15 --duration 30
+    python benchmarks/loadtest.py --compare benchmarks/results/*.json
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlsplit
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = PROJECT_DIR / 'benchmarks' / 'results'
+# Questions reused by --repeat-ratio of the requests (answer cache hits after the first)
+REPEATED_QUESTIONS = [
+    'Who created the Red Queen?',
+    'What is the Hive?',
+    'Who is Alice?',
+    'What is the T-virus?',
+    'Who is Albert Wesker?',
+]
+# Seconds between memory samples of the server's processes
+MEMORY_SAMPLE_INTERVAL = 0.5
+REQUEST_TIMEOUT = 120
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(model, workers, threads, port):
+    if model == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', 'config.asgi:application', '--host', '127.0.0.1',
+                '--port', str(port), '--workers', str(workers), '--log-level', 'warning']
+    command = [sys.executable, '-m', 'gunicorn', 'config.wsgi:application', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--timeout', str(REQUEST_TIMEOUT), '--log-level', 'warning']
+    if model == 'gthread':
+        command += ['--worker-class', 'gthread', '--threads', str(threads)]
+    return command
+
+
+def start_server(args):
+    """Start the server for args.server offline; returns (process, base URL)"""
+    port = free_port()
+    state_dir = tempfile.mkdtemp(prefix='rq-loadtest-')
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'benchmarks.loadtest_settings',
+        'TEST_MODE': 'true',
+        'AI_STATE_DB': os.path.join(state_dir, 'ai_state.sqlite3'),
+        'MOCK_LLM_LATENCY': str(args.llm_latency),
+        'TTS_SYNTHETIC_LATENCY': str(args.tts_latency),
+        'ADMISSION_ENABLED': 'false',
+    }
+    process = subprocess.Popen(server_command(args.server, args.workers, args.threads, port),
+                               cwd=PROJECT_DIR, env=env, start_new_session=True)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited with status {process.returncode}")
+        try:
+            status, _ = get(url, '/ai/')
+            if status == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise SystemExit("Server did not become ready within 60s")
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=15)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def get(url, path):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+class Client:
+    """Sends chat requests, one keep-alive connection per thread"""
+
+    def __init__(self, url, repeat_ratio):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.repeat_ratio = repeat_ratio
+        self._local = threading.local()
+        self._counter = iter(range(sys.maxsize))
+        self._lock = threading.Lock()
+        self.results = []  # (finished at, latency, status or None, error)
+
+    def question(self):
+        if random.random() < self.repeat_ratio:
+            return random.choice(REPEATED_QUESTIONS)
+        with self._lock:
+            index = next(self._counter)
+        # A distinct question so the answer cache doesn't short-circuit the request
+        return f'Tell me about Umbrella facility #{index}'
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+        return conn
+
+    def send(self, started=None):
+        """One chat request; latency counts from `started` (default now)"""
+        started = time.perf_counter() if started is None else started
+        body = json.dumps({'question': self.question()})
+        status, error = None, None
+        try:
+            conn = self._connection()
+            conn.request('POST', '/ai/chat/', body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            if response.getheader('Connection', '').lower() == 'close':
+                self._reset()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            self._reset()
+        finished = time.perf_counter()
+        with self._lock:
+            self.results.append((finished, finished - started, status, error))
+
+    def _reset(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def run_closed_loop(client, concurrency, duration, total):
+    """`concurrency` clients sending back to back until duration or total is reached"""
+    stop_at = time.perf_counter() + duration
+    sent = iter(range(total)) if total else None
+    sent_lock = threading.Lock()
+
+    def worker():
+        while time.perf_counter() < stop_at:
+            if sent is not None:
+                with sent_lock:
+                    if next(sent, None) is None:
+                        return
+            client.send()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_open_loop(client, rate, duration, total, max_in_flight):
+    """Poisson arrivals at `rate` per second until duration or total is reached"""
+    started = time.perf_counter()
+    arrival = started
+    count = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        while arrival - started < duration and (not total or count < total):
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(client.send, arrival)
+            count += 1
+            arrival += random.expovariate(rate)
+
+
+def child_pids(pid):
+    children = []
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+        except OSError:
+            continue
+        # Fields after the parenthesised command name: state, ppid, ...
+        if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+            children.append(int(entry.name))
+    return children
+
+
+def rss_mb(pid):
+    try:
+        for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(server_pid):
+    """The processes serving requests: the server's children, or the server itself"""
+    workers = []
+    for pid in child_pids(server_pid):
+        try:
+            cmdline = Path(f'/proc/{pid}/cmdline').read_bytes()
+        except OSError:
+            continue
+        if b'resource_tracker' not in cmdline:  # multiprocessing's helper, not a worker
+            workers.append(pid)
+    return workers or [server_pid]
+
+
+class MemorySampler(threading.Thread):
+    """Peak and latest RSS of each worker process, sampled in the background"""
+
+    def __init__(self, server_pid):
+        super().__init__(daemon=True)
+        self.server_pid = server_pid
+        self.peak = {}
+        self.last = {}
+        self._done = threading.Event()
+
+    def run(self):
+        if not Path('/proc').is_dir():
+            return  # Only Linux exposes RSS this way
+        while not self._done.is_set():
+            for pid in worker_pids(self.server_pid):
+                rss = rss_mb(pid)
+                if rss is not None:
+                    self.last[pid] = rss
+                    self.peak[pid] = max(rss, self.peak.get(pid, 0.0))
+            self._done.wait(MEMORY_SAMPLE_INTERVAL)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def summary(self):
+        if not self.peak:
+            return None
+        workers = [{'pid': pid, 'peak_mb': round(self.peak[pid], 1), 'end_mb': round(self.last[pid], 1)}
+                   for pid in sorted(self.peak)]
+        peaks = [worker['peak_mb'] for worker in workers]
+        return {
+            'workers': workers,
+            'peak_per_worker_mb': max(peaks),
+            'mean_peak_per_worker_mb': round(sum(peaks) / len(peaks), 1),
+        }
+
+
+def summarize(results, wall, memory):
+    latencies = [latency for _, latency, status, _ in results if status is not None and status < 400]
+    statuses = {}
+    for _, _, status, error in results:
+        key = str(status) if status is not None else 'connection_error'
+        statuses[key] = statuses.get(key, 0) + 1
+    errors = sum(1 for _, _, status, _ in results if status is None or status >= 400)
+    summary = {
+        'requests': len(results),
+        'ok': len(results) - errors,
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4) if results else 0.0,
+        'statuses': statuses,
+        'duration_s': round(wall, 2),
+        'throughput_rps': round((len(results) - errors) / wall, 2) if wall else 0.0,
+        'latency_ms': None,
+        'memory': memory,
+    }
+    if latencies:
+        summary['latency_ms'] = {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 1),
+            **{f'p{pct}': round(percentile(latencies, pct) * 1000, 1) for pct in (50, 90, 99)},
+            'max': round(max(latencies) * 1000, 1),
+        }
+    sample_errors = [error for _, _, _, error in results if error]
+    if sample_errors:
+        summary['sample_error'] = sample_errors[0]
+    return summary
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=PROJECT_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def label(config):
+    model = config['server'] or 'external'
+    load = f"c{config['concurrency']}" if config['rate'] is None else f"r{config['rate']:g}"
+    shape = f"w{config['workers']}" + (f"t{config['threads']}" if model == 'gthread' else '')
+    return f"{model}-{shape}-{load}"
+
+
+def print_summary(name, summary):
+    latency = summary['latency_ms'] or {}
+    memory = summary['memory'] or {}
+    print(f"{name:<32} {summary['throughput_rps']:8.2f} req/s  "
+          f"p50 {latency.get('p50', float('nan')):8.1f} ms  p99 {latency.get('p99', float('nan')):8.1f} ms  "
+          f"errors {summary['error_rate'] * 100:5.1f}%  "
+          f"peak RSS/worker {memory.get('peak_per_worker_mb', float('nan')):7.1f} MB")
+
+
+def compare(paths):
+    for path in paths:
+        run = json.loads(Path(path).read_text())
+        name = f"{label(run['config'])} @{run.get('commit') or '?'}"
+        print_summary(name, run['results'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--server', choices=['sync', 'gthread', 'asgi'], help='Worker model to start')
+    parser.add_argument('--url', help='Drive an already running server instead (e.g. http://127.0.0.1:8000)')
+    parser.add_argument('--server-pid', type=int, help='With --url: server process whose workers to measure')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gthread worker')
+    parser.add_argument('--concurrency', type=int, default=10, help='Closed-loop clients')
+    parser.add_argument('--rate', type=float, help='Open-loop arrivals per second (instead of --concurrency)')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='Open-loop cap on outstanding requests')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many requests (0 = no limit)')
+    parser.add_argument('--repeat-ratio', type=float, default=0.0, help='Share of requests reusing a few questions')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='Seconds per MockLLM call')
+    parser.add_argument('--tts-latency', type=float, default=0.3, help='Seconds per synthetic TTS call')
+    parser.add_argument('--output', help='Results file (default: benchmarks/results/<label>-<commit>-<time>.json)')
+    parser.add_argument('--compare', nargs='+', metavar='RESULTS', help='Print saved results side by side')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare)
+        return
+    if bool(args.server) == bool(args.url):
+        parser.error('give either --server or --url')
+
+    process = None
+    if args.server:
+        process, url = start_server(args)
+        server_pid = process.pid
+    else:
+        url, server_pid = args.url.rstrip('/'), args.server_pid
+    config = {
+        'server': args.server, 'url': None if args.server else url, 'workers': args.workers,
+        'threads': args.threads if args.server == 'gthread' else None,
+        'concurrency': None if args.rate else args.concurrency, 'rate': args.rate,
+        'duration': args.duration, 'requests': args.requests or None, 'repeat_ratio': args.repeat_ratio,
+        'llm_latency': args.llm_latency if args.server else None,
+        'tts_latency': args.tts_latency if args.server else None,
+    }
+
+    sampler = MemorySampler(server_pid) if server_pid else None
+    client = Client(url, args.repeat_ratio)
+    try:
+        if sampler is not None:
+            sampler.start()
+        started = time.perf_counter()
+        if args.rate:
+            run_open_loop(client, args.rate, args.duration, args.requests, args.max_in_flight)
+        else:
+            run_closed_loop(client, args.concurrency, args.duration, args.requests)
+        wall = time.perf_counter() - started
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if process is not None:
+            stop_server(process)
+
+    commit, dirty = git_commit()
+    run = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': commit,
+        'dirty': dirty,
+        'python': sys.version.split()[0],
+        'config': config,
+        'results': summarize(client.results, wall, sampler.summary() if sampler else None),
+    }
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"{label(config)}-{commit or 'nogit'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(run, indent=2) + '\n')
+
+    print_summary(label(config), run['results'])
+    if run['results'].get('sample_error'):
+        print(f"  e.g. {run['results']['sample_error']}")
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+"""
+Django settings for servers started by benchmarks/loadtest.py.
+
+The project settings in TEST_MODE (MockLLM, with MOCK_LLM_LATENCY per call)
+with the offline "synthetic" TTS backend (TTS_SYNTHETIC_LATENCY per call), so
+a load test never touches the network.
+"""
+
+from config.settings import *  # noqa: F401,F403
+
+TTS_BACKEND = 'synthetic'
+# Quiet request logging: the load generator measures the requests
+LOGGING['loggers']['ai']['level'] = 'WARNING'  # noqa: F405
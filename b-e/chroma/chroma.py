@@ -5,6 +5,7 @@ import difflib
 from datetime import datetime
 from dotenv import load_dotenv
 from custom_console import COLOR_MAGENTA, COLOR_YELLOW, COLOR_GREEN, COLOR_CYAN, COLOR_RED, RESET_COLOR
+from embedding_cache import EmbeddingCache
 
 load_dotenv()
 
@@ -50,7 +51,8 @@ if os.path.exists(content_file):
 else:
     old_content = ""
 
-if old_content != history:
+changed = old_content != history
+if changed:
     # Compute diff
     diff = list(difflib.unified_diff(old_content.splitlines(keepends=True), history.splitlines(keepends=True), fromfile='old', tofile='new', lineterm=''))
     print(f"{COLOR_RED}Changes were made to document!{RESET_COLOR}")
@@ -61,13 +63,21 @@ if old_content != history:
             print(f"{COLOR_RED}{line.rstrip()}{RESET_COLOR}")
         else:
             print(line.rstrip())
+
+# Upsert on every run, not only when the text changed: the embedding cache makes
+# an unchanged history free to re-send (it is only embedded when its text is
+# new), and a collection that was recreated since the last run gets it back
+embedding_cache = EmbeddingCache()
+collection.upsert(
+    documents=[history],
+    embeddings=embedding_cache.embed([history]),
+    metadatas=[{"source": "red_queen_history.txt"}],
+    ids=["red_queen_1"]
+)
+print(f"{COLOR_CYAN}{embedding_cache.summary()}{RESET_COLOR}")
+
+if changed:
     print(f"{COLOR_GREEN}Document updated in collection successfully.{RESET_COLOR}")
-    # Update the collection
-    collection.upsert(
-        documents=[history],
-        metadatas=[{"source": "red_queen_history.txt"}],
-        ids=["red_queen_1"]
-    )
     # Retrieve and print collection data including embeddings
     collection_data = collection.get(include=["embeddings", "metadatas", "documents"])
     print(f"{COLOR_CYAN}\nCollection Data:{RESET_COLOR}")
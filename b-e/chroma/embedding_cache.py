@@ -0,0 +1,165 @@
+"""
+Content-hash keyed embedding cache for the ingestion scripts
+
+Re-running batch_fetch.py or chroma.py used to re-embed every chunk even when
+the wiki had barely changed. Vectors are now cached locally, keyed by
+(embedder id, sha256 of the normalized chunk text), so a run only computes
+embeddings for chunks that are new or whose text changed, and passes them to
+Chroma explicitly.
+
+Storage is one append-only binary file per embedder under embedding_cache/:
+
+    header:  b'RQEC' | version (u16) | dimensions (u32) | id length (u16) | embedder id (utf-8)
+    records: sha256 digest (32 bytes) | vector (dimensions x float32, little-endian)
+
+A record cut short by an interrupted run is dropped on load; a file whose
+header is truncated or corrupt is discarded and the cache starts empty.
+
+Usage:
+    cache = EmbeddingCache()  # Chroma's default embedder
+    embeddings = cache.embed(chunks)
+    collection.add(documents=chunks, embeddings=embeddings, ids=ids)
+    print(cache.summary())
+"""
+
+import hashlib
+import os
+import struct
+import sys
+from array import array
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_cache')
+
+MAGIC = b'RQEC'
+VERSION = 1
+HEADER = struct.Struct('<4sHIH')
+DIGEST_SIZE = 32
+
+# Chroma's DefaultEmbeddingFunction (ONNX all-MiniLM-L6-v2)
+DEFAULT_EMBEDDER_ID = 'chroma-default/all-MiniLM-L6-v2'
+
+
+def normalize(text):
+    """Whitespace-insensitive form of a chunk: runs of whitespace become one space"""
+    return ' '.join(text.split())
+
+
+def content_key(text):
+    return hashlib.sha256(normalize(text).encode('utf-8')).digest()
+
+
+def default_embedding_function():
+    from chromadb.utils import embedding_functions
+    return embedding_functions.DefaultEmbeddingFunction()
+
+
+class EmbeddingCache:
+    def __init__(self, embedding_function=None, embedder_id=DEFAULT_EMBEDDER_ID, cache_dir=CACHE_DIR):
+        """
+        embedding_function maps a list of texts to a list of vectors (any Chroma
+        embedding function works); embedder_id must change whenever it would
+        produce different vectors, e.g. a different model.
+        """
+        self.embedding_function = embedding_function
+        self.embedder_id = embedder_id
+        self.path = os.path.join(cache_dir, hashlib.sha256(embedder_id.encode('utf-8')).hexdigest()[:16] + '.bin')
+        self.dimensions = None
+        self.vectors = {}
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        header = self._read_header(data)
+        if header is None:
+            # Cut short before its header was complete, or not a cache file:
+            # start over as if it were missing
+            os.remove(self.path)
+            return
+        version, dimensions, id_length, embedder_id = header
+        if version != VERSION or embedder_id != self.embedder_id:
+            raise ValueError(f"{self.path} is not an embedding cache for '{self.embedder_id}'")
+        self.dimensions = dimensions
+        record_size = DIGEST_SIZE + 4 * dimensions
+        offset = HEADER.size + id_length
+        while offset + record_size <= len(data):
+            digest = data[offset:offset + DIGEST_SIZE]
+            vector = array('f')
+            vector.frombytes(data[offset + DIGEST_SIZE:offset + record_size])
+            if sys.byteorder == 'big':
+                vector.byteswap()
+            self.vectors[digest] = vector
+            offset += record_size
+        if offset < len(data):
+            # Drop the partial record so later appends stay aligned
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+
+    @staticmethod
+    def _read_header(data):
+        """(version, dimensions, id length, embedder id), or None if the header is truncated or corrupt"""
+        if len(data) < HEADER.size:
+            return None
+        magic, version, dimensions, id_length = HEADER.unpack_from(data)
+        if magic != MAGIC or dimensions == 0 or len(data) < HEADER.size + id_length:
+            return None
+        try:
+            embedder_id = data[HEADER.size:HEADER.size + id_length].decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        return version, dimensions, id_length, embedder_id
+
+    def _append(self, records):
+        """Persist new (digest, vector) records, writing the header on first use"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        new_file = not os.path.exists(self.path)
+        with open(self.path, 'ab') as f:
+            if new_file:
+                embedder_id = self.embedder_id.encode('utf-8')
+                f.write(HEADER.pack(MAGIC, VERSION, self.dimensions, len(embedder_id)) + embedder_id)
+            for digest, vector in records:
+                if sys.byteorder == 'big':
+                    vector = array('f', vector)
+                    vector.byteswap()
+                f.write(digest + vector.tobytes())
+
+    def embed(self, texts):
+        """Vectors for texts (as lists of floats), computing only the uncached ones"""
+        keys = [content_key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self.vectors or key in missing:
+                self.hits += 1
+            else:
+                missing[key] = text
+        self.misses += len(missing)
+
+        if missing:
+            if self.embedding_function is None:
+                self.embedding_function = default_embedding_function()
+            computed = self.embedding_function(list(missing.values()))
+            records = []
+            for key, vector in zip(missing, computed):
+                vector = array('f', [float(value) for value in vector])
+                if self.dimensions is None:
+                    self.dimensions = len(vector)
+                elif len(vector) != self.dimensions:
+                    raise ValueError(f"Embedder '{self.embedder_id}' returned {len(vector)} dimensions, "
+                                     f"cache holds {self.dimensions}")
+                self.vectors[key] = vector
+                records.append((key, vector))
+            self._append(records)
+
+        return [self.vectors[key].tolist() for key in keys]
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def summary(self):
+        return (f"Embedding cache: {self.hits} hits, {self.misses} computed "
+                f"({self.hit_rate():.1%} hit rate, {len(self.vectors)} vectors cached)")
@@ -7,6 +7,7 @@ and stores them in ChromaDB for RAG purposes.
 Features:
 - Fetches raw wiki content from all URLs in all_urls array
 - Stores content in ChromaDB with metadata
+- Reuses cached embeddings for chunks whose text hasn't changed (embedding_cache.py)
 - Handles errors gracefully
 - Provides progress tracking
 
@@ -25,10 +26,12 @@ from dotenv import load_dotenv
 
 # Add path to custom modules
 sys.path.append('../../')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 from custom_console import (
     COLOR_MAGENTA, COLOR_WHITE, COLOR_YELLOW, COLOR_BLUE,
     COLOR_RED, COLOR_GREEN, COLOR_CYAN, RESET_COLOR
 )
+from embedding_cache import EmbeddingCache
 
 # Load URLs from JSON
 URLS_FILE = os.path.join(os.path.dirname(__file__), 'urls', 'urls.json')
@@ -60,7 +63,7 @@ def chunk_text(text, chunk_size=4000):
         chunks.append(text[i:i + chunk_size])
     return chunks
 
-def store_in_chromadb(url, content, collection):
+def store_in_chromadb(url, content, collection, embedding_cache):
     """Store content in ChromaDB with metadata, chunking large documents."""
     if not content:
         return
@@ -75,31 +78,31 @@ def store_in_chromadb(url, content, collection):
     if len(content) > 4000:
         chunks = chunk_text(content, chunk_size=4000)
         print(f"{COLOR_YELLOW}Chunking document into {len(chunks)} parts{RESET_COLOR}")
-        
-        for i, chunk in enumerate(chunks):
-            doc_id = f"{base_doc_id}_chunk_{i}"
-            collection.add(
-                documents=[chunk],
-                metadatas=[{
-                    'url': url,
-                    'title': title,
-                    'source': 'resident_evil_wiki',
-                    'chunk': i,
-                    'total_chunks': len(chunks)
-                }],
-                ids=[doc_id]
-            )
+        ids = [f"{base_doc_id}_chunk_{i}" for i in range(len(chunks))]
+        metadatas = [{
+            'url': url,
+            'title': title,
+            'source': 'resident_evil_wiki',
+            'chunk': i,
+            'total_chunks': len(chunks)
+        } for i in range(len(chunks))]
     else:
         # Single document
-        collection.add(
-            documents=[content],
-            metadatas=[{
-                'url': url,
-                'title': title,
-                'source': 'resident_evil_wiki'
-            }],
-            ids=[base_doc_id]
-        )
+        chunks = [content]
+        ids = [base_doc_id]
+        metadatas = [{
+            'url': url,
+            'title': title,
+            'source': 'resident_evil_wiki'
+        }]
+
+    # Only new or changed chunks are embedded; the rest come from the cache
+    collection.add(
+        documents=chunks,
+        embeddings=embedding_cache.embed(chunks),
+        metadatas=metadatas,
+        ids=ids
+    )
 
 def main():
     """Main batch processing function."""
@@ -126,6 +129,9 @@ def main():
     collection = client.create_collection(name=collection_name)
     print(f"{COLOR_GREEN}Created fresh collection '{collection_name}'{RESET_COLOR}")
 
+    # Recreating the collection no longer means re-embedding every chunk
+    embedding_cache = EmbeddingCache()
+
     processed = 0
     errors = 0
     error_log = []  # Track all errors
@@ -139,7 +145,7 @@ def main():
 
         if content:
             # Store in ChromaDB
-            store_in_chromadb(url, content, collection)
+            store_in_chromadb(url, content, collection, embedding_cache)
             processed += 1
             print(f"{COLOR_GREEN}✓ Stored content for {url.split('/')[-1]}{RESET_COLOR}")
         else:
@@ -157,6 +163,7 @@ def main():
     print(f"{COLOR_RED}Errors: {errors}{RESET_COLOR}")
     print(f"{COLOR_BLUE}Total documents in collection: {collection.count()}{RESET_COLOR}")
     print(f"{COLOR_CYAN}Total time: {total_time:.1f} seconds{RESET_COLOR}")
+    print(f"{COLOR_CYAN}{embedding_cache.summary()}{RESET_COLOR}")
 
     # Write error log if there were errors
     if error_log:
@@ -169,7 +176,8 @@ def main():
             f.write(f"Total URLs processed: {len(ALL_URLS)}\n")
             f.write(f"Successfully processed: {processed}\n")
             f.write(f"Errors encountered: {errors}\n")
-            f.write(f"Total time: {total_time:.1f} seconds\n\n")
+            f.write(f"Total time: {total_time:.1f} seconds\n")
+            f.write(f"{embedding_cache.summary()}\n\n")
             f.write("Error Details:\n")
             f.write("-" * 30 + "\n")
             for error in error_log:
@@ -24,7 +24,111 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
 SYSTEM_PROMPT_PATH = BASE_DIR / 'system_prompt.txt'
 TEST_MODE = os.environ.get("TEST_MODE", "false").lower() == "true"
+# Seconds each MockLLM call takes in TEST_MODE (load tests, see benchmarks/loadtest.py)
+MOCK_LLM_LATENCY = float(os.environ.get("MOCK_LLM_LATENCY", 0))
 PROD_API_URL = os.environ.get("PROD_API_URL", "")
+# 'asgi' when served through config/asgi.py (set there), otherwise 'wsgi'
+SERVER_INTERFACE = os.environ.get("DJANGO_SERVER_INTERFACE", "wsgi")
+
+# State shared by all worker processes (answer cache, counters) in one SQLite file
+AI_STATE_DB = Path(os.environ.get("AI_STATE_DB", BASE_DIR / 'ai_state.sqlite3'))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 24 * 60 * 60))  # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 500))
+SPEECH_CACHE_TTL = int(os.environ.get("SPEECH_CACHE_TTL", ANSWER_CACHE_TTL))  # seconds
+SPEECH_CACHE_MAX_ENTRIES = int(os.environ.get("SPEECH_CACHE_MAX_ENTRIES", ANSWER_CACHE_MAX_ENTRIES))
+
+# Generated speech (ai/generated_audio) is evicted least-recently-used beyond these budgets
+AUDIO_STORE_MAX_BYTES = int(os.environ.get("AUDIO_STORE_MAX_BYTES", 200 * 1024 * 1024))
+AUDIO_STORE_MAX_AGE = int(os.environ.get("AUDIO_STORE_MAX_AGE", 7 * 24 * 60 * 60))  # seconds
+AUDIO_STORE_EVICT_INTERVAL = int(os.environ.get("AUDIO_STORE_EVICT_INTERVAL", 60))  # seconds
+# Write clips to disk on a background thread, serving them from memory meanwhile
+AUDIO_STORE_ASYNC_WRITES = os.environ.get("AUDIO_STORE_ASYNC_WRITES", "true").lower() == "true"
+
+# TTS engine (ai/tts_engine.py): concurrent edge-tts calls per worker, per-call
+# deadline, and when to send a hedged duplicate of a slow call
+TTS_POOL_SIZE = int(os.environ.get("TTS_POOL_SIZE", 8))
+TTS_DEADLINE = float(os.environ.get("TTS_DEADLINE", 20))  # seconds
+TTS_HEDGE_PERCENTILE = float(os.environ.get("TTS_HEDGE_PERCENTILE", 95))
+TTS_HEDGE_DELAY = float(os.environ.get("TTS_HEDGE_DELAY", 3))  # seconds, until enough calls are measured
+# Speech backend (ai/tts_backends.py): "edge" (edge-tts, online) or "synthetic"
+# (offline silent MP3 with plausible word timings, after a configurable delay)
+TTS_BACKEND = os.environ.get("TTS_BACKEND", "edge")
+TTS_SYNTHETIC_LATENCY = float(os.environ.get("TTS_SYNTHETIC_LATENCY", 0))  # seconds per call
+TTS_SYNTHETIC_CHAR_LATENCY = float(os.environ.get("TTS_SYNTHETIC_CHAR_LATENCY", 0))  # extra seconds per character
+
+# LLM routing (ai/llm_router.py): overall deadline per call, time each model gets
+# before failing over to the next, and how long failing or slow models are demoted
+LLM_FALLBACK = os.environ.get("LLM_FALLBACK", "true").lower() == "true"
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 40))  # seconds
+LLM_ATTEMPT_TIMEOUT = float(os.environ.get("LLM_ATTEMPT_TIMEOUT", 20))  # seconds
+LLM_FAILURE_COOLDOWN = float(os.environ.get("LLM_FAILURE_COOLDOWN", 30))  # seconds, after a timeout
+LLM_QUOTA_COOLDOWN = float(os.environ.get("LLM_QUOTA_COOLDOWN", 300))  # seconds, after 429 / RESOURCE_EXHAUSTED
+LLM_SLOW_LATENCY = float(os.environ.get("LLM_SLOW_LATENCY", 10))  # seconds (p95 of recent calls)
+
+# Retries and circuit breakers (ai/resilience.py): tries per LLM call and the
+# full-jitter backoff between them; a breaker opens for BREAKER_OPEN_SECONDS once
+# BREAKER_MIN_CALLS calls in the last BREAKER_WINDOW failed at BREAKER_ERROR_RATE
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", 3))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", 1))  # seconds
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 8))  # seconds
+BREAKER_ERROR_RATE = float(os.environ.get("BREAKER_ERROR_RATE", 0.5))
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", 60))  # seconds
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", 5))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", 30))
+
+# Admission control (ai/admission.py): per-IP and per-session token buckets, and
+# a global budget that spreads the daily Gemini quota (0 = unlimited) over the day.
+# Off by default in TEST_MODE, where the mock LLM has no quota
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "false" if TEST_MODE else "true").lower() == "true"
+ADMISSION_CLIENT_RATE = float(os.environ.get("ADMISSION_CLIENT_RATE", 6))  # requests per minute
+ADMISSION_CLIENT_BURST = float(os.environ.get("ADMISSION_CLIENT_BURST", 3))
+LLM_DAILY_QUOTA = int(os.environ.get("LLM_DAILY_QUOTA", 250))  # requests per day
+ADMISSION_GLOBAL_BURST = float(os.environ.get("ADMISSION_GLOBAL_BURST", 10))
+ADMISSION_MAX_WAIT = float(os.environ.get("ADMISSION_MAX_WAIT", 2))  # seconds queued before rejecting instead
+# Take the client IP from X-Forwarded-For (only behind a proxy that sets it)
+ADMISSION_TRUST_FORWARDED = os.environ.get("ADMISSION_TRUST_FORWARDED", "false").lower() == "true"
+
+# Gemini context caching of the system prompt (ai/context_cache.py)
+LLM_CONTEXT_CACHE = os.environ.get("LLM_CONTEXT_CACHE", "true").lower() == "true"
+LLM_CONTEXT_CACHE_TTL = int(os.environ.get("LLM_CONTEXT_CACHE_TTL", 60 * 60))  # seconds
+
+# Retrieval (ai/retrieval.py): top-k wiki chunks from the local Chroma index are
+# added to the prompt, unless the query takes longer than the budget
+RAG_ENABLED = os.environ.get("RAG_ENABLED", "true").lower() == "true"
+RAG_CHROMA_PATH = Path(os.environ.get("RAG_CHROMA_PATH", BASE_DIR / 'chroma' / 'red_queen_knowledge' / 'chroma_db'))
+RAG_COLLECTION = os.environ.get("RAG_COLLECTION", "resident_evil_knowledge")
+RAG_TOP_K = int(os.environ.get("RAG_TOP_K", 3))
+RAG_BUDGET_MS = float(os.environ.get("RAG_BUDGET_MS", 150))
+RAG_MAX_CHUNK_CHARS = int(os.environ.get("RAG_MAX_CHUNK_CHARS", 1200))
+
+# Conversation memory (ai/conversation.py): history sent with each prompt is at
+# most this many recent turns plus a rolling summary, within the token budget
+CONVERSATION_MAX_TURNS = int(os.environ.get("CONVERSATION_MAX_TURNS", 6))
+CONVERSATION_TOKEN_BUDGET = int(os.environ.get("CONVERSATION_TOKEN_BUDGET", 1500))  # summary + recent turns
+CONVERSATION_SUMMARY_TOKENS = int(os.environ.get("CONVERSATION_SUMMARY_TOKENS", 300))
+CONVERSATION_TTL = int(os.environ.get("CONVERSATION_TTL", 7 * 24 * 60 * 60))  # seconds since the last turn
+
+# Logging (ai/structured_logging.py): JSON lines written by a background thread;
+# bulky per-request fields are kept for a LOG_SAMPLE_RATE fraction of requests
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", 0.01))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample_verbose': {'()': 'ai.structured_logging.VerboseSampler', 'rate': LOG_SAMPLE_RATE},
+    },
+    'handlers': {
+        'background': {
+            'class': 'ai.structured_logging.BackgroundQueueHandler',
+            'filters': ['sample_verbose'],
+            'stream': 'ext://sys.stdout',
+        },
+    },
+    'loggers': {
+        'ai': {'handlers': ['background'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+}
 
 # CORS settings - Allow both development and production origins
 CORS_ALLOWED_ORIGINS = [
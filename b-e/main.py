@@ -7,26 +7,21 @@ from google_llm_init import llm, log_api_usage
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 import custom_console
-from datetime import datetime
 from ai.utils import clean_wiki_markup
+from ai.prompt_template import render_prompt
 
 # Set up Gemini as the LLM
 Settings.llm = llm
 
+SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "system_prompt.txt")
+
 # Load system prompt
 def load_system_prompt():
-    """Load the system prompt from file"""
-    system_prompt_path = "system_prompt.txt"
-    try:
-        with open(system_prompt_path, "r", encoding="utf-8") as f:
-            prompt = f.read()
-        # Replace date placeholder
-        current_date = datetime.now().strftime('%Y-%m-%d')
-        prompt = prompt.replace('{current_date}', current_date)
-        return prompt
-    except FileNotFoundError:
+    """Load the system prompt (same cached template as the Django app)"""
+    prompt = render_prompt(SYSTEM_PROMPT_PATH)
+    if prompt is None:
         print(f"{custom_console.COLOR_YELLOW}⚠️  System prompt file not found. Using default behavior.{custom_console.RESET_COLOR}")
-        return None
+    return prompt
 
 def chat_with_gemini():
     """Interactive chat function with Gemini"""
@@ -24,16 +24,39 @@ interface Message {
   role: 'user' | 'assistant';
   content: string;
   isLoading?: boolean;
+  turn?: number; // The backend's number for this question's turn in its conversation history
 }
 
 interface ChatSession {
   id: string;
+  // Random id the backend keys this chat's conversation memory by; unlike id
+  // (a timestamp) it can't be guessed, so nobody else can read that memory
+  memoryId: string;
   name: string;
   messages: Message[];
   createdAt: string;
 }
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+const MAX_CHAT_ATTEMPTS = 3;
+// Longer retry_after waits (e.g. the daily budget is spent) are shown as errors instead
+const MAX_RETRY_WAIT_SECONDS = 30;
+
+// POST to /ai/chat/, waiting out the backend's retry_after (503 retry, 429 rate
+// limit) between attempts; the backend does not sleep between LLM retries itself
+async function postChat(payload: Record<string, unknown>): Promise<Response> {
+  for (let attempt = 0; ; attempt++) {
+    const response = await fetch(`${API_BASE_URL}/ai/chat/`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ...payload, attempt }),
+    });
+    if (![429, 503].includes(response.status) || attempt + 1 >= MAX_CHAT_ATTEMPTS) return response;
+    const data = await response.clone().json().catch(() => null);
+    if (typeof data?.retry_after !== 'number' || data.retry_after > MAX_RETRY_WAIT_SECONDS) return response;
+    await new Promise(resolve => setTimeout(resolve, data.retry_after * 1000));
+  }
+}
 
 // Optimized Input component with memoization
 const MemoizedInput = memo(React.forwardRef<HTMLInputElement, React.InputHTMLAttributes<HTMLInputElement>>((props, ref) => {
@@ -161,8 +184,15 @@ export default function Chat() {
     const stored = localStorage.getItem('chatSessions');
     if (stored) {
       try {
-        const parsed: ChatSession[] = JSON.parse(stored);
-        setSessions(parsed);
+        const storedSessions: ChatSession[] = JSON.parse(stored);
+        // Chats saved before memoryId existed get one (the backend refuses timestamp
+        // ids), starting a fresh memory, so their turn numbers no longer apply
+        const parsed = storedSessions.map(s => s.memoryId ? s : {
+          ...s,
+          memoryId: crypto.randomUUID(),
+          messages: s.messages.map(({ turn, ...message }) => message),
+        });
+        saveSessions(parsed);
         // Try to get current session ID from localStorage, fallback to first session
         const storedCurrentId = localStorage.getItem('currentSessionId');
         const currentId = (storedCurrentId && parsed.find(s => s.id === storedCurrentId)) 
@@ -191,6 +221,7 @@ export default function Chat() {
   const createNewSession = () => {
     const newSession: ChatSession = {
       id: Date.now().toString(),
+      memoryId: crypto.randomUUID(),
       name: `Chat ${sessions.length + 1}`,
       messages: [{ role: 'assistant', content: 'Hello! How can I help you today?' }],
       createdAt: new Date().toISOString(),
@@ -339,21 +370,20 @@ export default function Chat() {
     });
 
     try {
-      const response = await fetch(`${API_BASE_URL}/ai/chat/`, {
+      // Replay only needs speech: the server reuses the audio it already voiced for this text
+      const response = await fetch(`${API_BASE_URL}/ai/speak/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ question: message.content }),
+        body: JSON.stringify({ text: message.content }),
       });
 
       const contentType = response.headers.get('content-type');
       if (contentType && contentType.includes('application/json')) {
         const data = await response.json();
 
-        if (data.text && data.audio) {
-          const audioData = Uint8Array.from(atob(data.audio), c => c.charCodeAt(0));
-          const audioBlob = new Blob([audioData], { type: 'audio/mpeg' });
-          const audioUrl = URL.createObjectURL(audioBlob);
-          const audio = new Audio(audioUrl);
+        if (data.text && data.audio_url) {
+          // Audio is served as raw, cacheable bytes from a content-addressed URL
+          const audio = new Audio(`${API_BASE_URL}${data.audio_url}`);
           setCurrentAudio(audio);
           setCurrentPlayingMessageIndex(messageIndex);
 
@@ -452,7 +482,6 @@ export default function Chat() {
             setIsTalking(false);
             setIsAudioPlaying(false);
             setCurrentPlayingMessageIndex(null);
-            URL.revokeObjectURL(audioUrl);
             setCurrentAudio(null);
           });
 
@@ -478,10 +507,12 @@ export default function Chat() {
   const saveEdit = async (messageIndex: number) => {
     if (!currentSession || !editValue.trim()) return;
 
-    // Add the edited text as a new user message at the end
+    // The edited text replaces the question and everything after it, here and in
+    // the backend's history (from the first of those turns the backend remembered)
+    const replacesTurn = currentSession.messages.slice(messageIndex).find(m => m.turn !== undefined)?.turn;
     const userMessage: Message = { role: 'user', content: editValue.trim() };
     const loadingMessage: Message = { role: 'assistant', content: '', isLoading: true };
-    const updatedMessages = [...currentSession.messages, userMessage, loadingMessage];
+    let updatedMessages = [...currentSession.messages.slice(0, messageIndex), userMessage, loadingMessage];
     const updatedSession = { ...currentSession, messages: updatedMessages };
     const updatedSessions = sessions.map(s => s.id === currentSessionId ? updatedSession : s);
     saveSessions(updatedSessions);
@@ -506,26 +537,22 @@ export default function Chat() {
 
     try {
 
-      const response = await fetch(`${API_BASE_URL}/ai/chat/`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ question: editValue.trim() }),
-      });
+      const response = await postChat({ question: editValue.trim(), session_id: currentSession.memoryId, replaces_turn: replacesTurn });
       
       // Check if response is JSON with text and audio
       const contentType = response.headers.get('content-type');
       if (contentType && contentType.includes('application/json')) {
         const data = await response.json();
+        if (typeof data.turn === 'number') {
+          updatedMessages = [...updatedMessages.slice(0, -2), { ...userMessage, turn: data.turn }, loadingMessage];
+        }
         
         console.log('Backend response data:', data);
         console.log('Word timings received:', data.word_timings);
         
-        if (data.text && data.audio) {
-          // Handle text and audio response
-          const audioData = Uint8Array.from(atob(data.audio), c => c.charCodeAt(0));
-          const audioBlob = new Blob([audioData], { type: 'audio/mpeg' });
-          const audioUrl = URL.createObjectURL(audioBlob);
-          const audio = new Audio(audioUrl); setCurrentAudio(audio); // Track current audio for stopping
+        if (data.text && data.audio_url) {
+          // Handle text and audio response (audio is streamed from its content-addressed URL)
+          const audio = new Audio(`${API_BASE_URL}${data.audio_url}`); setCurrentAudio(audio); // Track current audio for stopping
           
           // Use precise word timings from backend
           const wordTimings = data.word_timings || [];
@@ -696,7 +723,7 @@ export default function Chat() {
             
             // Clean up
             audio.removeEventListener('timeupdate', () => {});
-            URL.revokeObjectURL(audioUrl); setCurrentAudio(null); // Clear current audio reference
+            setCurrentAudio(null); // Clear current audio reference
             
             setIsTalking(false);
           };
@@ -746,7 +773,7 @@ export default function Chat() {
 
     const userMessage: Message = { role: 'user', content: inputValue };
     const loadingMessage: Message = { role: 'assistant', content: '', isLoading: true };
-    const updatedMessages = [...currentSession.messages, userMessage, loadingMessage];
+    let updatedMessages = [...currentSession.messages, userMessage, loadingMessage];
     const updatedSession = { ...currentSession, messages: updatedMessages };
     const updatedSessions = sessions.map(s => s.id === currentSessionId ? updatedSession : s);
     saveSessions(updatedSessions);
@@ -769,23 +796,19 @@ export default function Chat() {
     }, 100);
 
     try {
-      const response = await fetch(`${API_BASE_URL}/ai/chat/`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ question: inputValue }),
-      });
+      const response = await postChat({ question: inputValue, session_id: currentSession.memoryId });
 
       // Check if response is JSON
       const contentType = response.headers.get('content-type');
       if (contentType && contentType.includes('application/json')) {
         const data = await response.json();
+        if (typeof data.turn === 'number') {
+          updatedMessages = [...updatedMessages.slice(0, -2), { ...userMessage, turn: data.turn }, loadingMessage];
+        }
 
-        if (data.text && data.audio) {
-          // Handle text and audio response
-          const audioData = Uint8Array.from(atob(data.audio), c => c.charCodeAt(0));
-          const audioBlob = new Blob([audioData], { type: 'audio/mpeg' });
-          const audioUrl = URL.createObjectURL(audioBlob);
-          const audio = new Audio(audioUrl); setCurrentAudio(audio); // Track current audio for stopping
+        if (data.text && data.audio_url) {
+          // Handle text and audio response (audio is streamed from its content-addressed URL)
+          const audio = new Audio(`${API_BASE_URL}${data.audio_url}`); setCurrentAudio(audio); // Track current audio for stopping
           const messageIndex = currentSession.messages.length - 1;
           
           // Use precise word timings from backend
@@ -957,7 +980,7 @@ export default function Chat() {
             
             // Clean up
             audio.removeEventListener('timeupdate', () => {});
-            URL.revokeObjectURL(audioUrl); setCurrentAudio(null); // Clear current audio reference
+            setCurrentAudio(null); // Clear current audio reference
             
             setCurrentPlayingMessageIndex(null);
             setIsTalking(false);